@@ -0,0 +1,25 @@
+"""Composite index for the inventory device list
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-18
+
+Covers the list endpoint filter on customer_id and its ORDER BY name, id.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '002'
+down_revision: Union[str, None] = '001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_inventory_list', 'inventory_devices', ['customer_id', 'name', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_inventory_list', table_name='inventory_devices')
@@ -0,0 +1,28 @@
+"""Composite per-customer indexes for inventory scans and stats
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18
+
+(customer_id, primary_ip) serves the duplicate-IP checks and the batch port
+scan; (customer_id, device_type, status) covers the grouped stats query.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '003'
+down_revision: Union[str, None] = '002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_inventory_customer_ip', 'inventory_devices', ['customer_id', 'primary_ip'])
+    op.create_index('idx_inventory_customer_type_status', 'inventory_devices', ['customer_id', 'device_type', 'status'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_inventory_customer_type_status', table_name='inventory_devices')
+    op.drop_index('idx_inventory_customer_ip', table_name='inventory_devices')
@@ -0,0 +1,26 @@
+"""Index inventory devices by credential
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18
+
+(credential_id, primary_ip) lets the MikroTik credential endpoints find the
+device IP for a credential from the index alone.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '004'
+down_revision: Union[str, None] = '003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_inventory_credential', 'inventory_devices', ['credential_id', 'primary_ip'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_inventory_credential', table_name='inventory_devices')
@@ -12,28 +12,60 @@ import os
 from loguru import logger
 
 
-def _read_env_file(env_path: str = ".env") -> dict:
-    """Legge il file .env e ritorna un dizionario"""
+# .env già letti: path -> ((mtime_ns, size), variabili). Il middleware lo consulta
+# a ogni richiesta: il file viene riletto solo quando cambia
+_env_cache: dict = {}
+
+
+def _env_stamp(env_path: str) -> Optional[tuple]:
+    """Firma (mtime_ns, size) del file, None se non esiste"""
+    try:
+        st = os.stat(env_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def invalidate_env_cache(env_path: Optional[str] = None) -> None:
+    """Scarta la copia in cache di env_path (o di tutti i file) dopo una scrittura"""
+    if env_path is None:
+        _env_cache.clear()
+    else:
+        _env_cache.pop(env_path, None)
+
+
+def read_env_file(env_path: str = ".env") -> dict:
+    """Legge il file .env e ritorna un dizionario (copia, modificabile dal chiamante)"""
+    stamp = _env_stamp(env_path)
+    cached = _env_cache.get(env_path)
+    if cached is not None and cached[0] == stamp:
+        return dict(cached[1])
+    
     env_vars = {}
-    if os.path.exists(env_path):
+    if stamp is not None:
+        # File piccolo: lettura unica, una partition per riga
         with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    env_vars[key.strip()] = value.strip().strip('"').strip("'")
-    return env_vars
+            lines = f.read().splitlines()
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            key, sep, value = line.partition("=")
+            if sep:
+                env_vars[key.strip()] = value.strip().strip('"').strip("'")
+    _env_cache[env_path] = (stamp, env_vars)
+    return dict(env_vars)
 
 
 def is_auth_enabled() -> bool:
     """Verifica se l'autenticazione è abilitata"""
-    env_vars = _read_env_file()
+    env_vars = read_env_file()
     return env_vars.get("AUTH_ENABLED", "false").lower() == "true"
 
 
 def verify_password(password: str) -> bool:
     """Verifica la password dell'admin"""
-    env_vars = _read_env_file()
+    env_vars = read_env_file()
     stored_hash = env_vars.get("ADMIN_PASSWORD_HASH", "")
     salt = env_vars.get("ADMIN_PASSWORD_SALT", "")
     
@@ -47,7 +79,7 @@ def verify_password(password: str) -> bool:
 
 def get_admin_username() -> str:
     """Ottiene lo username dell'admin"""
-    env_vars = _read_env_file()
+    env_vars = read_env_file()
     return env_vars.get("ADMIN_USERNAME", "admin")
 
 
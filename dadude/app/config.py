@@ -51,6 +51,9 @@ class Settings(BaseSettings):
     poll_interval: int = Field(default=60, description="Device poll interval (seconds)")
     full_sync_interval: int = Field(default=300, description="Full sync interval (seconds)")
     connection_timeout: int = Field(default=30, description="Connection timeout (seconds)")
+    auto_detect_max_concurrency: int = Field(default=5, description="Max concurrent devices in auto-detect batch")
+    port_scan_max_concurrency: int = Field(default=20, description="Max concurrent devices in batch port scan")
+    blocking_io_threads: int = Field(default=64, description="Worker threads for blocking I/O (RouterOS API, SSH) run via asyncio.to_thread")
 
     # Logging
     log_level: str = Field(default="INFO", description="Log level")
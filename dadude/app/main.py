@@ -6,6 +6,7 @@ Permette di esporre i dati di The Dude come API REST
 per applicazioni esterne di monitoraggio.
 """
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -70,6 +71,11 @@ async def lifespan(app: FastAPI):
     logger.info("DaDude - The Dude MikroTik Connector")
     logger.info("=" * 60)
     
+    # Executor di default per asyncio.to_thread: le chiamate RouterOS/SSH bloccanti
+    # restano in thread per tutta la round trip, il default (cpu + 4) le serializza
+    io_executor = ThreadPoolExecutor(max_workers=settings.blocking_io_threads, thread_name_prefix="dadude-io")
+    asyncio.get_running_loop().set_default_executor(io_executor)
+    
     # Crea directory necessarie
     Path("./data").mkdir(exist_ok=True)
     Path("./logs").mkdir(exist_ok=True)
@@ -129,6 +135,13 @@ async def lifespan(app: FastAPI):
     dude = get_dude_service()
     dude.disconnect()
     
+    # Chiudi connessioni API RouterOS in pool
+    from .services.mikrotik_service import get_mikrotik_service
+    get_mikrotik_service().close_connections()
+    
+    # Non attendere le chiamate bloccanti ancora in corso; quelle in coda vengono annullate
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    
     logger.info("DaDude shutdown complete")
 
 
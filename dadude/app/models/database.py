@@ -4,7 +4,7 @@ Modelli SQLAlchemy per persistenza dati
 """
 from sqlalchemy import (
     Column, String, Integer, Boolean, Text, DateTime, ForeignKey,
-    JSON, UniqueConstraint, Index, create_engine
+    JSON, UniqueConstraint, Index, create_engine, event
 )
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
 from sqlalchemy.sql import func
@@ -479,10 +479,37 @@ class DiscoveredDevice(Base):
     )
 
 
+# PRAGMA applicati a ogni connessione SQLite: WAL per non bloccare i lettori
+# durante le scritture, cache di pagine più ampia e temporanei in memoria
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MB
+    "PRAGMA mmap_size=268435456",  # 256 MB
+)
+
+
+def enable_sqlite_pragmas(engine):
+    """Registra i PRAGMA SQLite sulle nuove connessioni dell'engine (no-op per altri DB)"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        try:
+            for pragma in _SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
 # Database setup (legacy sync mode - for backward compatibility)
-def init_db(database_url: str = None):
+def init_db(database_url: str = None, **engine_kwargs):
     """
     Inizializza database e crea tabelle (legacy sync mode).
+    engine_kwargs sono passati a create_engine (es. opzioni del pool).
     For v2.0, use database_v2.py functions instead.
     """
     if database_url is None:
@@ -490,7 +517,8 @@ def init_db(database_url: str = None):
         settings = get_settings()
         database_url = settings.database_url_sync_computed
 
-    engine = create_engine(database_url, echo=False, pool_pre_ping=True)
+    engine = create_engine(database_url, echo=False, pool_pre_ping=True, **engine_kwargs)
+    enable_sqlite_pragmas(engine)
     Base.metadata.create_all(engine)
     return engine
 
@@ -501,6 +529,61 @@ def get_session(engine):
     return Session()
 
 
+# Engine e sessionmaker condivisi (legacy sync mode): creati una sola volta,
+# così le richieste riusano il pool di connessioni invece di ricrearlo
+_engine = None
+_SessionLocal = None
+
+
+def get_engine():
+    """Engine condiviso, inizializzato al primo utilizzo"""
+    global _engine, _SessionLocal
+    if _engine is None:
+        from ..config import get_settings
+        settings = get_settings()
+        pool_kwargs = {}
+        if not settings.is_sqlite:
+            # Pool condiviso tra le richieste: LIFO per lasciar scadere le connessioni
+            # in overflow inutilizzate, recycle contro i timeout di inattività del server
+            pool_kwargs = {
+                "pool_size": settings.db_pool_size,
+                "max_overflow": settings.db_max_overflow,
+                "pool_timeout": settings.db_pool_timeout,
+                "pool_recycle": settings.db_pool_recycle,
+                "pool_use_lifo": True,
+            }
+        _engine = init_db(**pool_kwargs)
+        _SessionLocal = sessionmaker(bind=_engine, expire_on_commit=False)
+    return _engine
+
+
+def get_shared_session():
+    """Nuova sessione dal sessionmaker condiviso (va chiusa dal chiamante)"""
+    get_engine()
+    return _SessionLocal()
+
+
+def get_db():
+    """Dependency FastAPI: sessione dal sessionmaker condiviso, chiusa a fine richiesta"""
+    db = get_shared_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Dependency FastAPI async: AsyncSession dal motore async condiviso
+    (database_v2), per endpoint che non devono bloccare l'event loop.
+    """
+    from .database_v2 import get_async_session_factory
+    get_engine()  # Crea le tabelle al primo utilizzo, come get_db
+    # Commit esplicito negli endpoint; la chiusura annulla quanto non committato
+    async with get_async_session_factory()() as session:
+        yield session
+
+
 # Type alias for JSON columns (uses JSONB on PostgreSQL for better performance)
 def get_json_type():
     """Get appropriate JSON type for current database"""
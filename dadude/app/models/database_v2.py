@@ -11,7 +11,7 @@ from sqlalchemy.pool import QueuePool, NullPool
 from loguru import logger
 
 from ..config import get_settings
-from .database import Base
+from .database import Base, enable_sqlite_pragmas
 
 # Global engine instances
 _async_engine = None
@@ -47,6 +47,7 @@ def get_async_engine():
             poolclass=pool_class,
             **pool_kwargs
         )
+        enable_sqlite_pragmas(_async_engine.sync_engine)
 
         logger.info(f"Async database engine created: {settings.database_url.split('@')[-1] if '@' in settings.database_url else 'local'}")
 
@@ -6,6 +6,7 @@ from sqlalchemy import (
     Column, String, Integer, Float, Boolean, DateTime, Text, JSON,
     ForeignKey, Index, Enum as SQLEnum
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from enum import Enum
@@ -87,7 +88,8 @@ class InventoryDevice(Base):
     # Identificazione
     identified_by = Column(String(50), nullable=True)  # probe_wmi, probe_ssh, probe_snmp, mac_vendor
     credential_used = Column(String(255), nullable=True)  # Nome della credenziale usata
-    open_ports = Column(JSON, nullable=True)  # Servizi rilevati: [{"port": 80, "protocol": "tcp", "service": "http"}]
+    # JSONB su PostgreSQL (come nello schema Alembic): consente query/indici sul contenuto, es. @>
+    open_ports = Column(JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"), nullable=True)  # Servizi rilevati: [{"port": 80, "protocol": "tcp", "service": "http"}]
 
     # Location
     site_name = Column(String(100), nullable=True)
@@ -145,6 +147,14 @@ class InventoryDevice(Base):
         Index('idx_inventory_ip', 'primary_ip'),
         Index('idx_inventory_status', 'status'),
         Index('idx_inventory_dude', 'dude_device_id'),
+        # Lista inventario: filtro per cliente e ordinamento per (name, id) dall'indice
+        Index('idx_inventory_list', 'customer_id', 'name', 'id'),
+        # Duplicati per IP e scansioni porte per cliente
+        Index('idx_inventory_customer_ip', 'customer_id', 'primary_ip'),
+        # Statistiche per cliente raggruppate per (tipo, stato), coperte dall'indice
+        Index('idx_inventory_customer_type_status', 'customer_id', 'device_type', 'status'),
+        # Device associato a una credenziale (IP letto dall'indice)
+        Index('idx_inventory_credential', 'credential_id', 'primary_ip'),
     )
 
 
@@ -12,7 +12,7 @@ from pydantic import BaseModel
 from datetime import datetime
 from loguru import logger
 
-from ..services.customer_service import get_customer_service
+from ..services.customer_service import get_customer_service, notify_entity_changed
 from ..services.encryption_service import get_encryption_service
 from ..models.customer_schemas import (
     AgentAssignmentListResponse,
@@ -1327,6 +1327,7 @@ async def approve_agent(
             db_agent.active = True
             db_agent.status = "online"
             session.commit()
+            notify_entity_changed("agent", agent_db_id)
         
         session.close()
         
@@ -1414,6 +1415,7 @@ async def update_agent_config(
                 db_agent.active = data.active
             
             session.commit()
+            notify_entity_changed("agent", agent_db_id)
         
         session.close()
         
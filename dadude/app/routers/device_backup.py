@@ -14,19 +14,7 @@ import os
 from pathlib import Path
 
 # Import database dependency (usa quello esistente)
-from ..models.database import init_db, get_session
-from ..config import get_settings
-
-def get_db():
-    """Dependency per ottenere sessione database"""
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
-    try:
-        yield session
-    finally:
-        session.close()
+from ..models.database import get_db
 
 from ..models.backup_models import DeviceBackup, BackupJob, BackupSchedule
 from ..services.device_backup_service import DeviceBackupService
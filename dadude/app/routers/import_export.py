@@ -9,6 +9,10 @@ from datetime import datetime
 from loguru import logger
 import csv
 import io
+import re
+import time
+from functools import lru_cache
+from itertools import islice
 
 from ..services.customer_service import get_customer_service
 from ..services.encryption_service import get_encryption_service
@@ -19,6 +23,98 @@ from ..models.customer_schemas import (
 
 router = APIRouter(prefix="/import-export", tags=["Import/Export"])
 
+# Numero di righe accumulate nel buffer prima di emettere un chunk
+CSV_CHUNK_ROWS = 256
+
+CUSTOMER_CSV_FIELDS = (
+    'code', 'name', 'description', 'contact_name', 'contact_email',
+    'contact_phone', 'address', 'notes', 'active'
+)
+
+NETWORK_CSV_FIELDS = (
+    'name', 'network_type', 'ip_network', 'gateway', 'vlan_id', 'vlan_name',
+    'dns_primary', 'dns_secondary', 'dhcp_start', 'dhcp_end',
+    'description', 'notes', 'active'
+)
+
+CREDENTIAL_CSV_FIELDS = (
+    'name', 'credential_type', 'username', 'snmp_community', 'snmp_version',
+    'api_endpoint', 'vpn_type', 'is_default', 'device_filter',
+    'description', 'notes', 'active'
+)
+
+CREDENTIAL_SECRET_CSV_FIELDS = (
+    'password', 'snmp_auth_password', 'snmp_priv_password', 'api_key', 'api_secret'
+)
+
+
+# Formatter di riga: una tupla nello stesso ordine dei campi *_CSV_FIELDS
+
+def _row_customer(c):
+    return (
+        c.code, c.name, c.description or '', c.contact_name or '',
+        c.contact_email or '', c.contact_phone or '', c.address or '',
+        c.notes or '', c.active,
+    )
+
+
+def _row_network(n):
+    return (
+        n.name, n.network_type, n.ip_network, n.gateway or '', n.vlan_id or '',
+        n.vlan_name or '', n.dns_primary or '', n.dns_secondary or '',
+        n.dhcp_start or '', n.dhcp_end or '', n.description or '',
+        n.notes or '', n.active,
+    )
+
+
+def _row_credential(c):
+    return (
+        c.name, c.credential_type, c.username or '', c.snmp_community or '',
+        c.snmp_version or '', c.api_endpoint or '', c.vpn_type or '',
+        c.is_default, c.device_filter or '', c.description or '',
+        c.notes or '', c.active,
+    )
+
+
+def _row_credential_secrets(c):
+    return (
+        c.password or '', c.snmp_auth_password or '', c.snmp_priv_password or '',
+        c.api_key or '', c.api_secret or '',
+    )
+
+
+@lru_cache(maxsize=1)
+def _format_ts(second: int) -> str:
+    return datetime.fromtimestamp(second).strftime('%Y%m%d_%H%M%S')
+
+
+def _ts() -> str:
+    """Timestamp per i nomi file, formattato una sola volta per secondo"""
+    return _format_ts(int(time.time()))
+
+
+def _iter_csv(header, rows):
+    """
+    Genera il contenuto CSV a blocchi di CSV_CHUNK_ROWS righe.
+    Usa un unico buffer StringIO svuotato con seek(0)/truncate(0)
+    dopo ogni chunk, invece di far crescere un buffer unico.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate(0)
+    
+    rows = iter(rows)
+    while True:
+        writer.writerows(islice(rows, CSV_CHUNK_ROWS))
+        if not buf.tell():
+            break
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+
 
 # ==========================================
 # EXPORT ENDPOINTS
@@ -34,33 +130,11 @@ async def export_customers_csv(
     service = get_customer_service()
     customers = service.list_customers(active_only=active_only, limit=10000)
     
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=[
-        'code', 'name', 'description', 'contact_name', 'contact_email',
-        'contact_phone', 'address', 'notes', 'active'
-    ])
-    writer.writeheader()
-    
-    for c in customers:
-        writer.writerow({
-            'code': c.code,
-            'name': c.name,
-            'description': c.description or '',
-            'contact_name': c.contact_name or '',
-            'contact_email': c.contact_email or '',
-            'contact_phone': c.contact_phone or '',
-            'address': c.address or '',
-            'notes': c.notes or '',
-            'active': c.active,
-        })
-    
-    output.seek(0)
-    
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _iter_csv(CUSTOMER_CSV_FIELDS, (_row_customer(c) for c in customers)),
         media_type="text/csv",
         headers={
-            "Content-Disposition": f"attachment; filename=customers_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            "Content-Disposition": f"attachment; filename=customers_{_ts()}.csv"
         }
     )
 
@@ -79,38 +153,11 @@ async def export_networks_csv(customer_id: str):
     
     networks = service.list_networks(customer_id=customer_id, active_only=False)
     
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=[
-        'name', 'network_type', 'ip_network', 'gateway', 'vlan_id', 'vlan_name',
-        'dns_primary', 'dns_secondary', 'dhcp_start', 'dhcp_end',
-        'description', 'notes', 'active'
-    ])
-    writer.writeheader()
-    
-    for n in networks:
-        writer.writerow({
-            'name': n.name,
-            'network_type': n.network_type,
-            'ip_network': n.ip_network,
-            'gateway': n.gateway or '',
-            'vlan_id': n.vlan_id or '',
-            'vlan_name': n.vlan_name or '',
-            'dns_primary': n.dns_primary or '',
-            'dns_secondary': n.dns_secondary or '',
-            'dhcp_start': n.dhcp_start or '',
-            'dhcp_end': n.dhcp_end or '',
-            'description': n.description or '',
-            'notes': n.notes or '',
-            'active': n.active,
-        })
-    
-    output.seek(0)
-    
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _iter_csv(NETWORK_CSV_FIELDS, (_row_network(n) for n in networks)),
         media_type="text/csv",
         headers={
-            "Content-Disposition": f"attachment; filename=networks_{customer.code}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            "Content-Disposition": f"attachment; filename=networks_{customer.code}_{_ts()}.csv"
         }
     )
 
@@ -135,55 +182,26 @@ async def export_credentials_csv(
     
     credentials = service.list_credentials(customer_id=customer_id, active_only=False)
     
-    fieldnames = [
-        'name', 'credential_type', 'username', 'snmp_community', 'snmp_version',
-        'api_endpoint', 'vpn_type', 'is_default', 'device_filter',
-        'description', 'notes', 'active'
-    ]
-    
+    header = CREDENTIAL_CSV_FIELDS
     if include_secrets:
-        fieldnames.extend(['password', 'snmp_auth_password', 'snmp_priv_password', 'api_key', 'api_secret'])
-    
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
+        header += CREDENTIAL_SECRET_CSV_FIELDS
     
-    for c in credentials:
-        row = {
-            'name': c.name,
-            'credential_type': c.credential_type,
-            'username': c.username or '',
-            'snmp_community': c.snmp_community or '',
-            'snmp_version': c.snmp_version or '',
-            'api_endpoint': c.api_endpoint or '',
-            'vpn_type': c.vpn_type or '',
-            'is_default': c.is_default,
-            'device_filter': c.device_filter or '',
-            'description': c.description or '',
-            'notes': c.notes or '',
-            'active': c.active,
-        }
-        
-        if include_secrets:
-            # Ottieni credenziale completa con secrets decriptati
-            full_cred = service.get_credential(c.id, include_secrets=True)
-            row['password'] = full_cred.password or ''
-            row['snmp_auth_password'] = full_cred.snmp_auth_password or ''
-            row['snmp_priv_password'] = full_cred.snmp_priv_password or ''
-            row['api_key'] = full_cred.api_key or ''
-            row['api_secret'] = full_cred.api_secret or ''
-        
-        writer.writerow(row)
-    
-    output.seek(0)
+    def rows():
+        for c in credentials:
+            if include_secrets:
+                # Ottieni credenziale completa con secrets decriptati
+                full_cred = service.get_credential(c.id, include_secrets=True)
+                yield _row_credential(c) + _row_credential_secrets(full_cred)
+            else:
+                yield _row_credential(c)
     
     filename_suffix = "_WITH_SECRETS" if include_secrets else ""
     
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _iter_csv(header, rows()),
         media_type="text/csv",
         headers={
-            "Content-Disposition": f"attachment; filename=credentials_{customer.code}{filename_suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            "Content-Disposition": f"attachment; filename=credentials_{customer.code}{filename_suffix}_{_ts()}.csv"
         }
     )
 
@@ -192,6 +210,38 @@ async def export_credentials_csv(
 # IMPORT ENDPOINTS
 # ==========================================
 
+_NETWORK_TYPES = {t.value: t for t in NetworkType}
+_CREDENTIAL_TYPES = {t.value: t for t in CredentialType}
+_TRUE_VALUES = frozenset(('true', '1', 'yes'))
+_is_numeric = re.compile(r'\d+').fullmatch
+
+
+def _read_csv_rows(content: bytes) -> List[dict]:
+    """Decodifica il file caricato e restituisce tutte le righe CSV"""
+    try:
+        text_content = content.decode('utf-8')
+    except UnicodeDecodeError:
+        text_content = content.decode('latin-1')
+    return list(csv.DictReader(io.StringIO(text_content)))
+
+
+def _precheck_rows(rows: List[dict], required: tuple):
+    """
+    Validazione preliminare senza eccezioni: scarta le righe senza
+    i campi obbligatori. Restituisce (righe valide, errori) dove le
+    righe valide sono coppie (numero riga, riga).
+    """
+    valid = []
+    errors = []
+    for row_num, row in enumerate(rows, start=2):  # Start at 2 (header is row 1)
+        missing = [f for f in required if not row.get(f)]
+        if missing:
+            errors.append(f"Riga {row_num}: campi obbligatori mancanti: {', '.join(missing)}")
+        else:
+            valid.append((row_num, row))
+    return valid, errors
+
+
 @router.post("/customers/{customer_id}/networks/csv")
 async def import_networks_csv(
     customer_id: str,
@@ -210,38 +260,25 @@ async def import_networks_csv(
     if not customer:
         raise HTTPException(status_code=404, detail=f"Cliente {customer_id} non trovato")
     
-    # Leggi file
-    content = await file.read()
-    try:
-        text_content = content.decode('utf-8')
-    except UnicodeDecodeError:
-        text_content = content.decode('latin-1')
-    
-    reader = csv.DictReader(io.StringIO(text_content))
+    # Leggi file e pre-validazione
+    rows, errors = _precheck_rows(_read_csv_rows(await file.read()), ('name', 'ip_network'))
+    if errors and not skip_errors:
+        raise HTTPException(status_code=400, detail=errors[0])
     
     results = {
         "imported": 0,
-        "skipped": 0,
-        "errors": []
+        "skipped": len(errors),
+        "errors": errors
     }
     
-    for row_num, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
+    for row_num, row in rows:
+        # Parse network type / VLAN ID
+        network_type_enum = _NETWORK_TYPES.get((row.get('network_type') or 'lan').lower(), NetworkType.LAN)
+        # Spazi attorno al valore (frequenti nei CSV modificati a mano) ammessi come con int()
+        vlan_raw = (row.get('vlan_id') or '').strip()
+        vlan_id = int(vlan_raw) if _is_numeric(vlan_raw) else None
+        
         try:
-            # Parse network type
-            network_type = row.get('network_type', 'lan').lower()
-            try:
-                network_type_enum = NetworkType(network_type)
-            except ValueError:
-                network_type_enum = NetworkType.LAN
-            
-            # Parse VLAN ID
-            vlan_id = None
-            if row.get('vlan_id'):
-                try:
-                    vlan_id = int(row['vlan_id'])
-                except ValueError:
-                    pass
-            
             network_data = NetworkCreate(
                 customer_id=customer_id,
                 name=row['name'],
@@ -256,7 +293,7 @@ async def import_networks_csv(
                 dhcp_end=row.get('dhcp_end') or None,
                 description=row.get('description') or None,
                 notes=row.get('notes') or None,
-                active=str(row.get('active', 'true')).lower() in ('true', '1', 'yes'),
+                active=str(row.get('active', 'true')).lower() in _TRUE_VALUES,
             )
             
             service.create_network(network_data)
@@ -299,30 +336,22 @@ async def import_credentials_csv(
     if not customer:
         raise HTTPException(status_code=404, detail=f"Cliente {customer_id} non trovato")
     
-    # Leggi file
-    content = await file.read()
-    try:
-        text_content = content.decode('utf-8')
-    except UnicodeDecodeError:
-        text_content = content.decode('latin-1')
-    
-    reader = csv.DictReader(io.StringIO(text_content))
+    # Leggi file e pre-validazione
+    rows, errors = _precheck_rows(_read_csv_rows(await file.read()), ('name',))
+    if errors and not skip_errors:
+        raise HTTPException(status_code=400, detail=errors[0])
     
     results = {
         "imported": 0,
-        "skipped": 0,
-        "errors": []
+        "skipped": len(errors),
+        "errors": errors
     }
     
-    for row_num, row in enumerate(reader, start=2):
+    for row_num, row in rows:
+        # Parse credential type
+        cred_type_enum = _CREDENTIAL_TYPES.get((row.get('credential_type') or 'device').lower(), CredentialType.DEVICE)
+        
         try:
-            # Parse credential type
-            cred_type = row.get('credential_type', 'device').lower()
-            try:
-                cred_type_enum = CredentialType(cred_type)
-            except ValueError:
-                cred_type_enum = CredentialType.DEVICE
-            
             cred_data = CredentialCreate(
                 customer_id=customer_id,
                 name=row['name'],
@@ -338,11 +367,11 @@ async def import_credentials_csv(
                 api_endpoint=row.get('api_endpoint') or None,
                 vpn_type=row.get('vpn_type') or None,
                 vpn_config=row.get('vpn_config') or None,
-                is_default=str(row.get('is_default', 'false')).lower() in ('true', '1', 'yes'),
+                is_default=str(row.get('is_default', 'false')).lower() in _TRUE_VALUES,
                 device_filter=row.get('device_filter') or None,
                 description=row.get('description') or None,
                 notes=row.get('notes') or None,
-                active=str(row.get('active', 'true')).lower() in ('true', '1', 'yes'),
+                active=str(row.get('active', 'true')).lower() in _TRUE_VALUES,
             )
             
             service.create_credential(cred_data)
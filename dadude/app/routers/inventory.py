@@ -2,15 +2,53 @@
 DaDude - Inventory Router
 API per gestione inventario dispositivi
 """
-from fastapi import APIRouter, HTTPException, Query
+import json
+import re
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import Response, StreamingResponse
 from typing import Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from loguru import logger
 from datetime import datetime
+from sqlalchemy import select, insert, update, delete, func, or_, and_, lambda_stmt, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, selectinload, joinedload
+
+from ..config import get_settings
+from ..models.database import get_async_db
+from ..models.inventory import InventoryDevice
+from ..services.agent_service import get_agent_service
+from ..services.customer_service import get_customer_service, credential_types_for_ports
+from ..services.device_probe_service import get_device_probe_service
+from ..services.dude_service import get_dude_service
+from ..services.encryption_service import get_encryption_service
+from ..services.mac_lookup_service import get_mac_lookup_service
+from ..services.mikrotik_service import get_mikrotik_service
+from ..utils.ttl_cache import TTLCache
 
 
 router = APIRouter(prefix="/inventory", tags=["Inventory"])
 
+# Cache dei risultati di rete per indirizzo (endpoint interrogati spesso dalle dashboard)
+_rdns_cache = TTLCache(maxsize=4096, ttl=300)
+_protocols_cache = TTLCache(maxsize=2048, ttl=120)
+_credential_type_cache = TTLCache(maxsize=2048, ttl=120)
+_scan_cache = TTLCache(maxsize=2048, ttl=60)
+# Totale dispositivi per filtri della lista e risposte della lista stessa
+# (svuotate a ogni modifica dell'inventario da questo router)
+_device_count_cache = TTLCache(maxsize=1024, ttl=10)
+_device_list_cache = TTLCache(maxsize=512, ttl=5)
+# Vendor per OUI: i risultati trovati restano a lungo, gli OUI sconosciuti solo un
+# minuto (il database OUI può essere popolato o aggiornato dopo l'avvio)
+_vendor_cache = TTLCache(maxsize=8192, ttl=3600)
+_vendor_miss_cache = TTLCache(maxsize=8192, ttl=60)
+
+
+def _invalidate_device_list() -> None:
+    """Da chiamare dopo ogni commit che modifica i dispositivi inventariati"""
+    _device_count_cache.clear()
+    _device_list_cache.clear()
+
 
 # ==========================================
 # SCHEMAS
@@ -68,54 +106,263 @@ class AutoDetectRequest(BaseModel):
     use_agent: bool = True  # Usa agent remoto se disponibile
     agent_id: Optional[str] = None  # ID agent specifico (se None, usa default)
     save_results: bool = True  # Salva i risultati nel device
+    parallel_credentials: bool = True  # Prova le credenziali in parallelo (probe diretto)
 
 
 class BulkAutoDetectRequest(BaseModel):
     """Schema per auto-detect multipli dispositivi"""
     devices: List[AutoDetectRequest]
     use_agent: bool = True  # Usa agent remoto per tutti i device
+    max_concurrency: Optional[int] = Field(None, ge=1, le=64)  # Se None, usa settings.auto_detect_max_concurrency
 
 
 # ==========================================
 # MAC VENDOR & DEVICE PROBE
 # ==========================================
 
+# Separatori e spazi dei formati MAC (AA:BB:..., AA-BB-..., AABB.CCDD.EEFF), rimossi in un solo passaggio
+_MAC_SEPARATORS = str.maketrans('', '', ':-. \t\r\n')
+_is_mac_hex = re.compile(r'[0-9A-F]{12}').fullmatch
+
+
+def _mac_oui(mac: str) -> Optional[str]:
+    """Estrae l'OUI (XX:XX:XX) da un MAC in qualsiasi formato, None se invalido"""
+    clean = mac.translate(_MAC_SEPARATORS).upper()
+    if not _is_mac_hex(clean):
+        return None
+    return f"{clean[0:2]}:{clean[2:4]}:{clean[4:6]}"
+
+
+def _cached_vendor_lookup(oui: str) -> Optional[dict]:
+    """Lookup vendor in cache per OUI: il vendor dipende solo dai primi 3 byte"""
+    vendor_info = _vendor_cache.get(oui)
+    if vendor_info is not None or _vendor_miss_cache.get(oui):
+        return vendor_info
+    vendor_info = get_mac_lookup_service().lookup(f"{oui}:00:00:00")
+    if vendor_info:
+        _vendor_cache.set(oui, vendor_info)
+    else:
+        _vendor_miss_cache.set(oui, True)
+    return vendor_info
+
+
+def _cred_to_probe_dict(cred, password: Optional[str] = None, ssh_private_key: Optional[str] = None) -> dict:
+    """
+    Converte una credenziale nel dict usato da probe service e agent.
+    password/ssh_private_key, se passati, sostituiscono quelli di cred
+    (record ORM con secrets criptati già decriptati dal chiamante).
+    """
+    return {
+        "id": cred.id,
+        "name": cred.name,
+        "type": cred.credential_type,
+        "username": cred.username,
+        "password": cred.password if password is None else password,
+        "ssh_port": cred.ssh_port or 22,
+        "ssh_private_key": cred.ssh_private_key if ssh_private_key is None else ssh_private_key,
+        "snmp_community": cred.snmp_community,
+        "snmp_version": cred.snmp_version or '2c',
+        "snmp_port": cred.snmp_port or 161,
+        "wmi_domain": cred.wmi_domain,
+        "mikrotik_api_port": cred.mikrotik_api_port or 8728,
+    }
+
+
+def _identify_without_credentials(address: str, mac_address: Optional[str], open_ports: list) -> dict:
+    """
+    Identificazione senza probe di rete, da MAC vendor e porte già scansionate.
+    Usata dall'auto-detect quando non ci sono credenziali da provare.
+    """
+    
+    scan_result = {
+        "address": address,
+        "mac_address": mac_address,
+        "device_type": "other",
+        "category": None,
+        "os_family": None,
+        "identified_by": None,
+    }
+    
+    oui = _mac_oui(mac_address) if mac_address else None
+    vendor_info = _cached_vendor_lookup(oui) if oui else None
+    if vendor_info:
+        scan_result["vendor"] = vendor_info.get("vendor")
+        scan_result["device_type"] = vendor_info.get("device_type", "other")
+        scan_result["category"] = vendor_info.get("category")
+        scan_result["os_family"] = vendor_info.get("os_family")
+        if vendor_info.get("vendor"):
+            scan_result["identified_by"] = "mac_vendor"
+    
+    os_hint = get_device_probe_service().identify_os_from_ports(open_ports)
+    if os_hint:
+        if not scan_result["os_family"]:
+            scan_result["os_family"] = os_hint.get("os_family")
+        if scan_result["device_type"] == "other":
+            scan_result["device_type"] = os_hint.get("device_type", "other")
+        if not scan_result["category"]:
+            scan_result["category"] = os_hint.get("category")
+        scan_result["identified_by"] = "port_scan"
+    
+    return scan_result
+
+# Campi extra del probe salvati in custom_fields (non hanno colonna dedicata)
+_AUTO_DETECT_EXTRA_FIELDS = (
+    "server_roles", "installed_software", "network_adapters", "local_users",
+    "important_services", "memory_modules", "disks", "antivirus",
+    "domain_role", "is_server", "is_domain_controller", "last_boot",
+    "install_date", "registered_user", "organization", "system_type",
+    "cpu_speed_mhz", "cpu_threads", "cpu_manufacturer", "bios_version", "bios_manufacturer",
+    "shell_users", "docker_containers_running", "lxc_containers", "vms",
+    "virtualization", "timezone", "uptime", "last_login", "kernel",
+    "interface_count", "license_level", "firmware",
+)
+
+
+def _scan_result_updates(scan_result: dict, credentials_tested: list, open_ports, custom_fields) -> dict:
+    """
+    Converte il risultato di un auto-detect nei valori colonna di
+    InventoryDevice da aggiornare (solo i campi con un valore).
+    custom_fields è il valore attuale del device, unito ai campi extra.
+    """
+    updates = {}
+    
+    # Hostname
+    hostname = scan_result.get("hostname") or scan_result.get("sysName") or scan_result.get("computer_name")
+    if hostname:
+        updates["hostname"] = hostname
+    
+    # OS
+    if scan_result.get("os_family"):
+        updates["os_family"] = scan_result["os_family"]
+    if scan_result.get("os_version") or scan_result.get("version"):
+        updates["os_version"] = scan_result.get("os_version") or scan_result.get("version")
+    if scan_result.get("os_name"):
+        updates["os_family"] = scan_result["os_name"]
+    
+    # Vendor/Manufacturer
+    manufacturer = (scan_result.get("manufacturer") or scan_result.get("vendor") or 
+                   scan_result.get("system_manufacturer"))
+    if manufacturer:
+        updates["manufacturer"] = manufacturer
+    
+    # Model
+    model = scan_result.get("model") or scan_result.get("system_model")
+    if model:
+        updates["model"] = model
+    
+    # Serial
+    serial = scan_result.get("serial_number") or scan_result.get("serial")
+    if serial:
+        updates["serial_number"] = serial
+    
+    # CPU
+    cpu = scan_result.get("cpu_model") or scan_result.get("cpu")
+    if cpu:
+        updates["cpu_model"] = cpu
+    cores = scan_result.get("cpu_cores") or scan_result.get("cores")
+    if cores:
+        try:
+            updates["cpu_cores"] = int(cores)
+        except (ValueError, TypeError):
+            pass
+    
+    # RAM (vari formati: MB, GB, bytes)
+    ram_mb = scan_result.get("memory_total_mb") or scan_result.get("ram_total_mb")
+    ram_gb = scan_result.get("ram_total_gb") or scan_result.get("memory_total_gb")
+    if ram_gb:
+        try:
+            updates["ram_total_gb"] = float(ram_gb)
+        except (ValueError, TypeError):
+            pass
+    elif ram_mb:
+        try:
+            updates["ram_total_gb"] = float(ram_mb) / 1024
+        except (ValueError, TypeError):
+            pass
+    
+    # Category e device_type
+    if scan_result.get("category"):
+        updates["category"] = scan_result["category"]
+    if scan_result.get("device_type"):
+        updates["device_type"] = scan_result["device_type"]
+    
+    # Domain
+    if scan_result.get("domain"):
+        updates["domain"] = scan_result["domain"]
+    
+    # Metodo di identificazione
+    if scan_result.get("identified_by"):
+        updates["identified_by"] = scan_result["identified_by"]
+    
+    # Credenziale usata
+    if credentials_tested:
+        updates["credential_used"] = credentials_tested[0].get("type")
+    
+    # Porte aperte: la colonna è JSON, la lista viene serializzata una sola volta dal driver
+    if open_ports:
+        updates["open_ports"] = open_ports
+    
+    # Dati Windows/Linux dettagliati in custom_fields
+    extra_fields = {field: scan_result[field] for field in _AUTO_DETECT_EXTRA_FIELDS if scan_result.get(field)}
+    if extra_fields:
+        # Merge con custom_fields esistenti (copia: il JSON non traccia mutazioni in-place)
+        existing = custom_fields or {}
+        if isinstance(existing, str):
+            try:
+                existing = json.loads(existing)
+            except (ValueError, TypeError):
+                existing = {}
+        updates["custom_fields"] = {**existing, **extra_fields}
+    
+    # Timestamp
+    updates["last_scan"] = datetime.now()
+    
+    return updates
+
+
 @router.post("/enrich-devices")
 async def enrich_devices_with_vendor(data: EnrichRequest):
     """
     Arricchisce una lista di dispositivi con info vendor dal MAC address.
     Ritorna i device con vendor, suggested_type, suggested_category.
     """
-    from ..services.mac_lookup_service import get_mac_lookup_service
+    # Primo passaggio: estrai l'OUI di ogni device
+    device_ouis = []
+    for device in data.devices:
+        mac = device.get("mac_address", "") or device.get("mac", "")
+        mac = mac.strip() if mac else ""
+        device_ouis.append((mac, _mac_oui(mac) if mac else None))
     
-    mac_service = get_mac_lookup_service()
+    # Un solo lookup per OUI distinto
+    vendor_map = {
+        oui: _cached_vendor_lookup(oui)
+        for oui in {oui for _, oui in device_ouis if oui}
+    }
     
-    # Arricchisci ogni dispositivo con lookup MAC
+    # Secondo passaggio: applica i risultati ai device
     enriched = []
     found_count = 0
-    for device in data.devices:
-        mac = device.get("mac_address", "") or device.get("mac", "")
-        if mac and mac.strip():
-            mac = mac.strip()
-            vendor_info = mac_service.lookup(mac)
+    for device, (mac, oui) in zip(data.devices, device_ouis):
+        if mac:
+            vendor_info = vendor_map.get(oui)
             if vendor_info:
                 device["vendor"] = vendor_info.get("vendor")
                 device["suggested_type"] = vendor_info.get("device_type", "other")
                 device["suggested_category"] = vendor_info.get("category")
                 device["os_family"] = vendor_info.get("os_family")
                 found_count += 1
-                logger.info(f"Enriched device {device.get('address', 'unknown')} MAC {mac}: {vendor_info.get('vendor')}")
+                logger.info("Enriched device {} MAC {}: {}", device.get('address', 'unknown'), mac, vendor_info.get('vendor'))
             else:
                 # Fallback se non trovato
                 device["vendor"] = device.get("vendor")
                 device["suggested_type"] = device.get("suggested_type", "other")
                 device["suggested_category"] = device.get("suggested_category")
-                logger.debug(f"No vendor found for MAC {mac} (device {device.get('address', 'unknown')})")
+                logger.debug("No vendor found for MAC {} (device {})", mac, device.get('address', 'unknown'))
         else:
-            logger.debug(f"Device {device.get('address', 'unknown')} has no MAC address")
+            logger.debug("Device {} has no MAC address", device.get('address', 'unknown'))
         enriched.append(device)
     
-    logger.info(f"Enriched {found_count}/{len(data.devices)} devices with vendor info")
+    logger.info("Enriched {}/{} devices with vendor info ({} distinct OUIs)", found_count, len(data.devices), len(vendor_map))
     
     return {
         "success": True,
@@ -132,8 +379,6 @@ async def probe_single_device(
     Esegue probe su un singolo dispositivo per identificarlo.
     Usa le credenziali del cliente specificate.
     """
-    from ..services.device_probe_service import get_device_probe_service
-    from ..services.customer_service import get_customer_service
     
     probe_service = get_device_probe_service()
     customer_service = get_customer_service()
@@ -141,23 +386,8 @@ async def probe_single_device(
     # Recupera credenziali
     credentials_list = []
     if data.credential_ids:
-        for cred_id in data.credential_ids:
-            cred = customer_service.get_credential(cred_id, include_secrets=True)
-            if cred:
-                credentials_list.append({
-                    "id": cred.id,
-                    "name": cred.name,
-                    "type": cred.credential_type,
-                    "username": cred.username,
-                    "password": cred.password,
-                    "ssh_port": getattr(cred, 'ssh_port', 22),
-                    "ssh_private_key": getattr(cred, 'ssh_private_key', None),
-                    "snmp_community": getattr(cred, 'snmp_community', None),
-                    "snmp_version": getattr(cred, 'snmp_version', '2c'),
-                    "snmp_port": getattr(cred, 'snmp_port', 161),
-                    "wmi_domain": getattr(cred, 'wmi_domain', None),
-                    "mikrotik_api_port": getattr(cred, 'mikrotik_api_port', 8728),
-                })
+        for cred in customer_service.get_credentials_bulk(data.credential_ids, include_secrets=True):
+            credentials_list.append(_cred_to_probe_dict(cred))
     
     # Esegui probe
     result = await probe_service.auto_identify_device(
@@ -191,9 +421,26 @@ async def auto_detect_device(
     - RDP/SMB/LDAP/WMI (3389, 445, 139, 389, 135, 5985) → credenziali wmi
     - MikroTik API (8728, 8729, 8291) → credenziali mikrotik
     """
-    from ..services.device_probe_service import get_device_probe_service
-    from ..services.customer_service import get_customer_service
-    from ..services.agent_service import get_agent_service
+    return await _run_auto_detect(data, customer_id)
+
+
+async def _run_auto_detect(
+    data: AutoDetectRequest,
+    customer_id: str,
+    agent_cache: Optional[dict] = None,
+    cred_cache: Optional[dict] = None,
+    pending_updates: Optional[list] = None,
+) -> dict:
+    """
+    Implementazione di auto-detect per un singolo device.
+    agent_cache (agent_id o None per il default -> agent_info) permette
+    al batch di risolvere l'agent una sola volta per tutti i device;
+    cred_cache ((customer_id, tipi credenziale) -> credenziali) evita di
+    ripetere la ricerca credenziali per device con gli stessi protocolli.
+    Se pending_updates è passato, i valori da salvare vi vengono accodati
+    come (result, mapping) invece di essere scritti: il batch li applica
+    tutti con un solo UPDATE in blocco.
+    """
     
     probe_service = get_device_probe_service()
     customer_service = get_customer_service()
@@ -209,11 +456,58 @@ async def auto_detect_device(
         "agent_used": None,
     }
     
+    from ..models.database import Credential as CredentialDB
+    
     try:
+        # Device inventario (se presente) e sua credenziale in una sola query, copiati
+        # in dict: la sessione viene chiusa prima della scansione di rete, così la
+        # connessione torna al pool invece di restare occupata per tutto il probe
+        device_record = None
+        assigned_cred = None
+        if data.device_id:
+            with customer_service._session_scope() as session:
+                row = session.query(InventoryDevice, CredentialDB).options(
+                    # Del device servono solo le colonne lette dal salvataggio
+                    load_only(
+                        InventoryDevice.id,
+                        InventoryDevice.customer_id,
+                        InventoryDevice.credential_id,
+                        InventoryDevice.custom_fields,
+                    )
+                ).outerjoin(
+                    CredentialDB, InventoryDevice.credential_id == CredentialDB.id
+                ).filter(
+                    InventoryDevice.id == data.device_id
+                ).first()
+                if row:
+                    device, cred = row
+                    device_record = {
+                        "id": device.id,
+                        "customer_id": device.customer_id,
+                        "credential_id": device.credential_id,
+                        "custom_fields": device.custom_fields,
+                    }
+                    if cred:
+                        # Decripta password e chiave SSH
+                        encryption = get_encryption_service()
+                        assigned_cred = {
+                            "id": cred.id,
+                            "name": cred.name,
+                            "type": cred.credential_type,
+                            "probe": _cred_to_probe_dict(
+                                cred,
+                                password=encryption.decrypt(cred.password) if cred.password else None,
+                                ssh_private_key=encryption.decrypt(cred.ssh_private_key) if cred.ssh_private_key else None,
+                            ),
+                        }
+        
         # 0. Cerca agent remoto
         agent_info = None
         if data.use_agent:
-            if data.agent_id:
+            if agent_cache is not None and data.agent_id in agent_cache:
+                # Già risolto da un altro device dello stesso batch
+                agent_info = agent_cache[data.agent_id]
+            elif data.agent_id:
                 # Agent specifico
                 agent = customer_service.get_agent(data.agent_id, include_password=True)
                 if agent:
@@ -222,16 +516,19 @@ async def auto_detect_device(
                 # Agent default del cliente
                 agent_info = agent_service.get_agent_for_customer(customer_id)
             
+            if agent_cache is not None:
+                agent_cache[data.agent_id] = agent_info
+            
             if agent_info:
                 result["agent_used"] = {
                     "id": agent_info["id"],
                     "name": agent_info["name"],
                     "type": agent_info["agent_type"],
                 }
-                logger.info(f"Auto-detect: Using agent {agent_info['name']} ({agent_info['agent_type']})")
+                logger.info("Auto-detect: Using agent {} ({})", agent_info['name'], agent_info['agent_type'])
         
         # 1. Scansiona le porte
-        logger.info(f"Auto-detect: Scanning ports on {data.address}...")
+        logger.info("Auto-detect: Scanning ports on {}...", data.address)
         
         if agent_info and agent_info.get("agent_type") == "docker":
             # Usa agent Docker per port scan
@@ -242,90 +539,51 @@ async def auto_detect_device(
             open_ports = await probe_service.scan_services(data.address)
         
         result["open_ports"] = open_ports
-        open_count = len([p for p in open_ports if p.get("open")])
-        logger.info(f"Auto-detect: Found {open_count} open ports on {data.address}")
+        open_ports_only = [p for p in open_ports if p.get("open")]
+        open_count = len(open_ports_only)
+        logger.info("Auto-detect: Found {} open ports on {}", open_count, data.address)
         
-        if not open_ports or open_count == 0:
+        if open_count == 0:
             result["error"] = "No open ports found"
             return result
         
         # 2. Determina credenziali da provare
         credentials_list = []
-        device_record = None
         
         # 2a. Prima controlla se c'è una credenziale assegnata al device specifico
-        if data.device_id and data.use_assigned_credential:
-            from ..models.inventory import InventoryDevice
-            from ..models.database import Credential as CredentialDB
-            
-            session = customer_service._get_session()
-            try:
-                device_record = session.query(InventoryDevice).filter(
-                    InventoryDevice.id == data.device_id
-                ).first()
-                
-                if device_record and device_record.credential_id:
-                    cred = session.query(CredentialDB).filter(
-                        CredentialDB.id == device_record.credential_id
-                    ).first()
-                    
-                    if cred:
-                        # Decripta la password
-                        from ..services.encryption_service import get_encryption_service
-                        encryption = get_encryption_service()
-                        password = encryption.decrypt(cred.password) if cred.password else None
-                        
-                        credentials_list.append({
-                            "id": cred.id,
-                            "name": cred.name,
-                            "type": cred.credential_type,
-                            "username": cred.username,
-                            "password": password,
-                            "ssh_port": cred.ssh_port or 22,
-                            "ssh_private_key": encryption.decrypt(cred.ssh_private_key) if cred.ssh_private_key else None,
-                            "snmp_community": cred.snmp_community,
-                            "snmp_version": cred.snmp_version or '2c',
-                            "snmp_port": cred.snmp_port or 161,
-                            "wmi_domain": cred.wmi_domain,
-                            "mikrotik_api_port": cred.mikrotik_api_port or 8728,
-                        })
-                        result["credentials_tested"].append({
-                            "id": cred.id,
-                            "name": cred.name,
-                            "type": cred.credential_type,
-                            "source": "device_assigned",
-                        })
-                        logger.info(f"Auto-detect: Using device-assigned credential '{cred.name}' ({cred.credential_type})")
-            finally:
-                session.close()
+        if assigned_cred and data.use_assigned_credential:
+            credentials_list.append(assigned_cred["probe"])
+            result["credentials_tested"].append({
+                "id": assigned_cred["id"],
+                "name": assigned_cred["name"],
+                "type": assigned_cred["type"],
+                "source": "device_assigned",
+            })
+            logger.info("Auto-detect: Using device-assigned credential '{}' ({})", assigned_cred["name"], assigned_cred["type"])
         
         # 2b. Poi aggiungi credenziali di default se richiesto
         if data.use_default_credentials:
             # Ottieni credenziali di default in base alle porte aperte
-            creds = customer_service.get_credentials_for_auto_detect(
-                customer_id=customer_id,
-                open_ports=open_ports
-            )
+            credential_types = credential_types_for_ports(open_ports_only)
+            cache_key = (customer_id, frozenset(credential_types))
+            if cred_cache is not None and cache_key in cred_cache:
+                creds = cred_cache[cache_key]
+            else:
+                creds = customer_service.get_credentials_for_auto_detect(
+                    customer_id=customer_id,
+                    credential_types=credential_types
+                )
+                if cred_cache is not None:
+                    cred_cache[cache_key] = creds
             
+            seen_cred_ids = {c["id"] for c in credentials_list}
             for cred in creds:
                 # Skip se già presente (stessa credenziale assegnata)
-                if any(c["id"] == cred.id for c in credentials_list):
+                if cred.id in seen_cred_ids:
                     continue
-                    
-                credentials_list.append({
-                    "id": cred.id,
-                    "name": cred.name,
-                    "type": cred.credential_type,
-                    "username": cred.username,
-                    "password": cred.password,
-                    "ssh_port": getattr(cred, 'ssh_port', 22),
-                    "ssh_private_key": getattr(cred, 'ssh_private_key', None),
-                    "snmp_community": getattr(cred, 'snmp_community', None),
-                    "snmp_version": getattr(cred, 'snmp_version', '2c'),
-                    "snmp_port": getattr(cred, 'snmp_port', 161),
-                    "wmi_domain": getattr(cred, 'wmi_domain', None),
-                    "mikrotik_api_port": getattr(cred, 'mikrotik_api_port', 8728),
-                })
+                seen_cred_ids.add(cred.id)
+                
+                credentials_list.append(_cred_to_probe_dict(cred))
                 result["credentials_tested"].append({
                     "id": cred.id,
                     "name": cred.name,
@@ -334,13 +592,18 @@ async def auto_detect_device(
                 })
         
         if not credentials_list:
-            logger.warning(f"Auto-detect: No credentials found for {data.address}!")
+            logger.warning("Auto-detect: No credentials found for {}!", data.address)
         else:
-            logger.info(f"Auto-detect: Testing {len(credentials_list)} credentials on {data.address}: {[c.get('type') for c in credentials_list]}")
+            logger.opt(lazy=True).info("Auto-detect: Testing {} credentials on {}: {}", lambda: len(credentials_list), lambda: data.address, lambda: [c.get('type') for c in credentials_list])
         
         # 3. Esegui probe con credenziali
+        if not credentials_list:
+            # Senza credenziali il probe non può autenticarsi: si evita il round trip
+            # di rete e si identifica solo da MAC vendor e porte già scansionate
+            result["skipped_probe"] = "no_credentials"
+            scan_result = _identify_without_credentials(data.address, data.mac_address, open_ports)
         # Se abbiamo un agent Docker, usalo per i probe
-        if agent_info and agent_info.get("agent_type") == "docker":
+        elif agent_info and agent_info.get("agent_type") == "docker":
             # Probe via agent Docker
             probe_result = await agent_service.auto_probe(
                 agent_info=agent_info,
@@ -372,17 +635,17 @@ async def auto_detect_device(
             scan_result = await probe_service.auto_identify_device(
                 address=data.address,
                 mac_address=data.mac_address,
-                credentials_list=credentials_list
+                credentials_list=credentials_list,
+                parallel_credentials=data.parallel_credentials
             )
         
         result["scan_result"] = scan_result
         result["success"] = True
         result["identified"] = scan_result.get("identified_by") is not None
         
-        # Log dettagliato dei dati raccolti
-        collected_data = {k: v for k, v in scan_result.items() if v and k not in ['probe_results', 'open_ports', 'available_protocols']}
-        logger.info(f"Auto-detect complete for {data.address}: identified={result['identified']}, method={scan_result.get('identified_by')}")
-        logger.info(f"Auto-detect data collected: {collected_data}")
+        # Log dettagliato dei dati raccolti (calcolato solo se il livello INFO è attivo)
+        logger.info("Auto-detect complete for {}: identified={}, method={}", data.address, result['identified'], scan_result.get('identified_by'))
+        logger.opt(lazy=True).info("Auto-detect data collected: {}", lambda: {k: v for k, v in scan_result.items() if v and k not in ['probe_results', 'open_ports', 'available_protocols']})
         
         # 4. Salva i risultati nel device se richiesto
         # Salva anche se non completamente identificato, ma ci sono dati utili
@@ -395,182 +658,54 @@ async def auto_detect_device(
             scan_result.get("manufacturer")
         )
         
-        if data.save_results and data.device_id and (result["identified"] or has_useful_data):
-            from ..models.inventory import InventoryDevice
-            import json
-            
-            session = customer_service._get_session()
+        if data.save_results and device_record and (result["identified"] or has_useful_data):
             try:
-                device = session.query(InventoryDevice).filter(
-                    InventoryDevice.id == data.device_id
-                ).first()
+                logger.opt(lazy=True).info("Saving probe results for device {}: {}", lambda: data.device_id, lambda: list(scan_result.keys()))
                 
-                if device:
-                    logger.info(f"Saving probe results for device {data.device_id}: {list(scan_result.keys())}")
-                    
+                updates = _scan_result_updates(
+                    scan_result, result["credentials_tested"], open_ports, device_record["custom_fields"]
+                )
+                
+                # Seconda sessione breve, solo per il salvataggio
+                with customer_service._session_scope() as session:
                     # PRESERVA credential_id esistente - NON sovrascriverlo!
-                    # Se viene usata una credenziale durante il probe e non c'è già una credenziale associata,
-                    # oppure se la credenziale usata corrisponde a quella già associata, preservala
-                    existing_credential_id = device.credential_id
-                    
                     # Se è stata usata una credenziale durante il probe e non c'è già una credenziale associata,
                     # prova ad associare quella usata
-                    if result.get("credentials_tested") and not existing_credential_id:
+                    if result.get("credentials_tested") and not device_record["credential_id"]:
                         # Cerca la credenziale usata tra quelle del cliente
                         tested_cred = result["credentials_tested"][0]
                         cred_name = tested_cred.get("name")
                         if cred_name:
                             # Cerca credenziale per nome
-                            from ..models.database import Credential as CredentialDB
-                            cred = session.query(CredentialDB).filter(
-                                CredentialDB.customer_id == device.customer_id,
+                            cred_id = session.query(CredentialDB.id).filter(
+                                CredentialDB.customer_id == device_record["customer_id"],
                                 CredentialDB.name == cred_name
-                            ).first()
-                            if cred:
-                                device.credential_id = cred.id
-                                logger.info(f"Auto-detect: Associated credential '{cred_name}' ({cred.id}) to device {data.device_id}")
-                    
-                    # Hostname
-                    hostname = scan_result.get("hostname") or scan_result.get("sysName") or scan_result.get("computer_name")
-                    if hostname:
-                        device.hostname = hostname
-                    
-                    # OS
-                    if scan_result.get("os_family"):
-                        device.os_family = scan_result["os_family"]
-                    if scan_result.get("os_version") or scan_result.get("version"):
-                        device.os_version = scan_result.get("os_version") or scan_result.get("version")
-                    if scan_result.get("os_name"):
-                        device.os_family = scan_result["os_name"]
-                    
-                    # Vendor/Manufacturer
-                    manufacturer = (scan_result.get("manufacturer") or scan_result.get("vendor") or 
-                                   scan_result.get("system_manufacturer"))
-                    if manufacturer:
-                        device.manufacturer = manufacturer
-                    
-                    # Model
-                    model = scan_result.get("model") or scan_result.get("system_model")
-                    if model:
-                        device.model = model
-                    
-                    # Serial
-                    serial = scan_result.get("serial_number") or scan_result.get("serial")
-                    if serial:
-                        device.serial_number = serial
-                    
-                    # CPU
-                    cpu = scan_result.get("cpu_model") or scan_result.get("cpu")
-                    if cpu:
-                        device.cpu_model = cpu
-                    cores = scan_result.get("cpu_cores") or scan_result.get("cores")
-                    if cores:
-                        try:
-                            device.cpu_cores = int(cores)
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # RAM (vari formati: MB, GB, bytes)
-                    ram_mb = scan_result.get("memory_total_mb") or scan_result.get("ram_total_mb")
-                    ram_gb = scan_result.get("ram_total_gb") or scan_result.get("memory_total_gb")
-                    if ram_gb:
-                        try:
-                            device.ram_total_gb = float(ram_gb)
-                        except (ValueError, TypeError):
-                            pass
-                    elif ram_mb:
-                        try:
-                            device.ram_total_gb = float(ram_mb) / 1024
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Disco
-                    disk_gb = scan_result.get("disk_total_gb") or scan_result.get("storage_total_gb")
-                    if disk_gb:
-                        try:
-                            device.disk_total_gb = float(disk_gb)
-                        except (ValueError, TypeError):
-                            pass
-                    disk_free = scan_result.get("disk_free_gb") or scan_result.get("storage_free_gb")
-                    if disk_free:
-                        try:
-                            device.disk_free_gb = float(disk_free)
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Firmware/Version
-                    firmware = scan_result.get("firmware_version") or scan_result.get("bios_version")
-                    if firmware:
-                        device.firmware_version = firmware
-                    
-                    # Category e device_type
-                    if scan_result.get("category"):
-                        device.category = scan_result["category"]
-                    if scan_result.get("device_type"):
-                        device.device_type = scan_result["device_type"]
-                    
-                    # Domain
-                    if scan_result.get("domain"):
-                        device.domain = scan_result["domain"]
-                    
-                    # Metodo di identificazione
-                    if scan_result.get("identified_by"):
-                        device.identified_by = scan_result["identified_by"]
-                    
-                    # Credenziale usata
-                    if result["credentials_tested"]:
-                        device.credential_used = result["credentials_tested"][0].get("type")
-                    
-                    # Porte aperte
-                    if open_ports:
-                        device.open_ports = json.dumps(open_ports) if isinstance(open_ports, list) else open_ports
-                    
-                    # Salva dati extra nel campo custom_fields
-                    extra_fields = {}
-                    
-                    # Dati Windows/Linux dettagliati
-                    extra_field_names = [
-                        "server_roles", "installed_software", "network_adapters", "local_users",
-                        "important_services", "memory_modules", "disks", "antivirus",
-                        "domain_role", "is_server", "is_domain_controller", "last_boot",
-                        "install_date", "registered_user", "organization", "system_type",
-                        "cpu_speed_mhz", "cpu_threads", "cpu_manufacturer", "bios_version", "bios_manufacturer",
-                        "shell_users", "docker_containers_running", "lxc_containers", "vms",
-                        "virtualization", "timezone", "uptime", "last_login", "kernel",
-                        "interface_count", "license_level", "firmware"
-                    ]
-                    
-                    for field in extra_field_names:
-                        if field in scan_result and scan_result[field]:
-                            extra_fields[field] = scan_result[field]
-                    
-                    if extra_fields:
-                        # Merge con custom_fields esistenti
-                        existing = device.custom_fields or {}
-                        if isinstance(existing, str):
-                            try:
-                                existing = json.loads(existing)
-                            except:
-                                existing = {}
-                        existing.update(extra_fields)
-                        device.custom_fields = existing
-                    
-                    # Timestamp
-                    from datetime import datetime
-                    device.last_scan = datetime.utcnow()
+                            ).scalar()
+                            if cred_id:
+                                updates["credential_id"] = cred_id
+                                logger.info("Auto-detect: Associated credential '{}' ({}) to device {}", cred_name, cred_id, data.device_id)
                     
-                    session.commit()
-                    logger.info(f"Auto-detect: Saved results to device {data.device_id} - hostname={device.hostname}, os={device.os_family}, cpu={device.cpu_model}")
-                    result["saved"] = True
+                    if pending_updates is None:
+                        # UPDATE diretto sulle sole colonne cambiate, senza ricaricare il record
+                        # (commit all'uscita dallo scope)
+                        session.query(InventoryDevice).filter(
+                            InventoryDevice.id == device_record["id"]
+                        ).update(updates, synchronize_session=False)
+                
+                if pending_updates is not None:
+                    # Salvataggio demandato al batch
+                    pending_updates.append((result, {"id": device_record["id"], **updates}))
+                    return result
+                
+                _invalidate_device_list()
+                logger.info("Auto-detect: Saved results to device {} - hostname={}, os={}, cpu={}", data.device_id, updates.get('hostname'), updates.get('os_family'), updates.get('cpu_model'))
+                result["saved"] = True
             except Exception as save_err:
                 logger.error(f"Failed to save auto-detect results: {save_err}", exc_info=True)
-                session.rollback()
                 result["save_error"] = str(save_err)
-            finally:
-                session.close()
         
     except Exception as e:
-        logger.error(f"Auto-detect failed for {data.address}: {e}")
+        logger.error("Auto-detect failed for {}: {}", data.address, e)
         result["error"] = str(e)
     
     return result
@@ -586,39 +721,54 @@ async def auto_detect_batch(
     """
     import asyncio
     
-    results = []
+    # Esegui in parallelo (limite configurabile per evitare sovraccarico)
+    semaphore = asyncio.Semaphore(data.max_concurrency or get_settings().auto_detect_max_concurrency)
     
-    async def detect_one(device: AutoDetectRequest):
-        return await auto_detect_device(device, customer_id)
+    # Agent e credenziali (per tipi di credenziale necessari) risolti una sola volta per l'intero batch
+    agent_cache = {}
+    cred_cache = {}
+    # Risultati da salvare, scritti tutti insieme a fine batch
+    pending_updates = []
     
-    # Esegui in parallelo (max 5 alla volta per evitare sovraccarico)
-    semaphore = asyncio.Semaphore(5)
-    
-    async def detect_with_semaphore(device):
+    async def detect_with_semaphore(index: int, device: AutoDetectRequest):
         async with semaphore:
-            return await detect_one(device)
+            try:
+                return index, await _run_auto_detect(device, customer_id, agent_cache, cred_cache, pending_updates)
+            except Exception as e:
+                return index, {
+                    "address": device.address,
+                    "success": False,
+                    "error": str(e),
+                }
     
-    tasks = [detect_with_semaphore(d) for d in data.devices]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    tasks = [detect_with_semaphore(i, d) for i, d in enumerate(data.devices)]
     
-    # Processa risultati
-    processed = []
+    # Processa i risultati man mano che arrivano (mantenendo l'ordine dei device)
+    processed = [None] * len(tasks)
     success_count = 0
     identified_count = 0
     
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            processed.append({
-                "address": data.devices[i].address,
-                "success": False,
-                "error": str(result),
-            })
-        else:
-            processed.append(result)
-            if result.get("success"):
-                success_count += 1
-            if result.get("identified"):
-                identified_count += 1
+    for next_done in asyncio.as_completed(tasks):
+        index, result = await next_done
+        processed[index] = result
+        if result.get("success"):
+            success_count += 1
+        if result.get("identified"):
+            identified_count += 1
+    
+    # Un'unica transazione per i salvataggi di tutti i device
+    if pending_updates:
+        try:
+            with get_customer_service()._session_scope() as session:
+                session.bulk_update_mappings(InventoryDevice, [mapping for _, mapping in pending_updates])
+            _invalidate_device_list()
+            for result, _ in pending_updates:
+                result["saved"] = True
+            logger.info("Auto-detect batch: saved results for {} devices", len(pending_updates))
+        except Exception as save_err:
+            logger.error(f"Failed to save auto-detect batch results: {save_err}", exc_info=True)
+            for result, _ in pending_updates:
+                result["save_error"] = str(save_err)
     
     return {
         "success": True,
@@ -637,35 +787,27 @@ async def probe_multiple_devices(
     """
     Esegue probe su più dispositivi in parallelo.
     """
-    from ..services.device_probe_service import get_device_probe_service
-    from ..services.customer_service import get_customer_service
     import asyncio
     
     probe_service = get_device_probe_service()
     customer_service = get_customer_service()
     
-    # Recupera credenziali comuni
+    # Recupera in una sola query credenziali comuni e specifiche dei device
     credentials_list = []
     credential_ids = data.credential_ids or []
     
-    if credential_ids:
-        for cred_id in credential_ids:
-            cred = customer_service.get_credential(cred_id, include_secrets=True)
-            if cred:
-                credentials_list.append({
-                    "id": cred.id,
-                    "name": cred.name,
-                    "type": cred.credential_type,
-                    "username": cred.username,
-                    "password": cred.password,
-                    "ssh_port": getattr(cred, 'ssh_port', 22),
-                    "ssh_private_key": getattr(cred, 'ssh_private_key', None),
-                    "snmp_community": getattr(cred, 'snmp_community', None),
-                    "snmp_version": getattr(cred, 'snmp_version', '2c'),
-                    "snmp_port": getattr(cred, 'snmp_port', 161),
-                    "wmi_domain": getattr(cred, 'wmi_domain', None),
-                    "mikrotik_api_port": getattr(cred, 'mikrotik_api_port', 8728),
-                })
+    all_cred_ids = list(credential_ids)
+    for device in data.devices:
+        if device.credential_ids:
+            all_cred_ids.extend(device.credential_ids)
+    creds_by_id = {
+        c.id: c for c in customer_service.get_credentials_bulk(all_cred_ids, include_secrets=True)
+    }
+    
+    for cred_id in credential_ids:
+        cred = creds_by_id.get(cred_id)
+        if cred:
+            credentials_list.append(_cred_to_probe_dict(cred))
     
     # Probe paralleli
     async def probe_one(device):
@@ -674,17 +816,9 @@ async def probe_multiple_devices(
             # Aggiungi credenziali specifiche per questo device
             for cred_id in device.credential_ids:
                 if cred_id not in credential_ids:
-                    cred = customer_service.get_credential(cred_id, include_secrets=True)
+                    cred = creds_by_id.get(cred_id)
                     if cred:
-                        device_creds.append({
-                            "id": cred.id,
-                            "name": cred.name,
-                            "type": cred.credential_type,
-                            "username": cred.username,
-                            "password": cred.password,
-                            "ssh_port": getattr(cred, 'ssh_port', 22),
-                            "snmp_community": getattr(cred, 'snmp_community', None),
-                        })
+                        device_creds.append(_cred_to_probe_dict(cred))
         
         return await probe_service.auto_identify_device(
             address=device.address,
@@ -695,33 +829,36 @@ async def probe_multiple_devices(
     tasks = [probe_one(d) for d in data.devices]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
-    # Formatta risultati
+    # Formatta risultati (contando errori nello stesso passaggio)
     formatted = []
+    errors = 0
     for device, result in zip(data.devices, results):
         if isinstance(result, Exception):
-            formatted.append({
+            result = {
                 "address": device.address,
                 "mac_address": device.mac_address,
                 "error": str(result),
-            })
-        else:
-            formatted.append(result)
+            }
+        if result.get("error"):
+            errors += 1
+        formatted.append(result)
     
     return {
         "success": True,
         "results": formatted,
-        "probed": len([r for r in formatted if not r.get("error")]),
-        "errors": len([r for r in formatted if r.get("error")]),
+        "probed": len(formatted) - errors,
+        "errors": errors,
     }
 
 
 @router.get("/detect-protocols/{address}")
 async def detect_protocols(address: str):
     """Rileva quali protocolli sono disponibili su un host"""
-    from ..services.device_probe_service import get_device_probe_service
 
     probe_service = get_device_probe_service()
-    protocols = await probe_service.detect_available_protocols(address)
+    protocols = await _protocols_cache.get_or_set(
+        address, lambda: probe_service.detect_available_protocols(address)
+    )
 
     return {
         "success": True,
@@ -736,12 +873,13 @@ async def scan_ports_for_address(address: str):
     Scansiona le porte TCP/UDP di un indirizzo IP.
     Restituisce l'elenco delle porte aperte con relativi servizi.
     """
-    from ..services.device_probe_service import get_device_probe_service
 
     probe_service = get_device_probe_service()
     
     try:
-        open_ports = await probe_service.scan_services(address)
+        open_ports = await _scan_cache.get_or_set(
+            address, lambda: probe_service.scan_services(address)
+        )
         
         # Filtra solo porte aperte
         active_ports = [p for p in open_ports if p.get("open")]
@@ -754,7 +892,7 @@ async def scan_ports_for_address(address: str):
             "services": [p["service"] for p in active_ports if p.get("service")],
         }
     except Exception as e:
-        logger.error(f"Error scanning ports for {address}: {e}")
+        logger.error("Error scanning ports for {}: {}", address, e)
         return {
             "success": False,
             "address": address,
@@ -774,10 +912,11 @@ async def suggest_credential_type(address: str):
     - Se risponde a 22 (SSH) ma non SNMP e non WMI -> ssh (Linux)
     - Se risponde a 8728 (RouterOS API) -> mikrotik
     """
-    from ..services.device_probe_service import get_device_probe_service
 
     probe_service = get_device_probe_service()
-    suggested_type = await probe_service.suggest_credential_type(address)
+    suggested_type = await _credential_type_cache.get_or_set(
+        address, lambda: probe_service.suggest_credential_type(address)
+    )
 
     return {
         "success": True,
@@ -789,10 +928,11 @@ async def suggest_credential_type(address: str):
 @router.get("/reverse-dns/{address}")
 async def reverse_dns_lookup(address: str):
     """Esegue reverse DNS lookup per ottenere hostname da IP"""
-    from ..services.device_probe_service import get_device_probe_service
 
     probe_service = get_device_probe_service()
-    hostname = await probe_service.reverse_dns_lookup(address)
+    hostname = await _rdns_cache.get_or_set(
+        address, lambda: probe_service.reverse_dns_lookup(address)
+    )
 
     return {
         "success": True,
@@ -805,6 +945,52 @@ async def reverse_dns_lookup(address: str):
 # INVENTORY CRUD
 # ==========================================
 
+# Colonne lette dalla lista dispositivi (select diretta, senza caricare l'intero record)
+_DEVICE_LIST_COLUMNS = (
+    InventoryDevice.id, InventoryDevice.customer_id, InventoryDevice.name,
+    InventoryDevice.hostname, InventoryDevice.domain, InventoryDevice.device_type,
+    InventoryDevice.category, InventoryDevice.manufacturer, InventoryDevice.model,
+    InventoryDevice.primary_ip, InventoryDevice.primary_mac, InventoryDevice.mac_address,
+    InventoryDevice.status, InventoryDevice.os_family, InventoryDevice.os_version,
+    InventoryDevice.last_seen, InventoryDevice.dude_device_id, InventoryDevice.tags,
+    InventoryDevice.credential_id, InventoryDevice.open_ports, InventoryDevice.identified_by,
+    InventoryDevice.serial_number, InventoryDevice.cpu_model, InventoryDevice.cpu_cores,
+    InventoryDevice.ram_total_gb,
+)
+# Chiavi JSON delle righe della lista, nello stesso ordine della select
+_DEVICE_LIST_KEYS = tuple(c.key for c in _DEVICE_LIST_COLUMNS) + ("credential_name", "credential_type")
+
+# Righe per blocco lette dal cursore durante lo streaming della lista dispositivi
+_DEVICE_LIST_FETCH = 100
+
+# Valori per singola query IN (IP dell'import, ID dei batch), sotto il limite parametri di SQLite
+_IN_CHUNK = 500
+
+# Dispositivi inseriti per transazione nell'import massivo
+_IMPORT_BATCH = 500
+
+# Risultati della scansione porte batch salvati per transazione
+_SCAN_COMMIT_BATCH = 100
+
+# Router MikroTik configurati in parallelo dal monitoraggio batch
+_MONITORING_MAX_ROUTERS = 5
+
+
+def _with_device_filters(stmt, customer_id, device_type, status):
+    """
+    Aggiunge i filtri della lista dispositivi a un lambda_stmt.
+    I valori sono parametri legati: l'SQL compilato è riusato tra le richieste
+    con la stessa combinazione di filtri.
+    """
+    if customer_id:
+        stmt += lambda s: s.where(InventoryDevice.customer_id == customer_id)
+    if device_type:
+        stmt += lambda s: s.where(InventoryDevice.device_type == device_type)
+    if status:
+        stmt += lambda s: s.where(InventoryDevice.status == status)
+    return stmt
+
+
 @router.get("/devices")
 async def list_inventory_devices(
     customer_id: Optional[str] = Query(None),
@@ -812,275 +998,274 @@ async def list_inventory_devices(
     status: Optional[str] = Query(None),
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    after_name: Optional[str] = Query(None),  # Paginazione keyset: nome/id dell'ultimo device della pagina precedente
+    after_id: Optional[str] = Query(None),
+    include_total: bool = Query(False),  # Forza il conteggio anche oltre la prima pagina
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Lista dispositivi inventariati"""
-    from ..models.database import init_db, get_session, Credential
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
+    """
+    Lista dispositivi inventariati.
+    Il totale è calcolato sulla prima pagina (o con include_total) e tenuto
+    in cache per pochi secondi; le pagine successive lo riportano se ancora
+    in cache, altrimenti None. Per pagine profonde usare after_name/after_id
+    (valori next_after_* della risposta precedente) al posto di offset.
+    """
+    from ..models.database import Credential
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    # Risposta identica già calcolata di recente (polling della UI)
+    cache_key = (customer_id, device_type, status, limit, offset, after_name, after_id, include_total)
+    cached = _device_list_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
     
-    try:
-        query = session.query(InventoryDevice)
-        
-        if customer_id:
-            query = query.filter(InventoryDevice.customer_id == customer_id)
-        if device_type:
-            query = query.filter(InventoryDevice.device_type == device_type)
-        if status:
-            query = query.filter(InventoryDevice.status == status)
-        
-        total = query.count()
-        devices = query.order_by(InventoryDevice.name).offset(offset).limit(limit).all()
-        
-        # Prepara dict delle credenziali per lookup veloce
-        cred_ids = [d.credential_id for d in devices if d.credential_id]
-        credentials_map = {}
-        if cred_ids:
-            creds = session.query(Credential).filter(Credential.id.in_(cred_ids)).all()
-            credentials_map = {c.id: {"name": c.name, "type": c.credential_type} for c in creds}
-        
-        return {
-            "total": total,
-            "limit": limit,
-            "offset": offset,
-            "devices": [
-                {
-                    "id": d.id,
-                    "customer_id": d.customer_id,
-                    "name": d.name,
-                    "hostname": d.hostname,
-                    "domain": d.domain,
-                    "device_type": d.device_type,
-                    "category": d.category,
-                    "manufacturer": d.manufacturer,
-                    "model": d.model,
-                    "primary_ip": d.primary_ip,
-                    "primary_mac": d.primary_mac,
-                    "mac_address": d.mac_address or d.primary_mac,  # Usa mac_address se disponibile, altrimenti primary_mac
-                    "status": d.status,
-                    "os_family": d.os_family,
-                    "os_version": d.os_version,
-                    "last_seen": d.last_seen.isoformat() if d.last_seen else None,
-                    "dude_device_id": d.dude_device_id,
-                    "tags": d.tags,
-                    "credential_id": d.credential_id,
-                    "credential_name": credentials_map.get(d.credential_id, {}).get("name") if d.credential_id else None,
-                    "credential_type": credentials_map.get(d.credential_id, {}).get("type") if d.credential_id else None,
-                    "open_ports": d.open_ports,  # Porte aperte
-                    "identified_by": d.identified_by,  # Metodo identificazione
-                    "serial_number": d.serial_number,
-                    "cpu_model": d.cpu_model,
-                    "cpu_cores": d.cpu_cores,
-                    "ram_total_gb": d.ram_total_gb,
-                }
-                for d in devices
-            ]
-        }
-    finally:
-        session.close()
+    count_key = (customer_id, device_type, status)
+    total = _device_count_cache.get(count_key)
+    if total is None and (include_total or (offset == 0 and after_name is None)):
+        count_stmt = _with_device_filters(
+            lambda_stmt(lambda: select(func.count(InventoryDevice.id))),
+            customer_id, device_type, status,
+        )
+        total = (await db.execute(count_stmt)).scalar()
+        _device_count_cache.set(count_key, total)
+    
+    # Solo le colonne esposte, come tuple: niente oggetti ORM da idratare.
+    # Nome e tipo della credenziale arrivano con la stessa query (outer join)
+    stmt = _with_device_filters(
+        lambda_stmt(lambda: select(
+            *_DEVICE_LIST_COLUMNS,
+            Credential.name.label("credential_name"),
+            Credential.credential_type.label("credential_type"),
+        ).outerjoin(Credential, Credential.id == InventoryDevice.credential_id)),
+        customer_id, device_type, status,
+    )
+    if after_name is not None:
+        # Keyset su (name, id): nessuna scansione delle righe saltate
+        if after_id is not None:
+            stmt += lambda s: s.where(or_(
+                InventoryDevice.name > after_name,
+                and_(InventoryDevice.name == after_name, InventoryDevice.id > after_id),
+            ))
+        else:
+            stmt += lambda s: s.where(InventoryDevice.name > after_name)
+        offset = 0
+    stmt += lambda s: s.order_by(InventoryDevice.name, InventoryDevice.id).offset(offset).limit(limit)
+    
+    # Righe lette a blocchi di _DEVICE_LIST_FETCH e scritte nella risposta man mano
+    rows = await db.stream(stmt, execution_options={"yield_per": _DEVICE_LIST_FETCH})
+    
+    async def render():
+        # Valori già tipi JSON: ogni riga è serializzata una volta sola, niente jsonable_encoder.
+        # I pezzi sono tenuti anche per la cache della risposta completa
+        parts = []
+        head = json.dumps({"total": total, "limit": limit, "offset": offset}, separators=(",", ":"))
+        parts.append(f'{head[:-1]},"devices":['.encode())
+        yield parts[-1]
+        
+        count = 0
+        last = None
+        async for row in rows:
+            item = dict(zip(_DEVICE_LIST_KEYS, row))
+            item["mac_address"] = item["mac_address"] or item["primary_mac"]  # Usa mac_address se disponibile, altrimenti primary_mac
+            if item["last_seen"] is not None:
+                item["last_seen"] = item["last_seen"].isoformat()
+            parts.append((b"," if count else b"") + json.dumps(item, separators=(",", ":")).encode())
+            yield parts[-1]
+            count += 1
+            last = row
+        
+        if count < limit:
+            last = None
+        tail = json.dumps({
+            "next_after_name": last.name if last else None,
+            "next_after_id": last.id if last else None,
+        }, separators=(",", ":"))
+        parts.append(f"],{tail[1:]}".encode())
+        yield parts[-1]
+        
+        _device_list_cache.set(cache_key, b"".join(parts))
+    
+    return StreamingResponse(render(), media_type="application/json")
 
 
 @router.get("/devices/{device_id}")
-async def get_inventory_device(device_id: str):
+async def get_inventory_device(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """Dettagli singolo dispositivo"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import (
-        InventoryDevice, NetworkInterface, DiskInfo, 
-        InstalledSoftware, ServiceInfo,
-        WindowsDetails, LinuxDetails, MikroTikDetails, NetworkDeviceDetails
-    )
-    from ..config import get_settings
+    # Relazioni caricate subito (in async non ci sono lazy load): dettagli 1:1 in join,
+    # collezioni con una SELECT IN ciascuna
+    device = (await db.execute(
+        select(InventoryDevice).options(
+            selectinload(InventoryDevice.network_interfaces),
+            selectinload(InventoryDevice.disks),
+            joinedload(InventoryDevice.windows_details),
+            joinedload(InventoryDevice.linux_details),
+            joinedload(InventoryDevice.mikrotik_details),
+        ).where(InventoryDevice.id == device_id)
+    )).scalars().first()
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    if not device:
+        raise HTTPException(status_code=404, detail="Dispositivo non trovato")
     
-    try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Dispositivo non trovato")
-        
-        # Base info
-        result = {
-            "id": device.id,
-            "customer_id": device.customer_id,
-            "name": device.name,
-            "hostname": device.hostname,
-            "domain": device.domain,
-            "device_type": device.device_type,
-            "category": device.category,
-            "manufacturer": device.manufacturer,
-            "model": device.model,
-            "serial_number": device.serial_number,
-            "asset_tag": device.asset_tag,
-            "primary_ip": device.primary_ip,
-            "primary_mac": device.primary_mac,
-            "mac_address": device.mac_address or device.primary_mac,
-            "site_name": device.site_name,
-            "location": device.location,
-            "status": device.status,
-            "monitor_source": device.monitor_source,
-            "dude_device_id": device.dude_device_id,
-            "last_seen": device.last_seen.isoformat() if device.last_seen else None,
-            "last_scan": device.last_scan.isoformat() if device.last_scan else None,
-            "os_family": device.os_family,
-            "os_version": device.os_version,
-            "os_build": device.os_build,
-            "architecture": device.architecture,
-            "cpu_model": device.cpu_model,
-            "cpu_cores": device.cpu_cores,
-            "cpu_threads": device.cpu_threads,
-            "ram_total_gb": device.ram_total_gb,
-            "description": device.description,
-            "notes": device.notes,
-            "tags": device.tags,
-            "custom_fields": device.custom_fields,
-            "open_ports": device.open_ports,
-            "identified_by": device.identified_by,
-            "credential_used": device.credential_used,
-            "credential_id": device.credential_id,
-            "created_at": device.created_at.isoformat() if device.created_at else None,
-            "updated_at": device.updated_at.isoformat() if device.updated_at else None,
+    # Base info
+    result = {
+        "id": device.id,
+        "customer_id": device.customer_id,
+        "name": device.name,
+        "hostname": device.hostname,
+        "domain": device.domain,
+        "device_type": device.device_type,
+        "category": device.category,
+        "manufacturer": device.manufacturer,
+        "model": device.model,
+        "serial_number": device.serial_number,
+        "asset_tag": device.asset_tag,
+        "primary_ip": device.primary_ip,
+        "primary_mac": device.primary_mac,
+        "mac_address": device.mac_address or device.primary_mac,
+        "site_name": device.site_name,
+        "location": device.location,
+        "status": device.status,
+        "monitor_source": device.monitor_source,
+        "dude_device_id": device.dude_device_id,
+        "last_seen": device.last_seen.isoformat() if device.last_seen else None,
+        "last_scan": device.last_scan.isoformat() if device.last_scan else None,
+        "os_family": device.os_family,
+        "os_version": device.os_version,
+        "os_build": device.os_build,
+        "architecture": device.architecture,
+        "cpu_model": device.cpu_model,
+        "cpu_cores": device.cpu_cores,
+        "cpu_threads": device.cpu_threads,
+        "ram_total_gb": device.ram_total_gb,
+        "description": device.description,
+        "notes": device.notes,
+        "tags": device.tags,
+        "custom_fields": device.custom_fields,
+        "open_ports": device.open_ports,
+        "identified_by": device.identified_by,
+        "credential_used": device.credential_used,
+        "credential_id": device.credential_id,
+        "created_at": device.created_at.isoformat() if device.created_at else None,
+        "updated_at": device.updated_at.isoformat() if device.updated_at else None,
+    }
+    
+    # Network interfaces
+    result["network_interfaces"] = [
+        {
+            "name": n.name,
+            "mac_address": n.mac_address,
+            "ip_addresses": n.ip_addresses,
+            "speed_mbps": n.speed_mbps,
+            "admin_status": n.admin_status,
         }
-        
-        # Network interfaces
-        result["network_interfaces"] = [
-            {
-                "name": n.name,
-                "mac_address": n.mac_address,
-                "ip_addresses": n.ip_addresses,
-                "speed_mbps": n.speed_mbps,
-                "admin_status": n.admin_status,
-            }
-            for n in device.network_interfaces
-        ]
-        
-        # Disks
-        result["disks"] = [
-            {
-                "name": d.name,
-                "mount_point": d.mount_point,
-                "size_gb": d.size_gb,
-                "used_gb": d.used_gb,
-                "filesystem": d.filesystem,
-            }
-            for d in device.disks
-        ]
-        
-        # Type-specific details
-        if device.device_type == "windows" and device.windows_details:
-            wd = device.windows_details
-            result["windows_details"] = {
-                "edition": wd.edition,
-                "domain_role": wd.domain_role,
-                "domain_name": wd.domain_name,
-                "last_update_check": wd.last_update_check.isoformat() if wd.last_update_check else None,
-                "antivirus_name": wd.antivirus_name,
-                "antivirus_status": wd.antivirus_status,
-            }
-        
-        if device.device_type == "linux" and device.linux_details:
-            ld = device.linux_details
-            result["linux_details"] = {
-                "distro_name": ld.distro_name,
-                "distro_version": ld.distro_version,
-                "kernel_version": ld.kernel_version,
-                "docker_installed": ld.docker_installed,
-                "containers_running": ld.containers_running,
-            }
-        
-        if device.device_type == "mikrotik" and device.mikrotik_details:
-            md = device.mikrotik_details
-            result["mikrotik_details"] = {
-                "routeros_version": md.routeros_version,
-                "board_name": md.board_name,
-                "license_level": md.license_level,
-                "cpu_load": md.cpu_load,
-                "memory_free_mb": md.memory_free_mb,
-                "uptime": md.uptime,
-            }
-        
-        return result
-        
-    finally:
-        session.close()
+        for n in device.network_interfaces
+    ]
+    
+    # Disks
+    result["disks"] = [
+        {
+            "name": d.name,
+            "mount_point": d.mount_point,
+            "size_gb": d.size_gb,
+            "used_gb": d.used_gb,
+            "filesystem": d.filesystem,
+        }
+        for d in device.disks
+    ]
+    
+    # Type-specific details
+    if device.device_type == "windows" and device.windows_details:
+        wd = device.windows_details
+        result["windows_details"] = {
+            "edition": wd.edition,
+            "domain_role": wd.domain_role,
+            "domain_name": wd.domain_name,
+            "last_update_check": wd.last_update_check.isoformat() if wd.last_update_check else None,
+            "antivirus_name": wd.antivirus_name,
+            "antivirus_status": wd.antivirus_status,
+        }
+    
+    if device.device_type == "linux" and device.linux_details:
+        ld = device.linux_details
+        result["linux_details"] = {
+            "distro_name": ld.distro_name,
+            "distro_version": ld.distro_version,
+            "kernel_version": ld.kernel_version,
+            "docker_installed": ld.docker_installed,
+            "containers_running": ld.containers_running,
+        }
+    
+    if device.device_type == "mikrotik" and device.mikrotik_details:
+        md = device.mikrotik_details
+        result["mikrotik_details"] = {
+            "routeros_version": md.routeros_version,
+            "board_name": md.board_name,
+            "license_level": md.license_level,
+            "cpu_load": md.cpu_load,
+            "memory_free_mb": md.memory_free_mb,
+            "uptime": md.uptime,
+        }
+    
+    return result
 
 
 @router.post("/devices")
 async def create_inventory_device(
     customer_id: str,
     device: DeviceImport,
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Crea nuovo dispositivo inventariato"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
+    # Determina nome
+    name = device.name or device.identity or device.address or "Unknown"
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
-    
-    try:
-        # Determina nome
-        name = device.name or device.identity or device.address or "Unknown"
-        
-        # Controlla duplicati per IP
-        if device.address:
-            existing = session.query(InventoryDevice).filter(
+    # Controlla duplicati per IP
+    if device.address:
+        existing_id = (await db.execute(
+            select(InventoryDevice.id).where(
                 InventoryDevice.customer_id == customer_id,
                 InventoryDevice.primary_ip == device.address
-            ).first()
-            
-            if existing:
-                return {
-                    "success": False,
-                    "error": "duplicate",
-                    "message": f"Dispositivo con IP {device.address} già presente",
-                    "existing_id": existing.id,
-                }
-        
-        # Crea dispositivo
-        new_device = InventoryDevice(
-            customer_id=customer_id,
-            name=name,
-            hostname=device.identity,
-            device_type=device.device_type,
-            category=device.category,
-            primary_ip=device.address,
-            primary_mac=device.mac_address,
-            mac_address=device.mac_address,  # Alias per retrocompatibilità
-            manufacturer=device.platform if device.platform else None,
-            model=device.board,
-            os_family=device.os_family if hasattr(device, 'os_family') else None,
-            os_version=device.os_version if hasattr(device, 'os_version') else None,
-            identified_by=device.identified_by if hasattr(device, 'identified_by') else None,
-            credential_used=device.credential_used if hasattr(device, 'credential_used') else None,
-            open_ports=device.open_ports if hasattr(device, 'open_ports') else None,
-            status="unknown",
-            last_seen=datetime.now(),
-        )
-        
-        session.add(new_device)
-        session.commit()
-        
-        return {
-            "success": True,
-            "device_id": new_device.id,
-            "name": new_device.name,
-            "message": f"Dispositivo {name} creato",
-        }
+            ).limit(1)
+        )).scalar()
         
-    finally:
-        session.close()
+        if existing_id is not None:
+            return {
+                "success": False,
+                "error": "duplicate",
+                "message": f"Dispositivo con IP {device.address} già presente",
+                "existing_id": existing_id,
+            }
+    
+    # Crea dispositivo
+    new_device = InventoryDevice(
+        customer_id=customer_id,
+        name=name,
+        hostname=device.identity,
+        device_type=device.device_type,
+        category=device.category,
+        primary_ip=device.address,
+        primary_mac=device.mac_address,
+        mac_address=device.mac_address,  # Alias per retrocompatibilità
+        manufacturer=device.platform if device.platform else None,
+        model=device.board,
+        os_family=device.os_family,
+        os_version=device.os_version,
+        identified_by=device.identified_by,
+        credential_used=device.credential_used,
+        open_ports=device.open_ports,
+        status="unknown",
+        last_seen=datetime.now(),
+    )
+    
+    db.add(new_device)
+    await db.commit()
+    _invalidate_device_list()
+    
+    return {
+        "success": True,
+        "device_id": new_device.id,
+        "name": new_device.name,
+        "message": f"Dispositivo {name} creato",
+    }
 
 
 @router.post("/devices/bulk-import")
@@ -1088,123 +1273,121 @@ async def bulk_import_devices(
     customer_id: str,
     data: BulkImport,
     skip_duplicates: bool = Query(True),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Importa più dispositivi nell'inventario"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
+    # IP già presenti, cercati solo tra quelli del batch (non tutto l'inventario del cliente)
+    existing_ips = set()
+    if skip_duplicates:
+        batch_ips = list({d.address for d in data.devices if d.address})
+        for i in range(0, len(batch_ips), _IN_CHUNK):
+            existing_ips.update((await db.execute(
+                select(InventoryDevice.primary_ip).where(
+                    InventoryDevice.customer_id == customer_id,
+                    InventoryDevice.primary_ip.in_(batch_ips[i:i + _IN_CHUNK])
+                )
+            )).scalars())
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    imported = 0
+    skipped = 0
+    skipped_no_mac = 0
+    errors = []
+    # Righe da inserire, scritte con INSERT multipli da _IMPORT_BATCH righe,
+    # ciascuno nella propria transazione (transazioni e WAL di dimensione limitata)
+    mappings = []
+    now = datetime.now()
+    # Argomenti del log per dispositivo valutati solo se il livello DEBUG è attivo
+    debug_log = logger.opt(lazy=True)
     
-    try:
-        # Ottieni IP esistenti
-        existing_ips = set()
-        if skip_duplicates:
-            existing = session.query(InventoryDevice.primary_ip).filter(
-                InventoryDevice.customer_id == customer_id,
-                InventoryDevice.primary_ip.isnot(None)
-            ).all()
-            existing_ips = {e[0] for e in existing}
-        
-        imported = 0
-        skipped = 0
-        skipped_no_mac = 0
-        errors = []
-        
-        for device in data.devices:
-            try:
-                # MAC address è opzionale - non bloccare se mancante
-                has_mac = device.mac_address and device.mac_address.strip() != ''
-                if not has_mac:
-                    skipped_no_mac += 1  # Conta ma non blocca
-                
-                # Skip se IP già presente
-                if device.address and device.address in existing_ips:
-                    skipped += 1
-                    continue
-                
-                # Determina il nome: priorità a name, poi hostname, poi identity, poi address
-                name = device.name or device.hostname or device.identity or device.address or "Unknown"
-                
-                # Determina hostname: priorità a hostname, poi identity
-                hostname = device.hostname or device.identity or None
+    for device in data.devices:
+        try:
+            # MAC address è opzionale - non bloccare se mancante
+            has_mac = device.mac_address and device.mac_address.strip() != ''
+            if not has_mac:
+                skipped_no_mac += 1  # Conta ma non blocca
+            
+            # Skip se IP già presente
+            if device.address and device.address in existing_ips:
+                skipped += 1
+                continue
+            
+            fields = device.model_dump()
+            
+            # Determina il nome: priorità a name, poi hostname, poi identity, poi address
+            name = fields["name"] or fields["hostname"] or fields["identity"] or fields["address"] or "Unknown"
+            
+            # Determina hostname: priorità a hostname, poi identity
+            hostname = fields["hostname"] or fields["identity"] or None
 
-                new_device = InventoryDevice(
-                    customer_id=customer_id,
-                    name=name,
-                    hostname=hostname,
-                    device_type=device.device_type,
-                    category=device.category,
-                    primary_ip=device.address,
-                    primary_mac=device.mac_address,
-                    mac_address=device.mac_address,  # Alias per retrocompatibilità
-                    manufacturer=device.platform if device.platform else None,
-                    model=device.board,
-                    os_family=device.os_family if hasattr(device, 'os_family') else None,
-                    os_version=device.os_version if hasattr(device, 'os_version') else None,
-                    identified_by=device.identified_by if hasattr(device, 'identified_by') else None,
-                    credential_used=device.credential_used if hasattr(device, 'credential_used') else None,
-                    open_ports=device.open_ports if hasattr(device, 'open_ports') else None,
-                    status="unknown",
-                    last_seen=datetime.now(),
-                )
-                
-                logger.debug(f"Importing device: {name} ({device.address}) - hostname: {hostname}, ports: {len(device.open_ports or [])}")
-                
-                session.add(new_device)
-                imported += 1
+            mappings.append(dict(
+                customer_id=customer_id,
+                name=name,
+                hostname=hostname,
+                device_type=fields["device_type"],
+                category=fields["category"],
+                primary_ip=fields["address"],
+                primary_mac=fields["mac_address"],
+                mac_address=fields["mac_address"],  # Alias per retrocompatibilità
+                manufacturer=fields["platform"] or None,
+                model=fields["board"],
+                os_family=fields["os_family"],
+                os_version=fields["os_version"],
+                identified_by=fields["identified_by"],
+                credential_used=fields["credential_used"],
+                open_ports=fields["open_ports"],
+                status="unknown",
+                last_seen=now,
+            ))
+            
+            debug_log.debug("Importing device: {} ({}) - hostname: {}, ports: {}", lambda: name, lambda: device.address, lambda: hostname, lambda: len(device.open_ports or []))
+            
+            imported += 1
+            
+            if device.address:
+                existing_ips.add(device.address)
                 
-                if device.address:
-                    existing_ips.add(device.address)
-                    
-            except Exception as e:
-                errors.append(f"{device.address}: {str(e)}")
-        
-        session.commit()
-        
-        return {
-            "success": True,
-            "imported": imported,
-            "skipped": skipped,
-            "without_mac": skipped_no_mac,  # Info only, not skipped
-            "errors": errors,
-            "message": f"Importati {imported} dispositivi ({skipped_no_mac} senza MAC), {skipped} duplicati",
-        }
-        
-    finally:
-        session.close()
+        except Exception as e:
+            errors.append(f"{device.address}: {str(e)}")
+        
+        if len(mappings) >= _IMPORT_BATCH:
+            # INSERT multiplo ORM (applica i default delle colonne, es. id)
+            await db.execute(insert(InventoryDevice), mappings)
+            await db.commit()
+            mappings = []
+    
+    if mappings:
+        await db.execute(insert(InventoryDevice), mappings)
+    await db.commit()
+    _invalidate_device_list()
+    
+    return {
+        "success": True,
+        "imported": imported,
+        "skipped": skipped,
+        "without_mac": skipped_no_mac,  # Info only, not skipped
+        "errors": errors,
+        "message": f"Importati {imported} dispositivi ({skipped_no_mac} senza MAC), {skipped} duplicati",
+    }
 
 
 @router.delete("/devices/clear")
-async def clear_inventory(customer_id: Optional[str] = Query(None)):
+async def clear_inventory(customer_id: Optional[str] = Query(None), db: AsyncSession = Depends(get_async_db)):
     """Elimina tutti i dispositivi dall'inventario di un cliente"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
-
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    # Validazione prima di qualsiasi accesso al DB (la sessione si connette al primo execute)
+    if not customer_id:
+        raise HTTPException(status_code=400, detail="customer_id è richiesto")
 
     try:
-        # Costruisci query
-        query = session.query(InventoryDevice)
-
-        if customer_id:
-            query = query.filter(InventoryDevice.customer_id == customer_id)
-        else:
-            raise HTTPException(status_code=400, detail="customer_id è richiesto")
-
-        # Conta e elimina
-        count = query.count()
-        query.delete(synchronize_session=False)
-        session.commit()
+        # Un solo DELETE: il numero di righe eliminate lo riporta il DB
+        result = await db.execute(
+            delete(InventoryDevice).where(InventoryDevice.customer_id == customer_id),
+            execution_options={"synchronize_session": False},
+        )
+        count = result.rowcount
+        await db.commit()
+        _invalidate_device_list()
 
-        logger.info(f"Cleared {count} devices from inventory for customer {customer_id}")
+        logger.info("Cleared {} devices from inventory for customer {}", count, customer_id)
 
         return {
             "success": True,
@@ -1213,11 +1396,9 @@ async def clear_inventory(customer_id: Optional[str] = Query(None)):
         }
 
     except Exception as e:
-        session.rollback()
-        logger.error(f"Error clearing inventory: {e}")
+        await db.rollback()
+        logger.error("Error clearing inventory: {}", e)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        session.close()
 
 
 # ==========================================
@@ -1225,25 +1406,14 @@ async def clear_inventory(customer_id: Optional[str] = Query(None)):
 # ==========================================
 
 @router.post("/devices/{device_id}/scan-ports")
-async def scan_device_ports(device_id: str):
+async def scan_device_ports(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     Riesegue la scansione delle porte per un dispositivo inventariato.
     Aggiorna il campo open_ports nel database.
     """
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..services.device_probe_service import get_device_probe_service
-    from ..config import get_settings
-    
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
-    
     try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
+        # Solo l'IP: open_ports e last_seen vengono solo scritti
+        device = await db.get(InventoryDevice, device_id, options=[load_only(InventoryDevice.primary_ip)])
         
         if not device:
             raise HTTPException(status_code=404, detail="Dispositivo non trovato")
@@ -1258,27 +1428,27 @@ async def scan_device_ports(device_id: str):
         # Aggiorna dispositivo
         device.open_ports = open_ports
         device.last_seen = datetime.now()
-        session.commit()
+        await db.commit()
+        _invalidate_device_list()
         
-        logger.info(f"Port scan completed for device {device_id} ({device.primary_ip}): {len([p for p in open_ports if p.get('open')])} ports open")
+        open_count = sum(1 for p in open_ports if p.get('open'))
+        logger.info("Port scan completed for device {} ({}): {} ports open", device_id, device.primary_ip, open_count)
         
         return {
             "success": True,
             "device_id": device_id,
             "address": device.primary_ip,
             "open_ports": open_ports,
-            "open_count": len([p for p in open_ports if p.get('open')]),
-            "message": f"Scansione completata: {len([p for p in open_ports if p.get('open')])} porte aperte"
+            "open_count": open_count,
+            "message": f"Scansione completata: {open_count} porte aperte"
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        session.rollback()
-        logger.error(f"Error scanning ports for device {device_id}: {e}")
+        await db.rollback()
+        logger.error("Error scanning ports for device {}: {}", device_id, e)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        session.close()
 
 
 class BatchPortScanRequest(BaseModel):
@@ -1290,36 +1460,35 @@ class BatchPortScanRequest(BaseModel):
 async def batch_scan_device_ports(
     customer_id: Optional[str] = Query(None),
     data: Optional[BatchPortScanRequest] = None,
+    max_concurrency: Optional[int] = Query(None, ge=1, le=64),  # Se None, usa settings.port_scan_max_concurrency
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Riesegue la scansione delle porte per più dispositivi inventariati.
     Se customer_id è specificato, scansiona tutti i device del cliente.
     Se data.device_ids è specificato, scansiona solo quei device.
     """
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..services.device_probe_service import get_device_probe_service
-    from ..config import get_settings
     import asyncio
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
-    
     try:
-        # Determina quali device scansionare
-        query = session.query(InventoryDevice).filter(
+        # Determina quali device scansionare (solo id e IP: nessun oggetto ORM nella sessione)
+        stmt = select(InventoryDevice.id, InventoryDevice.primary_ip).where(
             InventoryDevice.primary_ip.isnot(None)
         )
         
         if customer_id:
-            query = query.filter(InventoryDevice.customer_id == customer_id)
+            stmt = stmt.where(InventoryDevice.customer_id == customer_id)
         
         if data and data.device_ids:
-            query = query.filter(InventoryDevice.id.in_(data.device_ids))
-        
-        devices = query.all()
+            # ID a blocchi: un IN enorme supera il limite parametri del driver
+            device_ids = list(dict.fromkeys(data.device_ids))
+            devices = []
+            for i in range(0, len(device_ids), _IN_CHUNK):
+                devices.extend((await db.execute(
+                    stmt.where(InventoryDevice.id.in_(device_ids[i:i + _IN_CHUNK]))
+                )).all())
+        else:
+            devices = (await db.execute(stmt)).all()
         
         if not devices:
             return {
@@ -1332,45 +1501,73 @@ async def batch_scan_device_ports(
         # Esegui scansione in parallelo
         probe_service = get_device_probe_service()
         
-        async def scan_one_device(device):
+        # Scansioni contemporanee limitate: il numero di socket aperti resta costante
+        # qualunque sia la dimensione del batch
+        semaphore = asyncio.Semaphore(max_concurrency or get_settings().port_scan_max_concurrency)
+        
+        async def scan_one_device(device_id: str, address: str):
             """Scansiona un singolo device"""
             try:
-                open_ports = await probe_service.scan_services(device.primary_ip)
-                device.open_ports = open_ports
-                device.last_seen = datetime.now()
+                async with semaphore:
+                    open_ports = await probe_service.scan_services(address)
                 return {
-                    "device_id": device.id,
-                    "address": device.primary_ip,
+                    "device_id": device_id,
+                    "address": address,
                     "success": True,
-                    "open_count": len([p for p in open_ports if p.get('open')]),
+                    "open_ports": open_ports,
                 }
             except Exception as e:
-                logger.error(f"Error scanning {device.primary_ip}: {e}")
+                logger.error("Error scanning {}: {}", address, e)
                 return {
-                    "device_id": device.id,
-                    "address": device.primary_ip,
+                    "device_id": device_id,
+                    "address": address,
                     "success": False,
                     "error": str(e),
                 }
         
-        # Esegui scansioni in parallelo (max 10 alla volta)
-        tasks = [scan_one_device(d) for d in devices]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # UPDATE per chiave primaria eseguito come un solo executemany per blocco
+        save_stmt = (
+            update(InventoryDevice.__table__)
+            .where(InventoryDevice.__table__.c.id == bindparam("b_id"))
+            .values(open_ports=bindparam("b_open_ports"), last_seen=bindparam("b_last_seen"))
+        )
+        
+        async def save_results(rows: list):
+            """Salva un blocco di risultati"""
+            # Un solo timestamp per blocco (i risultati arrivano a pochi istanti l'uno dall'altro)
+            now = datetime.now()
+            for row in rows:
+                row["b_last_seen"] = now
+            await db.execute(save_stmt, rows)
+        
+        # Esegui scansioni in parallelo; i risultati sono salvati man mano che
+        # arrivano, a blocchi di _SCAN_COMMIT_BATCH righe
+        tasks = [scan_one_device(device_id, address) for device_id, address in devices]
         
-        # Processa risultati
         scanned = 0
         errors = []
-        for result in results:
-            if isinstance(result, Exception):
-                errors.append(str(result))
-            elif result.get("success"):
-                scanned += 1
-            else:
-                errors.append(f"{result.get('address', 'unknown')}: {result.get('error', 'unknown error')}")
+        pending_updates = []
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if not result["success"]:
+                errors.append(f"{result['address']}: {result['error']}")
+                continue
+            scanned += 1
+            pending_updates.append({
+                "b_id": result["device_id"],
+                "b_open_ports": result["open_ports"],
+            })
+            if len(pending_updates) >= _SCAN_COMMIT_BATCH:
+                await save_results(pending_updates)
+                await db.commit()
+                pending_updates = []
         
-        session.commit()
+        if pending_updates:
+            await save_results(pending_updates)
+        await db.commit()
+        _invalidate_device_list()
         
-        logger.info(f"Batch port scan completed: {scanned}/{len(devices)} devices scanned")
+        logger.info("Batch port scan completed: {}/{} devices scanned", scanned, len(devices))
         
         return {
             "success": True,
@@ -1381,127 +1578,86 @@ async def batch_scan_device_ports(
         }
         
     except Exception as e:
-        session.rollback()
-        logger.error(f"Error in batch port scan: {e}")
+        await db.rollback()
+        logger.error("Error in batch port scan: {}", e)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        session.close()
 
 
 @router.delete("/devices/{device_id}")
-async def delete_inventory_device(device_id: str):
+async def delete_inventory_device(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """Elimina dispositivo dall'inventario"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
+    device = await db.get(InventoryDevice, device_id)
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    if not device:
+        raise HTTPException(status_code=404, detail="Dispositivo non trovato")
     
-    try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Dispositivo non trovato")
-        
-        name = device.name
-        session.delete(device)
-        session.commit()
-        
-        return {
-            "success": True,
-            "message": f"Dispositivo {name} eliminato",
-        }
-        
-    finally:
-        session.close()
+    name = device.name
+    await db.delete(device)
+    await db.commit()
+    _invalidate_device_list()
+    
+    return {
+        "success": True,
+        "message": f"Dispositivo {name} eliminato",
+    }
 
 
 @router.put("/devices/{device_id}")
-async def update_inventory_device(device_id: str, updates: dict):
+async def update_inventory_device(device_id: str, updates: dict, db: AsyncSession = Depends(get_async_db)):
     """Aggiorna dispositivo"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
+    device = await db.get(InventoryDevice, device_id)
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    if not device:
+        raise HTTPException(status_code=404, detail="Dispositivo non trovato")
     
-    try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Dispositivo non trovato")
-        
-        # PRESERVA credential_id esistente se non viene esplicitamente passato nell'update
-        existing_credential_id = device.credential_id
-        
-        # Campi aggiornabili
-        allowed_fields = [
-            'name', 'hostname', 'device_type', 'category', 'manufacturer',
-            'model', 'serial_number', 'asset_tag', 'site_name', 'location',
-            'description', 'notes', 'tags', 'status', 'credential_id',
-            'os_family', 'os_version', 'domain'
-        ]
-        
-        for field, value in updates.items():
-            if field in allowed_fields:
-                # Protezione speciale per credential_id: preserva se non viene esplicitamente passato o se viene passato None
-                if field == 'credential_id':
-                    # Permetti solo se viene esplicitamente passato un valore non-None
-                    # Se viene passato None o non viene passato, preserva quello esistente
-                    if value is not None:
-                        setattr(device, field, value)
-                    # Se value è None, non fare nulla (preserva esistente)
-                else:
+    # PRESERVA credential_id esistente se non viene esplicitamente passato nell'update
+    existing_credential_id = device.credential_id
+    
+    # Campi aggiornabili
+    allowed_fields = [
+        'name', 'hostname', 'device_type', 'category', 'manufacturer',
+        'model', 'serial_number', 'asset_tag', 'site_name', 'location',
+        'description', 'notes', 'tags', 'status', 'credential_id',
+        'os_family', 'os_version', 'domain'
+    ]
+    
+    for field, value in updates.items():
+        if field in allowed_fields:
+            # Protezione speciale per credential_id: preserva se non viene esplicitamente passato o se viene passato None
+            if field == 'credential_id':
+                # Permetti solo se viene esplicitamente passato un valore non-None
+                # Se viene passato None o non viene passato, preserva quello esistente
+                if value is not None:
                     setattr(device, field, value)
-        
-        # Assicurati che credential_id non venga perso accidentalmente
-        if device.credential_id != existing_credential_id and 'credential_id' not in updates:
-            logger.warning(f"Preserving existing credential_id {existing_credential_id} for device {device_id} (was about to be lost)")
-            device.credential_id = existing_credential_id
-        
-        session.commit()
-        
-        return {
-            "success": True,
-            "message": f"Dispositivo {device.name} aggiornato",
-        }
-        
-    finally:
-        session.close()
+                # Se value è None, non fare nulla (preserva esistente)
+            else:
+                setattr(device, field, value)
+    
+    # Assicurati che credential_id non venga perso accidentalmente
+    if device.credential_id != existing_credential_id and 'credential_id' not in updates:
+        logger.warning("Preserving existing credential_id {} for device {} (was about to be lost)", existing_credential_id, device_id)
+        device.credential_id = existing_credential_id
+    
+    await db.commit()
+    _invalidate_device_list()
+    
+    return {
+        "success": True,
+        "message": f"Dispositivo {device.name} aggiornato",
+    }
 
 
 @router.post("/devices/{device_id}/monitoring")
-async def configure_device_monitoring(device_id: str, config: dict):
+async def configure_device_monitoring(device_id: str, config: dict, db: AsyncSession = Depends(get_async_db)):
     """
     Configura il monitoraggio per un dispositivo.
     
     monitoring_type: none, netwatch, agent
     """
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    import asyncio
     
     try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
+        device = await db.get(InventoryDevice, device_id)
         
         if not device:
             raise HTTPException(status_code=404, detail="Dispositivo non trovato")
@@ -1530,7 +1686,9 @@ async def configure_device_monitoring(device_id: str, config: dict):
                     agent = customer_service.get_agent(device.monitoring_agent_id, include_password=True)
                     if agent and agent.agent_type == "mikrotik":
                         mikrotik_service = get_mikrotik_service()
-                        mikrotik_service.remove_netwatch(
+                        # RouterOS API sincrona: in un thread per non bloccare l'event loop
+                        await asyncio.to_thread(
+                            mikrotik_service.remove_netwatch,
                             address=agent.address,
                             port=agent.port or 8728,
                             username=agent.username or "admin",
@@ -1538,9 +1696,9 @@ async def configure_device_monitoring(device_id: str, config: dict):
                             netwatch_id=device.netwatch_id,
                             use_ssl=agent.use_ssl or False,
                         )
-                        logger.info(f"Rimosso Netwatch {device.netwatch_id} da {agent.name}")
+                        logger.info("Rimosso Netwatch {} da {}", device.netwatch_id, agent.name)
                 except Exception as e:
-                    logger.warning(f"Errore rimozione Netwatch: {e}")
+                    logger.warning("Errore rimozione Netwatch: {}", e)
             
             device.monitored = False
             device.monitoring_type = "none"
@@ -1550,12 +1708,9 @@ async def configure_device_monitoring(device_id: str, config: dict):
         elif monitoring_type == "netwatch":
             # Configura Netwatch su MikroTik
             # Cerca una sonda MikroTik per questo cliente
-            agents = customer_service.list_agents(customer_id=customer_id, active_only=True)
-            mikrotik_agent = None
-            for ag in agents:
-                if ag.agent_type == "mikrotik":
-                    mikrotik_agent = customer_service.get_agent(ag.id, include_password=True)
-                    break
+            mikrotik_agent = next(iter(customer_service.list_agents(
+                customer_id=customer_id, active_only=True, agent_type="mikrotik", include_password=True, limit=1,
+            )), None)
             
             if not mikrotik_agent:
                 return {
@@ -1567,13 +1722,14 @@ async def configure_device_monitoring(device_id: str, config: dict):
             
             try:
                 # Aggiungi o aggiorna Netwatch
-                netwatch_result = mikrotik_service.add_netwatch(
+                netwatch_result = await asyncio.to_thread(
+                    mikrotik_service.add_netwatch,
                     address=mikrotik_agent.address,
                     port=mikrotik_agent.port or 8728,
                     username=mikrotik_agent.username or "admin",
                     password=mikrotik_agent.password or "",
-                    target_ip=device.primary_ip,
-                    target_name=device.name or device.hostname or device.primary_ip,
+                    host=device.primary_ip,
+                    comment=device.name or device.hostname or device.primary_ip,
                     interval="30s",
                     use_ssl=mikrotik_agent.use_ssl or False,
                 )
@@ -1585,32 +1741,27 @@ async def configure_device_monitoring(device_id: str, config: dict):
                     device.netwatch_id = netwatch_result.get("netwatch_id")
                     result["netwatch_configured"] = True
                     result["mikrotik_name"] = mikrotik_agent.name
-                    logger.info(f"Netwatch configurato per {device.primary_ip} su {mikrotik_agent.name}")
+                    logger.info("Netwatch configurato per {} su {}", device.primary_ip, mikrotik_agent.name)
                 else:
                     result["success"] = False
                     result["error"] = netwatch_result.get("error", "Errore configurazione Netwatch")
                     
             except Exception as e:
-                logger.error(f"Errore configurazione Netwatch: {e}")
+                logger.error("Errore configurazione Netwatch: {}", e)
                 result["success"] = False
                 result["error"] = str(e)
                 
         elif monitoring_type == "agent":
             # Configura monitoring via Docker agent
-            agents = customer_service.list_agents(customer_id=customer_id, active_only=True)
             docker_agent = None
-            for ag in agents:
-                if ag.agent_type == "docker":
-                    docker_agent = customer_service.get_agent(ag.id, include_password=True)
+            # Docker, con fallback a MikroTik se non c'è Docker
+            for agent_type in ("docker", "mikrotik"):
+                docker_agent = next(iter(customer_service.list_agents(
+                    customer_id=customer_id, active_only=True, agent_type=agent_type, include_password=True, limit=1,
+                )), None)
+                if docker_agent:
                     break
             
-            if not docker_agent:
-                # Fallback a MikroTik se non c'è Docker
-                for ag in agents:
-                    if ag.agent_type == "mikrotik":
-                        docker_agent = customer_service.get_agent(ag.id, include_password=True)
-                        break
-            
             if not docker_agent:
                 return {
                     "success": False,
@@ -1622,207 +1773,240 @@ async def configure_device_monitoring(device_id: str, config: dict):
             device.monitoring_agent_id = docker_agent.id
             result["agent_configured"] = True
             result["agent_name"] = docker_agent.name
-            logger.info(f"Agent monitoring configurato per {device.primary_ip} via {docker_agent.name}")
+            logger.info("Agent monitoring configurato per {} via {}", device.primary_ip, docker_agent.name)
         
-        session.commit()
+        await db.commit()
+        _invalidate_device_list()
         return result
         
     except Exception as e:
-        session.rollback()
-        logger.error(f"Errore configurazione monitoring: {e}")
+        await db.rollback()
+        logger.error("Errore configurazione monitoring: {}", e)
         raise HTTPException(status_code=500, detail=str(e))
-        
-    finally:
-        session.close()
+
+
+class BatchMonitoringRequest(BaseModel):
+    """Schema per configurazione monitoraggio batch"""
+    device_ids: List[str]
+    monitoring_type: str = "netwatch"
+
+
+@router.post("/devices/batch-monitoring")
+async def batch_configure_monitoring(data: BatchMonitoringRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Configura Netwatch per più dispositivi.
+    I dispositivi sono raggruppati per sonda MikroTik del cliente: ogni router
+    riceve tutte le sue voci in una sola sessione API, con al massimo
+    _MONITORING_MAX_ROUTERS router configurati in parallelo.
+    """
+    import asyncio
+    
+    if data.monitoring_type != "netwatch":
+        raise HTTPException(status_code=400, detail="Configurazione batch supportata solo per monitoring_type netwatch")
+    
+    stmt = select(InventoryDevice).options(load_only(
+        InventoryDevice.customer_id, InventoryDevice.name,
+        InventoryDevice.hostname, InventoryDevice.primary_ip,
+    ))
+    device_ids = list(dict.fromkeys(data.device_ids))
+    devices = []
+    for i in range(0, len(device_ids), _IN_CHUNK):
+        devices.extend((await db.execute(
+            stmt.where(InventoryDevice.id.in_(device_ids[i:i + _IN_CHUNK]))
+        )).scalars())
+    
+    found_ids = {device.id for device in devices}
+    results = [
+        {"device_id": device_id, "success": False, "error": "Dispositivo non trovato"}
+        for device_id in data.device_ids if device_id not in found_ids
+    ]
+    
+    # Sonda MikroTik per cliente (una query per cliente) e dispositivi per sonda
+    customer_service = get_customer_service()
+    agent_by_customer = {}
+    by_agent = {}
+    for device in devices:
+        if not device.primary_ip:
+            results.append({"device_id": device.id, "success": False, "error": "Dispositivo senza IP"})
+            continue
+        if device.customer_id not in agent_by_customer:
+            agent_by_customer[device.customer_id] = next(iter(customer_service.list_agents(
+                customer_id=device.customer_id, active_only=True, agent_type="mikrotik", include_password=True, limit=1,
+            )), None)
+        agent = agent_by_customer[device.customer_id]
+        if not agent:
+            results.append({"device_id": device.id, "success": False, "error": "Nessuna sonda MikroTik configurata per questo cliente"})
+            continue
+        by_agent.setdefault(agent.id, (agent, []))[1].append(device)
+    
+    mikrotik_service = get_mikrotik_service()
+    semaphore = asyncio.Semaphore(_MONITORING_MAX_ROUTERS)
+    
+    async def provision(agent, agent_devices):
+        """Aggiunge i Netwatch di una sonda (API RouterOS sincrona, in un thread)"""
+        async with semaphore:
+            return await asyncio.to_thread(
+                mikrotik_service.add_netwatch_batch,
+                address=agent.address,
+                port=agent.port or 8728,
+                username=agent.username or "admin",
+                password=agent.password or "",
+                hosts=[
+                    {"host": device.primary_ip, "comment": device.name or device.hostname or device.primary_ip}
+                    for device in agent_devices
+                ],
+                interval="30s",
+                use_ssl=agent.use_ssl or False,
+            )
+    
+    groups = list(by_agent.values())
+    outcomes = await asyncio.gather(*(provision(agent, agent_devices) for agent, agent_devices in groups))
+    
+    configured = 0
+    for (agent, agent_devices), agent_results in zip(groups, outcomes):
+        for device, netwatch_result in zip(agent_devices, agent_results):
+            if netwatch_result["success"]:
+                device.monitored = True
+                device.monitoring_type = "netwatch"
+                device.monitoring_agent_id = agent.id
+                device.netwatch_id = netwatch_result.get("netwatch_id")
+                configured += 1
+                results.append({"device_id": device.id, "success": True, "mikrotik_name": agent.name})
+            else:
+                results.append({"device_id": device.id, "success": False, "error": netwatch_result.get("error")})
+    
+    await db.commit()
+    _invalidate_device_list()
+    
+    logger.info("Batch Netwatch configurato: {}/{} dispositivi su {} sonde", configured, len(data.device_ids), len(groups))
+    
+    return {
+        "success": True,
+        "configured": configured,
+        "total": len(data.device_ids),
+        "results": results,
+    }
+
+
+# Campi copiati dal risultato dell'identificazione sul dispositivo, in ordine:
+# (chiave risultato, attributo device, sovrascrive valore esistente, valore ignorato).
+# Le chiavi ripetute su uno stesso attributo non sovrascrivono (es. version poi os_version)
+_IDENTIFY_FIELDS = (
+    ("hostname", "hostname", False, None),
+    ("device_type", "device_type", True, "other"),
+    ("category", "category", True, None),
+    ("os_family", "os_family", True, None),
+    ("model", "model", True, None),
+    ("vendor", "manufacturer", True, None),
+    ("cpu_model", "cpu_model", True, None),
+    ("cpu_cores", "cpu_cores", True, None),
+    ("serial_number", "serial_number", True, None),
+    # OS Version - può venire da "version" (WMI) o altri campi
+    ("version", "os_version", False, None),
+    ("os_version", "os_version", False, None),
+    # Manufacturer - può venire da "manufacturer" (WMI) o "vendor" (MAC)
+    ("manufacturer", "manufacturer", False, None),
+    # Domain - può venire direttamente da WMI
+    ("domain", "domain", False, None),
+    ("architecture", "architecture", True, None),
+    # Porte aperte rilevate
+    ("open_ports", "open_ports", True, None),
+    ("identified_by", "identified_by", True, None),
+    ("credential_used", "credential_used", True, None),
+)
 
 
 @router.post("/devices/{device_id}/identify")
 async def identify_inventory_device(
     device_id: str,
     credential_ids: List[str] = Query(default=[]),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Ri-identifica un dispositivo esistente e aggiorna automaticamente le info.
     """
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
-    from ..services.device_probe_service import get_device_probe_service
-    from ..services.customer_service import get_customer_service
+    device = await db.get(InventoryDevice, device_id)
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    if not device:
+        raise HTTPException(status_code=404, detail="Dispositivo non trovato")
     
-    try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Dispositivo non trovato")
-        
-        # Prepara credenziali
-        credentials_list = []
-        if credential_ids:
-            customer_service = get_customer_service()
-            for cred_id in credential_ids:
-                cred = customer_service.get_credential(cred_id, include_secrets=True)
-                if cred:
-                    credentials_list.append({
-                        "id": cred.id,
-                        "name": cred.name,
-                        "type": cred.credential_type,
-                        "username": cred.username,
-                        "password": cred.password,
-                        "ssh_port": getattr(cred, 'ssh_port', 22),
-                        "snmp_community": getattr(cred, 'snmp_community', None),
-                        "snmp_version": getattr(cred, 'snmp_version', '2c'),
-                        "snmp_port": getattr(cred, 'snmp_port', 161),
-                        "wmi_domain": getattr(cred, 'wmi_domain', None),
-                        "mikrotik_api_port": getattr(cred, 'mikrotik_api_port', 8728),
-                    })
-        
-        # Esegui probe
-        probe_service = get_device_probe_service()
-        result = await probe_service.auto_identify_device(
-            address=device.primary_ip,
-            mac_address=device.primary_mac,
-            credentials_list=credentials_list
-        )
-        
-        # PRESERVA credential_id esistente - NON sovrascriverlo!
-        # Il credential_id viene gestito solo tramite l'interfaccia utente o durante la creazione del device
-        existing_credential_id = device.credential_id
-        
-        # Aggiorna dispositivo con info identificate
-        updates_applied = []
-        
-        if result.get("hostname") and not device.hostname:
-            device.hostname = result["hostname"]
-            updates_applied.append("hostname")
-        
-        if result.get("device_type") and result["device_type"] != "other":
-            device.device_type = result["device_type"]
-            updates_applied.append("device_type")
-        
-        if result.get("category"):
-            device.category = result["category"]
-            updates_applied.append("category")
-        
-        if result.get("os_family"):
-            device.os_family = result["os_family"]
-            updates_applied.append("os_family")
-        
-        if result.get("model"):
-            device.model = result["model"]
-            updates_applied.append("model")
-        
-        if result.get("vendor"):
-            device.manufacturer = result["vendor"]
-            updates_applied.append("manufacturer")
-        
-        # Hardware Info
-        if result.get("cpu_model"):
-            device.cpu_model = result["cpu_model"]
-            updates_applied.append("cpu_model")
-            
-        if result.get("cpu_cores"):
-            device.cpu_cores = result["cpu_cores"]
-            updates_applied.append("cpu_cores")
-            
-        if result.get("memory_total_mb"):
-            device.ram_total_gb = round(result["memory_total_mb"] / 1024, 2)
-            updates_applied.append("ram_total_gb")
-            
-        if result.get("serial_number"):
-            device.serial_number = result["serial_number"]
-            updates_applied.append("serial_number")
-            
-        # OS Version - può venire da "version" (WMI) o altri campi
-        if result.get("version") and not device.os_version:
-            device.os_version = result["version"]
-            updates_applied.append("os_version")
-        elif result.get("os_version") and not device.os_version:
-            device.os_version = result["os_version"]
-            updates_applied.append("os_version")
-
-        # Disk info
-        if result.get("disk_total_gb"):
-            # Salva in custom_fields o in un campo specifico se disponibile
-            if not device.custom_fields:
-                device.custom_fields = {}
-            device.custom_fields["disk_total_gb"] = result["disk_total_gb"]
-            device.custom_fields["disk_free_gb"] = result.get("disk_free_gb")
-            updates_applied.append("disk_info")
-            
-        # Manufacturer - può venire da "manufacturer" (WMI) o "vendor" (MAC)
-        if result.get("manufacturer") and not device.manufacturer:
-            device.manufacturer = result["manufacturer"]
-            updates_applied.append("manufacturer")
-            
-        # Domain - può venire direttamente da WMI
-        if result.get("domain") and not device.domain:
-            device.domain = result["domain"]
-            updates_applied.append("domain")
-            
-        # Architecture
-        if result.get("architecture"):
-            device.architecture = result["architecture"]
-            updates_applied.append("architecture")
-        
-        # Assicurati che credential_id non venga perso
-        if existing_credential_id and device.credential_id != existing_credential_id:
-            logger.warning(f"Preserving existing credential_id {existing_credential_id} for device {device_id}")
-            device.credential_id = existing_credential_id
-
-        # Salva porte aperte rilevate
-        if result.get("open_ports"):
-            device.open_ports = result["open_ports"]
-            updates_applied.append("open_ports")
-
-        # Estrai dominio da hostname se non già impostato
-        if not device.domain and result.get("hostname") and "." in result["hostname"]:
-            parts = result["hostname"].split(".", 1)
-            if len(parts) > 1:
-                device.domain = parts[1]
-                updates_applied.append("domain_from_hostname")
-        
-        # Nome OS completo (da WMI: "Windows 10 Pro", etc.)
-        if result.get("name") and "Windows" in result.get("name", ""):
-            # Salva il nome OS completo in description o custom_fields
-            if not device.description:
-                device.description = result["name"]
-                updates_applied.append("os_description")
-                
-        # Aggiorna identificato_by e credential_used
-        if result.get("identified_by"):
-            device.identified_by = result["identified_by"]
-            updates_applied.append("identified_by")
-            
-        if result.get("credential_used"):
-            device.credential_used = result["credential_used"]
-            updates_applied.append("credential_used")
-        
-        # Aggiorna last_seen
-        device.last_seen = datetime.now()
-        device.last_scan = datetime.now()
-        
-        logger.info(f"Device {device_id} identification complete. Updates: {updates_applied}")
-        
-        session.commit()
-        
-        return {
-            "success": True,
-            "device_id": device_id,
-            "probe_result": result,
-            "updates_applied": updates_applied,
-            "message": f"Dispositivo aggiornato: {', '.join(updates_applied)}" if updates_applied else "Nessun aggiornamento necessario"
-        }
-        
-    finally:
-        session.close()
+    # Prepara credenziali (una sola query per tutti gli ID)
+    credentials_list = [
+        _cred_to_probe_dict(cred)
+        for cred in get_customer_service().get_credentials_bulk(credential_ids, include_secrets=True)
+    ]
+    
+    # Esegui probe
+    probe_service = get_device_probe_service()
+    result = await probe_service.auto_identify_device(
+        address=device.primary_ip,
+        mac_address=device.primary_mac,
+        credentials_list=credentials_list
+    )
+    
+    # PRESERVA credential_id esistente - NON sovrascriverlo!
+    # Il credential_id viene gestito solo tramite l'interfaccia utente o durante la creazione del device
+    existing_credential_id = device.credential_id
+    
+    # Aggiorna dispositivo con info identificate
+    updates_applied = []
+    
+    for key, attr, overwrite, ignored in _IDENTIFY_FIELDS:
+        value = result.get(key)
+        if not value or value == ignored:
+            continue
+        if overwrite or not getattr(device, attr):
+            setattr(device, attr, value)
+            updates_applied.append(attr)
+    
+    # Hardware Info
+    if result.get("memory_total_mb"):
+        device.ram_total_gb = round(result["memory_total_mb"] / 1024, 2)
+        updates_applied.append("ram_total_gb")
+    
+    # Disk info
+    if result.get("disk_total_gb"):
+        # Salva in custom_fields o in un campo specifico se disponibile
+        if not device.custom_fields:
+            device.custom_fields = {}
+        device.custom_fields["disk_total_gb"] = result["disk_total_gb"]
+        device.custom_fields["disk_free_gb"] = result.get("disk_free_gb")
+        updates_applied.append("disk_info")
+    
+    # Assicurati che credential_id non venga perso
+    if existing_credential_id and device.credential_id != existing_credential_id:
+        logger.warning("Preserving existing credential_id {} for device {}", existing_credential_id, device_id)
+        device.credential_id = existing_credential_id
+    
+    # Estrai dominio da hostname se non già impostato
+    if not device.domain and result.get("hostname") and "." in result["hostname"]:
+        parts = result["hostname"].split(".", 1)
+        if len(parts) > 1:
+            device.domain = parts[1]
+            updates_applied.append("domain_from_hostname")
+    
+    # Nome OS completo (da WMI: "Windows 10 Pro", etc.)
+    if result.get("name") and "Windows" in result.get("name", ""):
+        # Salva il nome OS completo in description o custom_fields
+        if not device.description:
+            device.description = result["name"]
+            updates_applied.append("os_description")
+    
+    # Aggiorna last_seen
+    device.last_seen = device.last_scan = datetime.now()
+    
+    logger.info("Device {} identification complete. Updates: {}", device_id, updates_applied)
+    
+    await db.commit()
+    _invalidate_device_list()
+    
+    return {
+        "success": True,
+        "device_id": device_id,
+        "probe_result": result,
+        "updates_applied": updates_applied,
+        "message": f"Dispositivo aggiornato: {', '.join(updates_applied)}" if updates_applied else "Nessun aggiornamento necessario"
+    }
 
 
 # ==========================================
@@ -1830,126 +2014,95 @@ async def identify_inventory_device(
 # ==========================================
 
 @router.get("/stats")
-async def get_inventory_stats(customer_id: Optional[str] = None):
+async def get_inventory_stats(customer_id: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     """Statistiche inventario"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
-    from sqlalchemy import func
+    filters = []
+    if customer_id:
+        filters.append(InventoryDevice.customer_id == customer_id)
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    # Una sola scansione raggruppata per (tipo, stato); totale e conteggi per
+    # tipo e per stato sono ricavati dalle combinazioni
+    rows = (await db.execute(
+        select(InventoryDevice.device_type, InventoryDevice.status, func.count(InventoryDevice.id))
+        .where(*filters).group_by(InventoryDevice.device_type, InventoryDevice.status)
+    )).all()
     
-    try:
-        query = session.query(InventoryDevice)
-        
-        if customer_id:
-            query = query.filter(InventoryDevice.customer_id == customer_id)
-        
-        total = query.count()
-        
-        # Per tipo
-        by_type = session.query(
-            InventoryDevice.device_type,
-            func.count(InventoryDevice.id)
-        )
-        if customer_id:
-            by_type = by_type.filter(InventoryDevice.customer_id == customer_id)
-        by_type = dict(by_type.group_by(InventoryDevice.device_type).all())
-        
-        # Per stato
-        by_status = session.query(
-            InventoryDevice.status,
-            func.count(InventoryDevice.id)
-        )
-        if customer_id:
-            by_status = by_status.filter(InventoryDevice.customer_id == customer_id)
-        by_status = dict(by_status.group_by(InventoryDevice.status).all())
-        
-        return {
-            "total": total,
-            "by_type": by_type,
-            "by_status": by_status,
-        }
-        
-    finally:
-        session.close()
+    total = 0
+    by_type = {}
+    by_status = {}
+    for device_type, status, count in rows:
+        total += count
+        by_type[device_type] = by_type.get(device_type, 0) + count
+        by_status[status] = by_status.get(status, 0) + count
+    
+    return {
+        "total": total,
+        "by_type": by_type,
+        "by_status": by_status,
+    }
 
 
 # ==========================================
 # SYNC WITH THE DUDE
 # ==========================================
 
+# Tipo dispositivo inventario -> tipo The Dude (default "Generic Device")
+_DUDE_DEVICE_TYPES = {
+    "mikrotik": "RouterOS",
+    "windows": "Windows",
+    "linux": "Linux",
+    "network": "SNMP Device",
+    "switch": "SNMP Device",
+}
+
+
 @router.post("/devices/{device_id}/add-to-dude")
-async def add_device_to_dude(device_id: str):
+async def add_device_to_dude(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """Aggiunge dispositivo a The Dude per monitoraggio"""
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..services.dude_service import get_dude_service
-    from ..config import get_settings
+    device = await db.get(InventoryDevice, device_id, options=[load_only(
+        InventoryDevice.name, InventoryDevice.primary_ip, InventoryDevice.device_type, InventoryDevice.dude_device_id,
+    )])
     
-    settings = get_settings()
-    db_url = settings.database_url_sync_computed
-    engine = init_db(db_url)
-    session = get_session(engine)
+    if not device:
+        raise HTTPException(status_code=404, detail="Dispositivo non trovato")
     
-    try:
-        device = session.query(InventoryDevice).filter(
-            InventoryDevice.id == device_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Dispositivo non trovato")
-        
-        if not device.primary_ip:
-            raise HTTPException(status_code=400, detail="Dispositivo senza IP")
-        
-        if device.dude_device_id:
-            return {
-                "success": True,
-                "already_exists": True,
-                "dude_device_id": device.dude_device_id,
-                "message": "Dispositivo già in The Dude",
-            }
-        
-        # Aggiungi a The Dude
-        dude = get_dude_service()
-        
-        # Determina tipo dispositivo per Dude
-        dude_type = "Generic Device"
-        if device.device_type == "mikrotik":
-            dude_type = "RouterOS"
-        elif device.device_type == "windows":
-            dude_type = "Windows"
-        elif device.device_type == "linux":
-            dude_type = "Linux"
-        elif device.device_type in ["network", "switch"]:
-            dude_type = "SNMP Device"
-        
-        result = dude.add_device(
-            name=device.name,
-            address=device.primary_ip,
-            device_type=dude_type,
-        )
-        
-        if result:
-            # Aggiorna riferimento
-            device.dude_device_id = result
-            device.monitor_source = "dude"
-            session.commit()
-            
-            return {
-                "success": True,
-                "dude_device_id": result,
-                "message": f"Dispositivo {device.name} aggiunto a The Dude",
-            }
-        else:
-            return {
-                "success": False,
-                "message": "Errore aggiunta a The Dude",
-            }
-        
-    finally:
-        session.close()
+    if not device.primary_ip:
+        raise HTTPException(status_code=400, detail="Dispositivo senza IP")
+    
+    if device.dude_device_id:
+        return {
+            "success": True,
+            "already_exists": True,
+            "dude_device_id": device.dude_device_id,
+            "message": "Dispositivo già in The Dude",
+        }
+    
+    # Aggiungi a The Dude
+    dude = get_dude_service()
+    
+    # Determina tipo dispositivo per Dude
+    dude_type = _DUDE_DEVICE_TYPES.get(device.device_type, "Generic Device")
+    
+    result = dude.add_device(
+        name=device.name,
+        address=device.primary_ip,
+        device_type=dude_type,
+    )
+    
+    if result:
+        # Aggiorna riferimento
+        device.dude_device_id = result
+        device.monitor_source = "dude"
+        await db.commit()
+        _invalidate_device_list()
+    
+        return {
+            "success": True,
+            "dude_device_id": result,
+            "message": f"Dispositivo {device.name} aggiunto a The Dude",
+        }
+    else:
+        return {
+            "success": False,
+            "message": "Errore aggiunta a The Dude",
+        }
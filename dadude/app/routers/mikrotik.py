@@ -2,19 +2,142 @@
 DaDude - MikroTik Router Endpoints
 API per gestione MikroTik remoti e Dude Agent
 """
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional, List
+import asyncio
+import itertools
+import os
+import uuid
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..models.database import get_async_db
+from ..models.inventory import InventoryDevice
+from ..services.customer_service import get_customer_service, on_entity_changed
+from ..services.dude_agent_sync import get_dude_agent_sync_service
+from ..services.mikrotik_backup_collector import MikroTikBackupCollector
+from ..services.mikrotik_service import get_mikrotik_service, MikroTikConnSpec
+from ..utils.ttl_cache import TTLCache
 
+
+# Gli endpoint dichiarano il tipo di ritorno (Dict[str, Any]): da FastAPI 0.130 la
+# risposta è serializzata direttamente in JSON con Pydantic, senza jsonable_encoder
+# (nelle versioni precedenti il tipo aggiunge solo una validazione)
 router = APIRouter(prefix="/mikrotik", tags=["MikroTik"])
 
+# Sonde e credenziali (con segreti decifrati) usate dalle chiamate ai router:
+# TTL breve, i miss concorrenti sullo stesso ID fanno una sola query
+_agent_cache = TTLCache(maxsize=1024, ttl=30)
+_credential_cache = TTLCache(maxsize=1024, ttl=30)
+
+# Letture dei router (GET in sola lettura) per (metodo, agent_id): la UI in polling
+# e le richieste concorrenti sullo stesso router condividono una sola chiamata
+_read_cache = TTLCache(maxsize=4096, ttl=10)
+
+# Letture disponibili nel batch: chiave -> metodo di MikroTikRemoteService
+_BATCH_QUERIES = {
+    "system": "get_system_info",
+    "interfaces": "get_interfaces",
+    "ip-addresses": "get_ip_addresses",
+    "routes": "get_routes",
+    "firewall-stats": "get_firewall_stats",
+}
+
+# Metodi di sola lettura le cui risposte passano da _read_cache
+_CACHED_READS = (*_BATCH_QUERIES.values(), "get_dude_agent_status", "get_netwatch_list")
+
+# Tipi di credenziale utilizzabili per connettersi a un router MikroTik
+_SUPPORTED_CRED_TYPES = frozenset({"mikrotik", "ssh", "device"})
+
+# Tipi di connessione delle sonde che espongono la RouterOS API
+_API_CONN_TYPES = frozenset({"api", "both"})
+
+# Router interrogati in parallelo da un batch
+_BATCH_MAX_ROUTERS = 10
+
+# Job di IP scan: stato e risultato consultabili per 10 minuti dall'ultimo aggiornamento
+_scan_jobs = TTLCache(maxsize=256, ttl=600)
+# Riferimenti ai task in corso (il loop ne tiene solo riferimenti deboli)
+_scan_tasks: set = set()
+
+
+async def _get_agent(agent_id: str):
+    """Sonda con password (in cache); 404 se non esiste"""
+    async def load():
+        agent = await asyncio.to_thread(get_customer_service().get_agent, agent_id, include_password=True)
+        if not agent:
+            # L'eccezione non viene memorizzata: una sonda creata dopo è subito visibile
+            raise HTTPException(status_code=404, detail="Sonda non trovata")
+        return agent
+    
+    return await _agent_cache.get_or_set(agent_id, load)
+
+
+def _conn_kwargs(agent) -> dict:
+    """Parametri di connessione API RouterOS di una sonda"""
+    return {
+        "address": agent.address,
+        "port": agent.port,
+        "username": agent.username or "admin",
+        "password": agent.password or "",
+        "use_ssl": agent.use_ssl,
+    }
+
+
+async def _agent_conn(agent=Depends(_get_agent)) -> dict:
+    """Dependency: parametri di connessione della sonda {agent_id} (404 se non esiste)"""
+    return _conn_kwargs(agent)
+
+
+async def _cached_read(agent_id: str, method: str, conn: dict) -> Dict[str, Any]:
+    """Lettura dal router tramite MikroTikRemoteService.<method>, in cache per qualche secondo"""
+    key = (method, agent_id)
+    mikrotik = get_mikrotik_service()
+    result = await _read_cache.get_or_set(key, lambda: asyncio.to_thread(getattr(mikrotik, method), **conn))
+    if not result.get("success", True):
+        # Gli errori (router non raggiungibile, login fallito) non restano in cache
+        _read_cache.pop(key)
+    return result
+
+
+async def _get_credential(credential_id: str):
+    """Credenziale con segreti (in cache); 404 se non esiste"""
+    async def load():
+        credential = await asyncio.to_thread(get_customer_service().get_credential, credential_id, include_secrets=True)
+        if not credential:
+            raise HTTPException(status_code=404, detail="Credenziale non trovata")
+        return credential
+    
+    return await _credential_cache.get_or_set(credential_id, load)
+
+
+def _invalidate_entity(kind: str, entity_id: str) -> None:
+    """Rimuove dalle cache la sonda o credenziale indicata (e le letture della sonda)"""
+    if kind == "agent":
+        _agent_cache.pop(entity_id)
+        for method in _CACHED_READS:
+            _read_cache.pop((method, entity_id))
+    elif kind == "credential":
+        _credential_cache.pop(entity_id)
+
+
+# Modifiche ed eliminazioni via CustomerService invalidano subito i segreti in cache
+on_entity_changed(_invalidate_entity)
+
 
 # ==========================================
 # SCHEMAS
 # ==========================================
 
+class BatchSystemInfoRequest(BaseModel):
+    agent_ids: List[str]
+    include: List[str] = ["system"]  # Chiavi di _BATCH_QUERIES
+
+
 class NetwatchCreate(BaseModel):
     host: str
     port: Optional[int] = None
@@ -25,14 +148,32 @@ class NetwatchCreate(BaseModel):
     comment: Optional[str] = None
 
 
+@router.post("/cache/invalidate")
+async def invalidate_router_cache(
+    agent_id: Optional[str] = Query(None, description="Invalida solo questa sonda"),
+    credential_id: Optional[str] = Query(None, description="Invalida solo questa credenziale"),
+) -> Dict[str, Any]:
+    """Svuota la cache di sonde/credenziali e letture (tutta, o solo gli ID indicati)"""
+    if agent_id or credential_id:
+        if agent_id:
+            _invalidate_entity("agent", agent_id)
+        if credential_id:
+            _invalidate_entity("credential", credential_id)
+    else:
+        _agent_cache.clear()
+        _credential_cache.clear()
+        _read_cache.clear()
+    
+    return {"success": True}
+
+
 # ==========================================
 # DUDE AGENTS
 # ==========================================
 
 @router.post("/dude-agents/sync")
-async def sync_dude_agents():
+async def sync_dude_agents() -> Dict[str, Any]:
     """Sincronizza agent dal server The Dude"""
-    from ..services.dude_agent_sync import get_dude_agent_sync_service
     
     sync_service = get_dude_agent_sync_service()
     result = sync_service.sync_agents()
@@ -43,9 +184,8 @@ async def sync_dude_agents():
 @router.get("/dude-agents")
 async def list_dude_agents(
     customer_id: Optional[str] = Query(None, description="Filtra per cliente"),
-):
+) -> Dict[str, Any]:
     """Lista agent Dude sincronizzati"""
-    from ..services.dude_agent_sync import get_dude_agent_sync_service
     
     sync_service = get_dude_agent_sync_service()
     agents = sync_service.list_agents(customer_id=customer_id)
@@ -57,9 +197,8 @@ async def list_dude_agents(
 
 
 @router.get("/dude-agents/available")
-async def list_available_agents():
+async def list_available_agents() -> Dict[str, Any]:
     """Lista agent non ancora associati a clienti"""
-    from ..services.dude_agent_sync import get_dude_agent_sync_service
     
     sync_service = get_dude_agent_sync_service()
     agents = sync_service.get_available_agents()
@@ -71,9 +210,8 @@ async def list_available_agents():
 
 
 @router.post("/dude-agents/{agent_id}/assign/{customer_id}")
-async def assign_agent_to_customer(agent_id: str, customer_id: str):
+async def assign_agent_to_customer(agent_id: str, customer_id: str) -> Dict[str, Any]:
     """Associa agent Dude a un cliente"""
-    from ..services.dude_agent_sync import get_dude_agent_sync_service
     
     sync_service = get_dude_agent_sync_service()
     result = sync_service.assign_to_customer(agent_id, customer_id)
@@ -85,9 +223,8 @@ async def assign_agent_to_customer(agent_id: str, customer_id: str):
 
 
 @router.delete("/dude-agents/{agent_id}/unassign")
-async def unassign_agent_from_customer(agent_id: str):
+async def unassign_agent_from_customer(agent_id: str) -> Dict[str, Any]:
     """Rimuove associazione agent-cliente"""
-    from ..services.dude_agent_sync import get_dude_agent_sync_service
     
     sync_service = get_dude_agent_sync_service()
     result = sync_service.unassign_from_customer(agent_id)
@@ -102,84 +239,56 @@ async def unassign_agent_from_customer(agent_id: str):
 # ROUTER OPERATIONS (via Credentials - Direct)
 # ==========================================
 
+async def _credential_device_ip(db: AsyncSession, credential_id: str, device_ip: Optional[str]) -> Optional[str]:
+    """IP del router: device_ip esplicito, altrimenti primary_ip del primo device associato alla credenziale"""
+    if device_ip:
+        return device_ip
+    
+    address = (await db.execute(
+        select(InventoryDevice.primary_ip).where(
+            InventoryDevice.credential_id == credential_id,
+            InventoryDevice.primary_ip.isnot(None),
+        ).limit(1)
+    )).scalar_one_or_none()
+    if address:
+        logger.info("Found device IP {} for credential {}", address, credential_id)
+    return address
+
+
 @router.get("/credentials/{credential_id}/system-info")
 async def get_router_system_info_by_credential(
     credential_id: str,
-    device_ip: Optional[str] = Query(None, description="IP del device (se non nella credenziale)")
-):
+    device_ip: Optional[str] = Query(None, description="IP del device (se non nella credenziale)"),
+    db: AsyncSession = Depends(get_async_db),
+) -> Dict[str, Any]:
     """Ottiene informazioni sistema del router tramite credenziale"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    from ..models.database import init_db, get_session
-    from ..models.inventory import InventoryDevice
-    from ..config import get_settings
-    from loguru import logger
     
     try:
-        customer_service = get_customer_service()
-        credential = customer_service.get_credential(credential_id, include_secrets=True)
+        credential = await _get_credential(credential_id)
         
-        if not credential:
-            raise HTTPException(status_code=404, detail="Credenziale non trovata")
-        
-        if credential.credential_type not in ["mikrotik", "ssh", "device"]:
+        if credential.credential_type not in _SUPPORTED_CRED_TYPES:
             raise HTTPException(status_code=400, detail="Credenziale non supporta MikroTik")
         
         # Determina indirizzo: priorità a device_ip passato, poi cerca device associato, poi address nella credenziale
-        address = device_ip
-        
-        if not address:
-            # Cerca device associato a questa credenziale
-            settings = get_settings()
-            db_url = settings.database_url_sync_computed
-            engine = init_db(db_url)
-            session = get_session(engine)
-            try:
-                device = session.query(InventoryDevice).filter(
-                    InventoryDevice.credential_id == credential_id
-                ).first()
-                
-                if device and device.primary_ip:
-                    address = device.primary_ip
-                    logger.info(f"Found device IP {address} for credential {credential_id}")
-            finally:
-                session.close()
+        address = await _credential_device_ip(db, credential_id, device_ip)
         
-        # Se ancora non abbiamo l'indirizzo, prova a recuperarlo dalla credenziale (se esiste)
-        if not address:
-            address = getattr(credential, 'address', None)
+        # Se ancora non abbiamo l'indirizzo, usa quello della credenziale (se esiste);
+        # porta, utente e SSL secondo le priorità di MikroTikConnSpec
+        spec = MikroTikConnSpec.from_credential(credential, address)
         
-        if not address:
+        if not spec.address:
             raise HTTPException(
                 status_code=400, 
                 detail="Indirizzo IP non trovato. Fornire device_ip come parametro o associare la credenziale a un device."
             )
         
-        # Porta: priorità a mikrotik_api_port, poi port generico, poi default 8728
-        port = getattr(credential, 'mikrotik_api_port', None) or getattr(credential, 'port', None) or 8728
-        
-        # Username e password
-        username = credential.username or "admin"
-        password = credential.password or ""
-        
-        if not password:
+        if not spec.password:
             raise HTTPException(status_code=400, detail="Credenziale senza password")
         
-        # SSL: usa mikrotik_api_ssl se disponibile, altrimenti use_ssl generico
-        use_ssl = getattr(credential, 'mikrotik_api_ssl', None)
-        if use_ssl is None:
-            use_ssl = getattr(credential, 'use_ssl', False)
-        
-        logger.info(f"Connecting to MikroTik {address}:{port} with user {username} (SSL: {use_ssl})")
+        logger.info("Connecting to MikroTik {}:{} with user {} (SSL: {})", spec.address, spec.port, spec.username, spec.use_ssl)
         
         mikrotik = get_mikrotik_service()
-        result = mikrotik.get_system_info(
-            address=address,
-            port=port,
-            username=username,
-            password=password,
-            use_ssl=use_ssl,
-        )
+        result = await asyncio.to_thread(mikrotik.get_system_info, **spec.as_kwargs())
         
         return result
         
@@ -194,22 +303,32 @@ async def get_router_system_info_by_credential(
 async def backup_router_by_credential(
     credential_id: str,
     backup_type: str = Query("export", description="Tipo backup: export, binary, both"),
+    device_ip: Optional[str] = Query(None, description="IP del device (se non nella credenziale)"),
+    download: bool = Query(False, description="Restituisce l'export in streaming come file .rsc invece del JSON"),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Esegue backup configurazione router tramite credenziale"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_backup_collector import MikroTikBackupCollector
-    import os
-    
-    customer_service = get_customer_service()
-    credential = customer_service.get_credential(credential_id, include_secrets=True)
-    
-    if not credential:
-        raise HTTPException(status_code=404, detail="Credenziale non trovata")
+    """
+    Esegue backup configurazione router tramite credenziale.
+    Con download=true l'export viene inviato al client man mano che il
+    router lo produce (StreamingResponse), senza bufferizzarlo in memoria.
+    """
+    
+    if download and backup_type != "export":
+        raise HTTPException(status_code=400, detail="download supportato solo con backup_type=export")
+    
+    credential = await _get_credential(credential_id)
+    
+    host = await _credential_device_ip(db, credential_id, device_ip) or getattr(credential, "address", None)
+    if not host:
+        raise HTTPException(
+            status_code=400,
+            detail="Indirizzo IP non trovato. Fornire device_ip come parametro o associare la credenziale a un device."
+        )
     
     # Determina customer per path backup
     customer = None
     if credential.customer_id:
-        customer = customer_service.get_customer(credential.customer_id)
+        customer = await asyncio.to_thread(get_customer_service().get_customer, credential.customer_id)
     
     backup_path = None
     if customer:
@@ -217,8 +336,33 @@ async def backup_router_by_credential(
         backup_path = os.path.join(backup_base, customer.code or "default")
     
     collector = MikroTikBackupCollector()
-    result = collector.backup_configuration(
-        host=credential.address or "",
+    
+    if download:
+        chunks = collector.stream_export(
+            host=host,
+            username=credential.username or "admin",
+            password=credential.password or "",
+            port=credential.ssh_port or 22,
+            backup_path=backup_path,
+        )
+        # Il primo blocco apre la connessione SSH: gli errori diventano un 502
+        # prima di iniziare la risposta, non uno stream troncato
+        try:
+            first = await asyncio.to_thread(next, chunks, b"")
+        except Exception as e:
+            logger.error("Streamed export failed for {}: {}", host, e)
+            raise HTTPException(status_code=502, detail=f"Export fallito: {e}")
+        
+        # Iteratore sincrono: Starlette lo consuma nel threadpool
+        return StreamingResponse(
+            itertools.chain((first,), chunks),
+            media_type="text/plain; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{host}.rsc"'},
+        )
+    
+    result = await asyncio.to_thread(
+        collector.backup_configuration,
+        host=host,
         username=credential.username or "admin",
         password=credential.password or "",
         port=credential.ssh_port or 22,
@@ -233,179 +377,123 @@ async def backup_router_by_credential(
 # ROUTER OPERATIONS (via Agent Assignment)
 # ==========================================
 
-@router.get("/agents/{agent_id}/system-info")
-async def get_router_system_info(agent_id: str):
-    """Ottiene informazioni sistema del router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
+@router.post("/agents/batch/system-info")
+async def get_routers_system_info_batch(data: BatchSystemInfoRequest) -> Dict[str, Any]:
+    """
+    Informazioni di più router in una sola chiamata.
+    Sonde caricate con una query, router interrogati in parallelo;
+    ritorna {agent_id: {include: risultato}} o {agent_id: {"success": False, "error": ...}}.
+    """
+    
+    unknown = [key for key in data.include if key not in _BATCH_QUERIES]
+    if unknown or not data.include:
+        raise HTTPException(
+            status_code=400,
+            detail=f"include non valido: {', '.join(unknown) or '(vuoto)'}. Valori ammessi: {', '.join(_BATCH_QUERIES)}",
+        )
     
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
+    agent_ids = list(dict.fromkeys(data.agent_ids))
+    
+    # Sonde: cache, poi una sola query per quelle mancanti
+    agents = {}
+    missing = []
+    for agent_id in agent_ids:
+        agent = _agent_cache.get(agent_id)
+        if agent:
+            agents[agent_id] = agent
+        else:
+            missing.append(agent_id)
+    if missing:
+        loaded = await asyncio.to_thread(get_customer_service().get_agents_bulk, missing, include_password=True)
+        for agent in loaded:
+            _agent_cache.set(agent.id, agent)
+            agents[agent.id] = agent
+    
+    semaphore = asyncio.Semaphore(_BATCH_MAX_ROUTERS)
+    
+    async def fetch(agent):
+        if agent.connection_type not in _API_CONN_TYPES:
+            return {"success": False, "error": "Sonda non supporta API RouterOS"}
+        
+        kwargs = _conn_kwargs(agent)
+        async with semaphore:
+            # Stessa connessione in pool per le letture sullo stesso router
+            results = {}
+            for key in data.include:
+                results[key] = await _cached_read(agent.id, _BATCH_QUERIES[key], kwargs)
+            return results
+    
+    found = [agents[agent_id] for agent_id in agent_ids if agent_id in agents]
+    outcomes = await asyncio.gather(*(fetch(agent) for agent in found), return_exceptions=True)
+    
+    results = {agent_id: {"success": False, "error": "Sonda non trovata"} for agent_id in agent_ids}
+    for agent, outcome in zip(found, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("Batch system info failed for agent {}: {}", agent.id, outcome)
+            outcome = {"success": False, "error": str(outcome)}
+        results[agent.id] = outcome
     
-    if agent.connection_type not in ["api", "both"]:
+    return {
+        "count": len(results),
+        "results": results,
+    }
+
+
+@router.get("/agents/{agent_id}/system-info")
+async def get_router_system_info(agent_id: str, agent=Depends(_get_agent), conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
+    """Ottiene informazioni sistema del router"""
+    if agent.connection_type not in _API_CONN_TYPES:
         raise HTTPException(status_code=400, detail="Sonda non supporta API RouterOS")
     
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_system_info(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_system_info", conn)
 
 
 @router.get("/agents/{agent_id}/interfaces")
-async def get_router_interfaces(agent_id: str):
+async def get_router_interfaces(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Ottiene interfacce del router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_interfaces(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_interfaces", conn)
 
 
 @router.get("/agents/{agent_id}/ip-addresses")
-async def get_router_ip_addresses(agent_id: str):
+async def get_router_ip_addresses(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Ottiene indirizzi IP configurati"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_ip_addresses(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_ip_addresses", conn)
 
 
 @router.get("/agents/{agent_id}/routes")
-async def get_router_routes(agent_id: str):
+async def get_router_routes(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Ottiene tabella routing"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_routes(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_routes", conn)
 
 
 @router.get("/agents/{agent_id}/firewall-stats")
-async def get_router_firewall_stats(agent_id: str):
+async def get_router_firewall_stats(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Ottiene statistiche firewall"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_firewall_stats(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_firewall_stats", conn)
 
 
 @router.get("/agents/{agent_id}/dude-agent-status")
-async def get_router_dude_agent_status(agent_id: str):
+async def get_router_dude_agent_status(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Verifica stato Dude Agent sul router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_dude_agent_status(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_dude_agent_status", conn)
 
 
 @router.post("/agents/{agent_id}/configure-dude-agent")
 async def configure_router_dude_agent(
     agent_id: str,
+    conn: dict = Depends(_agent_conn),
     dude_server: str = Query(..., description="Indirizzo server The Dude"),
     enabled: bool = Query(True, description="Abilita agent"),
-):
+) -> Dict[str, Any]:
     """Configura Dude Agent sul router remoto"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
     mikrotik = get_mikrotik_service()
-    result = mikrotik.configure_dude_agent(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
+    result = await asyncio.to_thread(
+        mikrotik.configure_dude_agent,
+        **conn,
         dude_server=dude_server,
         enabled=enabled,
-        use_ssl=agent.use_ssl,
     )
+    _read_cache.pop(("get_dude_agent_status", agent_id))
     
     return result
 
@@ -415,47 +503,18 @@ async def configure_router_dude_agent(
 # ==========================================
 
 @router.get("/agents/{agent_id}/netwatch")
-async def list_router_netwatch(agent_id: str):
+async def list_router_netwatch(agent_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Lista netwatch configurati sul router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.get_netwatch_list(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        use_ssl=agent.use_ssl,
-    )
-    
-    return result
+    return await _cached_read(agent_id, "get_netwatch_list", conn)
 
 
 @router.post("/agents/{agent_id}/netwatch")
-async def add_router_netwatch(agent_id: str, netwatch: NetwatchCreate):
+async def add_router_netwatch(agent_id: str, netwatch: NetwatchCreate, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Aggiunge netwatch sul router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
     mikrotik = get_mikrotik_service()
-    result = mikrotik.add_netwatch(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
+    result = await asyncio.to_thread(
+        mikrotik.add_netwatch,
+        **conn,
         host=netwatch.host,
         target_port=netwatch.port,
         interval=netwatch.interval,
@@ -463,33 +522,22 @@ async def add_router_netwatch(agent_id: str, netwatch: NetwatchCreate):
         up_script=netwatch.up_script,
         down_script=netwatch.down_script,
         comment=netwatch.comment,
-        use_ssl=agent.use_ssl,
     )
+    _read_cache.pop(("get_netwatch_list", agent_id))
     
     return result
 
 
 @router.delete("/agents/{agent_id}/netwatch/{netwatch_id}")
-async def remove_router_netwatch(agent_id: str, netwatch_id: str):
+async def remove_router_netwatch(agent_id: str, netwatch_id: str, conn: dict = Depends(_agent_conn)) -> Dict[str, Any]:
     """Rimuove netwatch dal router"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
-    
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
-    
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
-    
     mikrotik = get_mikrotik_service()
-    result = mikrotik.remove_netwatch(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
+    result = await asyncio.to_thread(
+        mikrotik.remove_netwatch,
+        **conn,
         netwatch_id=netwatch_id,
-        use_ssl=agent.use_ssl,
     )
+    _read_cache.pop(("get_netwatch_list", agent_id))
     
     return result
 
@@ -498,33 +546,62 @@ async def remove_router_netwatch(agent_id: str, netwatch_id: str):
 # IP SCAN / DISCOVERY
 # ==========================================
 
-@router.post("/agents/{agent_id}/ip-scan")
+@router.post("/agents/{agent_id}/ip-scan", status_code=202)
 async def run_router_ip_scan(
     agent_id: str,
+    conn: dict = Depends(_agent_conn),
     network: str = Query(..., description="Rete da scansionare (CIDR)"),
     interface: Optional[str] = Query(None, description="Interfaccia da usare"),
-    duration: int = Query(30, description="Durata scansione in secondi"),
-):
-    """Esegue IP scan dal router remoto"""
-    from ..services.customer_service import get_customer_service
-    from ..services.mikrotik_service import get_mikrotik_service
+    duration: int = Query(30, ge=1, le=300, description="Durata scansione in secondi"),
+) -> Dict[str, Any]:
+    """
+    Avvia IP scan dal router remoto in background.
+    Ritorna subito job_id; il risultato si legge da GET /agents/{agent_id}/ip-scan/{job_id}.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "agent_id": agent_id,
+        "network": network,
+        "status": "running",
+        "started_at": datetime.now().isoformat(),
+    }
+    _scan_jobs.set(job_id, job)
     
-    customer_service = get_customer_service()
-    agent = customer_service.get_agent(agent_id, include_password=True)
+    async def run():
+        mikrotik = get_mikrotik_service()
+        try:
+            result = await asyncio.to_thread(
+                mikrotik.run_ip_scan,
+                **conn,
+                network=network,
+                interface=interface,
+                duration=duration,
+            )
+        except Exception as e:
+            logger.error("IP scan {} on agent {} failed: {}", job_id, agent_id, e)
+            result = {"success": False, "error": str(e)}
+        
+        job.update(
+            status="completed" if result.get("success") else "failed",
+            finished_at=datetime.now().isoformat(),
+            result=result,
+        )
+        # Riparte il TTL dal completamento
+        _scan_jobs.set(job_id, job)
     
-    if not agent:
-        raise HTTPException(status_code=404, detail="Sonda non trovata")
+    task = asyncio.create_task(run())
+    _scan_tasks.add(task)
+    task.add_done_callback(_scan_tasks.discard)
     
-    mikrotik = get_mikrotik_service()
-    result = mikrotik.run_ip_scan(
-        address=agent.address,
-        port=agent.port,
-        username=agent.username or "admin",
-        password=agent.password or "",
-        network=network,
-        interface=interface,
-        duration=duration,
-        use_ssl=agent.use_ssl,
-    )
+    return {"job_id": job_id, "status": "running"}
+
+
+@router.get("/agents/{agent_id}/ip-scan/{job_id}")
+async def get_router_ip_scan(agent_id: str, job_id: str) -> Dict[str, Any]:
+    """Stato e risultato di un IP scan avviato con POST /agents/{agent_id}/ip-scan"""
+    job = _scan_jobs.get(job_id)
+    if not job or job["agent_id"] != agent_id:
+        raise HTTPException(status_code=404, detail="Job di scansione non trovato o scaduto")
     
-    return result
+    return job
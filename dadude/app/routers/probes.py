@@ -2,15 +2,21 @@
 DaDude - Probes Router
 API endpoints per gestione sonde/probe
 """
+from collections import Counter
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
 from loguru import logger
 
 from ..models import Probe, ProbeListResponse, ProbeStatus
 from ..services import get_dude_service, get_sync_service
+from ..utils.ttl_cache import TTLCache
 
 router = APIRouter(prefix="/probes", tags=["Probes"])
 
+# Viste calcolate sulla cache del SyncService, per filtri: ogni sync sostituisce
+# la lista delle probe, che invalida le voci calcolate sulla lista precedente
+_view_cache = TTLCache(maxsize=256, ttl=300)
+
 
 @router.get("", response_model=ProbeListResponse)
 async def list_probes(
@@ -24,41 +30,58 @@ async def list_probes(
     """
     try:
         if use_cache:
-            sync = get_sync_service()
-            probes = sync.probes
+            probes = get_sync_service().probes
+            return _view_cache.get_for_sources(
+                ("list", device_id, status, probe_type),
+                (probes,),
+                lambda: _filter_probes(probes, device_id, status, probe_type),
+            )
         else:
             dude = get_dude_service()
             probes = dude.get_probes(device_id=device_id)
-        
-        # Applica filtri
-        if device_id:
-            probes = [p for p in probes if p.device_id == device_id]
-        if status:
-            probes = [p for p in probes if p.status.value == status]
-        if probe_type:
-            probes = [p for p in probes if p.probe_type == probe_type]
-        
-        return ProbeListResponse(total=len(probes), probes=probes)
+            # get_probes ha già filtrato per device
+            return _filter_probes(probes, None, status, probe_type)
         
     except Exception as e:
         logger.error(f"Error listing probes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _filter_probes(
+    probes: list,
+    device_id: Optional[str],
+    status: Optional[str],
+    probe_type: Optional[str],
+) -> ProbeListResponse:
+    """Applica i filtri in un solo passaggio"""
+    if device_id or status or probe_type:
+        probes = [
+            p for p in probes
+            if (not device_id or p.device_id == device_id)
+            and (not status or p.status.value == status)
+            and (not probe_type or p.probe_type == probe_type)
+        ]
+    
+    return ProbeListResponse(total=len(probes), probes=probes)
+
+
 @router.get("/summary")
 async def probes_summary():
     """
     Ottiene riepilogo stato probe.
     """
-    sync = get_sync_service()
-    probes = sync.probes
+    probes = get_sync_service().probes
+    return _view_cache.get_for_sources(("summary",), (probes,), lambda: _summarize_probes(probes))
+
+
+def _summarize_probes(probes: list) -> dict:
+    """Riepilogo per stato in un solo passaggio"""
+    counts = Counter(p.status for p in probes)
     
-    summary = {
+    return {
         "total": len(probes),
-        "ok": len([p for p in probes if p.status == ProbeStatus.OK]),
-        "warning": len([p for p in probes if p.status == ProbeStatus.WARNING]),
-        "critical": len([p for p in probes if p.status == ProbeStatus.CRITICAL]),
-        "unknown": len([p for p in probes if p.status == ProbeStatus.UNKNOWN]),
+        "ok": counts[ProbeStatus.OK],
+        "warning": counts[ProbeStatus.WARNING],
+        "critical": counts[ProbeStatus.CRITICAL],
+        "unknown": counts[ProbeStatus.UNKNOWN],
     }
-    
-    return summary
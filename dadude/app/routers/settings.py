@@ -6,9 +6,12 @@ from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import Optional
 from loguru import logger
+import asyncio
 import os
 import subprocess
 
+from ..auth import read_env_file, invalidate_env_cache
+
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
 
@@ -46,19 +49,6 @@ class AuthSettings(BaseModel):
     admin_password: Optional[str] = None  # Solo per creazione/modifica
 
 
-def _read_env_file(env_path: str = ".env") -> dict:
-    """Legge il file .env e ritorna un dizionario"""
-    env_vars = {}
-    if os.path.exists(env_path):
-        with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    env_vars[key.strip()] = value.strip().strip('"').strip("'")
-    return env_vars
-
-
 def _write_env_file(env_vars: dict, env_path: str = ".env"):
     """Scrive il dizionario nel file .env"""
     with open(env_path, "w") as f:
@@ -66,6 +56,28 @@ def _write_env_file(env_vars: dict, env_path: str = ".env"):
             if value is not None:
                 # Non aggiungere virgolette ai valori
                 f.write(f'{key}={value}\n')
+    # La firma (mtime, size) può non cambiare tra due scritture ravvicinate
+    invalidate_env_cache(env_path)
+
+
+def _apply_env_updates(updates: dict, env_path: str = ".env") -> bool:
+    """Applica updates al file .env; non lo riscrive se i valori sono già quelli"""
+    env_vars = read_env_file(env_path)
+    if all(env_vars.get(key) == value for key, value in updates.items()):
+        return False
+    env_vars.update(updates)
+    _write_env_file(env_vars, env_path)
+    return True
+
+
+# Serializza i read-modify-write di .env tra richieste concorrenti
+_env_lock = asyncio.Lock()
+
+
+async def _update_env_file(updates: dict, env_path: str = ".env") -> bool:
+    """Aggiorna .env in un solo read-modify-write, fuori dall'event loop"""
+    async with _env_lock:
+        return await asyncio.to_thread(_apply_env_updates, updates, env_path)
 
 
 @router.get("/current")
@@ -77,7 +89,7 @@ async def get_current_settings():
     settings = get_settings()
     
     # Leggi anche le impostazioni extra non in pydantic
-    env_vars = _read_env_file()
+    env_vars = await asyncio.to_thread(read_env_file)
     
     return {
         "dude": {
@@ -118,20 +130,20 @@ async def update_dude_settings(settings: DudeSettings):
     """
     Aggiorna le impostazioni di connessione al Dude Server
     """
-    env_vars = _read_env_file()
+    updates = {}
     
     if settings.dude_host is not None:
-        env_vars["DUDE_HOST"] = settings.dude_host
+        updates["DUDE_HOST"] = settings.dude_host
     if settings.dude_api_port is not None:
-        env_vars["DUDE_API_PORT"] = str(settings.dude_api_port)
+        updates["DUDE_API_PORT"] = str(settings.dude_api_port)
     if settings.dude_use_ssl is not None:
-        env_vars["DUDE_USE_SSL"] = "true" if settings.dude_use_ssl else "false"
+        updates["DUDE_USE_SSL"] = "true" if settings.dude_use_ssl else "false"
     if settings.dude_username is not None:
-        env_vars["DUDE_USERNAME"] = settings.dude_username
+        updates["DUDE_USERNAME"] = settings.dude_username
     if settings.dude_password is not None:
-        env_vars["DUDE_PASSWORD"] = settings.dude_password
+        updates["DUDE_PASSWORD"] = settings.dude_password
     
-    _write_env_file(env_vars)
+    await _update_env_file(updates)
     logger.info("Dude settings updated")
     
     return {"success": True, "message": "Impostazioni Dude aggiornate. Riavvia il servizio per applicare."}
@@ -142,24 +154,24 @@ async def update_dadude_settings(settings: DaDudeSettings):
     """
     Aggiorna le impostazioni del server DaDude
     """
-    env_vars = _read_env_file()
+    updates = {}
     
     if settings.dadude_host is not None:
-        env_vars["DADUDE_HOST"] = settings.dadude_host
+        updates["DADUDE_HOST"] = settings.dadude_host
     if settings.dadude_port is not None:
-        env_vars["DADUDE_PORT"] = str(settings.dadude_port)
+        updates["DADUDE_PORT"] = str(settings.dadude_port)
     if settings.dadude_api_key is not None:
-        env_vars["DADUDE_API_KEY"] = settings.dadude_api_key
+        updates["DADUDE_API_KEY"] = settings.dadude_api_key
     if settings.poll_interval is not None:
-        env_vars["POLL_INTERVAL"] = str(settings.poll_interval)
+        updates["POLL_INTERVAL"] = str(settings.poll_interval)
     if settings.full_sync_interval is not None:
-        env_vars["FULL_SYNC_INTERVAL"] = str(settings.full_sync_interval)
+        updates["FULL_SYNC_INTERVAL"] = str(settings.full_sync_interval)
     if settings.connection_timeout is not None:
-        env_vars["CONNECTION_TIMEOUT"] = str(settings.connection_timeout)
+        updates["CONNECTION_TIMEOUT"] = str(settings.connection_timeout)
     if settings.log_level is not None:
-        env_vars["LOG_LEVEL"] = settings.log_level
+        updates["LOG_LEVEL"] = settings.log_level
     
-    _write_env_file(env_vars)
+    await _update_env_file(updates)
     logger.info("DaDude settings updated")
     
     return {"success": True, "message": "Impostazioni DaDude aggiornate. Riavvia il servizio per applicare."}
@@ -190,17 +202,17 @@ async def generate_ssl_certificate(
             "-subj", f"/CN={common_name}/O=DaDude/C=IT"
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = await asyncio.to_thread(subprocess.run, cmd, capture_output=True, text=True, timeout=30)
         
         if result.returncode != 0:
             raise HTTPException(status_code=500, detail=f"Errore generazione certificato: {result.stderr}")
         
         # Aggiorna .env
-        env_vars = _read_env_file()
-        env_vars["SSL_ENABLED"] = "true"
-        env_vars["SSL_CERT_PATH"] = cert_path
-        env_vars["SSL_KEY_PATH"] = key_path
-        _write_env_file(env_vars)
+        await _update_env_file({
+            "SSL_ENABLED": "true",
+            "SSL_CERT_PATH": cert_path,
+            "SSL_KEY_PATH": key_path,
+        })
         
         logger.info(f"SSL certificate generated: {cert_path}")
         
@@ -224,16 +236,16 @@ async def update_ssl_settings(settings: SSLSettings):
     """
     Aggiorna le impostazioni SSL
     """
-    env_vars = _read_env_file()
+    updates = {}
     
     if settings.ssl_enabled is not None:
-        env_vars["SSL_ENABLED"] = "true" if settings.ssl_enabled else "false"
+        updates["SSL_ENABLED"] = "true" if settings.ssl_enabled else "false"
     if settings.ssl_cert_path is not None:
-        env_vars["SSL_CERT_PATH"] = settings.ssl_cert_path
+        updates["SSL_CERT_PATH"] = settings.ssl_cert_path
     if settings.ssl_key_path is not None:
-        env_vars["SSL_KEY_PATH"] = settings.ssl_key_path
+        updates["SSL_KEY_PATH"] = settings.ssl_key_path
     
-    _write_env_file(env_vars)
+    await _update_env_file(updates)
     logger.info("SSL settings updated")
     
     return {"success": True, "message": "Impostazioni SSL aggiornate. Riavvia il servizio per applicare."}
@@ -247,20 +259,20 @@ async def update_auth_settings(settings: AuthSettings):
     import hashlib
     import secrets
     
-    env_vars = _read_env_file()
+    updates = {}
     
     if settings.auth_enabled is not None:
-        env_vars["AUTH_ENABLED"] = "true" if settings.auth_enabled else "false"
+        updates["AUTH_ENABLED"] = "true" if settings.auth_enabled else "false"
     if settings.admin_username is not None:
-        env_vars["ADMIN_USERNAME"] = settings.admin_username
+        updates["ADMIN_USERNAME"] = settings.admin_username
     if settings.admin_password is not None:
         # Hash della password con salt
         salt = secrets.token_hex(16)
         password_hash = hashlib.sha256((settings.admin_password + salt).encode()).hexdigest()
-        env_vars["ADMIN_PASSWORD_HASH"] = password_hash
-        env_vars["ADMIN_PASSWORD_SALT"] = salt
+        updates["ADMIN_PASSWORD_HASH"] = password_hash
+        updates["ADMIN_PASSWORD_SALT"] = salt
     
-    _write_env_file(env_vars)
+    await _update_env_file(updates)
     logger.info("Auth settings updated")
     
     return {"success": True, "message": "Impostazioni autenticazione aggiornate. Riavvia il servizio per applicare."}
@@ -2,6 +2,9 @@
 DaDude - System Router
 API endpoints per gestione sistema e configurazione
 """
+import asyncio
+import hmac
+from collections import Counter
 from fastapi import APIRouter, HTTPException, Depends, Header
 from typing import Optional
 from datetime import datetime
@@ -11,6 +14,7 @@ from ..config import get_settings, Settings
 from ..models import DudeServerInfo, StatusResponse
 from ..services import get_dude_service, get_sync_service
 from ..services.settings_service import get_settings_service
+from ..utils.ttl_cache import TTLCache
 from pydantic import BaseModel
 
 
@@ -24,25 +28,35 @@ class DudeConfigUpdate(BaseModel):
 
 router = APIRouter(prefix="/system", tags=["System"])
 
+# Statistiche calcolate su device e probe del SyncService: valide finché
+# un sync non sostituisce una delle due liste
+_stats_cache = TTLCache(maxsize=4, ttl=300)
 
-def verify_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
+
+def _api_key_matches(x_api_key: str, expected: str) -> bool:
+    """Confronto a tempo costante della API key"""
+    return hmac.compare_digest(x_api_key.encode(), expected.encode())
+
+
+# Dependency async: nessun passaggio dal threadpool, il controllo è solo in memoria
+async def verify_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
     """Verifica API key se configurata"""
-    settings = get_settings()
-    if not settings.dadude_api_key:
+    expected = get_settings().dadude_api_key
+    if not expected:
         return True  # Nessuna API key configurata = accesso libero
     if not x_api_key:
         raise HTTPException(status_code=401, detail="API key required")
-    if x_api_key != settings.dadude_api_key:
+    if not _api_key_matches(x_api_key, expected):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return True
 
 
-def optional_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
+async def optional_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
     """Verifica API key solo se fornita (per endpoint accessibili anche da UI)"""
-    settings = get_settings()
-    if not settings.dadude_api_key:
+    expected = get_settings().dadude_api_key
+    if not expected:
         return True  # Nessuna API key configurata
-    if x_api_key and x_api_key != settings.dadude_api_key:
+    if x_api_key and not _api_key_matches(x_api_key, expected):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return True
 
@@ -80,7 +94,7 @@ async def get_server_info():
     """
     try:
         dude = get_dude_service()
-        return dude.get_server_info()
+        return await asyncio.to_thread(dude.get_server_info)
     except Exception as e:
         logger.error(f"Error getting server info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -134,9 +148,8 @@ async def reconnect_dude(authorized: bool = Depends(optional_api_key)):
     """
     try:
         dude = get_dude_service()
-        dude.disconnect()
         
-        if dude.connect():
+        if await asyncio.to_thread(_reconnect, dude):
             return StatusResponse(status="success", message="Reconnected to Dude Server")
         else:
             raise HTTPException(status_code=503, detail="Failed to reconnect")
@@ -154,12 +167,20 @@ async def get_stats():
     Statistiche di utilizzo del sistema.
     """
     sync = get_sync_service()
-    devices = sync.devices
-    probes = sync.probes
-    
-    # Calcola uptime stats
-    devices_up = len([d for d in devices if d.status.value == "up"])
-    devices_down = len([d for d in devices if d.status.value == "down"])
+    return _stats_cache.get_for_sources(
+        "stats",
+        (sync.devices, sync.probes, sync.last_sync),
+        lambda: _compute_stats(sync.devices, sync.probes, sync.last_sync),
+    )
+
+
+def _compute_stats(devices: list, probes: list, last_sync: Optional[datetime]) -> dict:
+    """Statistiche di device e probe"""
+    # Calcola uptime stats (conteggi per stato in un solo passaggio)
+    device_counts = Counter(d.status.value for d in devices)
+    probe_counts = Counter(p.status.value for p in probes)
+    devices_up = device_counts["up"]
+    devices_down = device_counts["down"]
     
     return {
         "devices": {
@@ -170,23 +191,35 @@ async def get_stats():
         },
         "probes": {
             "total": len(probes),
-            "ok": len([p for p in probes if p.status.value == "ok"]),
-            "warning": len([p for p in probes if p.status.value == "warning"]),
-            "critical": len([p for p in probes if p.status.value == "critical"]),
+            "ok": probe_counts["ok"],
+            "warning": probe_counts["warning"],
+            "critical": probe_counts["critical"],
         },
         "system": {
             "uptime": "N/A",  # TODO: track uptime
-            "last_sync": sync.last_sync.isoformat() if sync.last_sync else None,
+            "last_sync": last_sync.isoformat() if last_sync else None,
         },
     }
 
 
+def _reconnect(dude) -> bool:
+    """Disconnette e riconnette il DudeService (bloccante)"""
+    dude.disconnect()
+    return dude.connect()
+
+
 @router.post("/test-connection")
 async def test_dude_connection(config: DudeConfigUpdate):
     """
     Testa la connessione al server Dude con le credenziali fornite.
     Non salva la configurazione.
     """
+    # Connessione RouterOS API bloccante: fuori dall'event loop
+    return await asyncio.to_thread(_probe_dude_connection, config)
+
+
+def _probe_dude_connection(config: DudeConfigUpdate) -> dict:
+    """Prova login e lettura identity sul server Dude"""
     import routeros_api
     
     try:
@@ -243,7 +276,8 @@ async def save_dude_config(config: DudeConfigUpdate):
         )
     
     # Salva configurazione
-    success = settings_service.set_dude_config(
+    success = await asyncio.to_thread(
+        settings_service.set_dude_config,
         host=config.host,
         port=config.port,
         username=config.username,
@@ -257,7 +291,7 @@ async def save_dude_config(config: DudeConfigUpdate):
     # Riconnetti con nuove credenziali
     try:
         dude = get_dude_service()
-        dude.disconnect()
+        await asyncio.to_thread(dude.disconnect)
         
         # Aggiorna impostazioni runtime
         dude.host = config.host
@@ -266,7 +300,7 @@ async def save_dude_config(config: DudeConfigUpdate):
         dude.password = config.password
         dude.use_ssl = config.use_ssl
         
-        connected = dude.connect()
+        connected = await asyncio.to_thread(dude.connect)
         
         if connected:
             # Esegui sync iniziale
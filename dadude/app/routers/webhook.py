@@ -6,6 +6,8 @@ from fastapi import APIRouter, HTTPException, Request, Header, BackgroundTasks
 from typing import Optional, List
 from datetime import datetime
 from loguru import logger
+import asyncio
+import json
 import hmac
 import hashlib
 
@@ -15,6 +17,16 @@ from ..services import get_alert_service, get_webhook_service
 
 router = APIRouter(prefix="/webhook", tags=["Webhook"])
 
+# Campi di WebhookPayload: il resto del payload finisce in extra_data
+_PAYLOAD_FIELDS = frozenset({
+    "event_type", "device_id", "device_name", "probe_id",
+    "probe_name", "old_status", "new_status", "message",
+})
+
+# Oltre questa dimensione l'HMAC del body viene calcolato in un thread
+# (hashlib rilascia il GIL); sotto, il costo del thread supera quello dello SHA-256
+_HMAC_THREAD_THRESHOLD = 256 * 1024
+
 
 def verify_signature(payload: bytes, signature: str, secret: str) -> bool:
     """Verifica firma HMAC del webhook"""
@@ -43,14 +55,18 @@ async def receive_webhook(
         http-data="event_type=device_down&device_name=Router1&device_id=*1"
     ```
     """
-    settings = get_settings()
+    secret = get_settings().webhook_secret
     
     # Leggi body
     body = await request.body()
     
     # Verifica firma se configurata
-    if settings.webhook_secret and x_webhook_signature:
-        if not verify_signature(body, x_webhook_signature, settings.webhook_secret):
+    if secret and x_webhook_signature:
+        if len(body) > _HMAC_THREAD_THRESHOLD:
+            valid = await asyncio.to_thread(verify_signature, body, x_webhook_signature, secret)
+        else:
+            valid = verify_signature(body, x_webhook_signature, secret)
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid webhook signature")
     
     # Parse payload
@@ -59,7 +75,8 @@ async def receive_webhook(
         content_type = request.headers.get("content-type", "")
         
         if "application/json" in content_type:
-            data = await request.json()
+            # Body già letto per la firma: parse diretto dei bytes
+            data = json.loads(body)
         else:
             # Form data (da script RouterOS)
             form_data = await request.form()
@@ -74,10 +91,7 @@ async def receive_webhook(
             old_status=data.get("old_status"),
             new_status=data.get("new_status"),
             message=data.get("message"),
-            extra_data={k: v for k, v in data.items() if k not in [
-                "event_type", "device_id", "device_name", "probe_id",
-                "probe_name", "old_status", "new_status", "message"
-            ]},
+            extra_data={k: v for k, v in data.items() if k not in _PAYLOAD_FIELDS},
         )
         
     except Exception as e:
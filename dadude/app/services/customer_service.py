@@ -2,8 +2,9 @@
 DaDude - Customer Service
 Gestione clienti, reti, credenziali e assegnazioni device
 """
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union, Callable
 from datetime import datetime
+from contextlib import contextmanager
 from loguru import logger
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
@@ -28,6 +29,50 @@ from ..config import get_settings
 from .encryption_service import get_encryption_service
 
 
+# Porte aperte → tipo credenziale da provare in auto-detect
+_SSH_PORTS = frozenset({22, 23})  # 23 = telnet, proviamo ssh
+_SNMP_PORTS = frozenset({161, 162})
+_WMI_PORTS = frozenset({3389, 445, 139, 389, 135, 5985, 5986})  # RDP, SMB, NetBIOS, LDAP, RPC, WinRM
+_MIKROTIK_PORTS = frozenset({8728, 8729, 8291})  # API, API-SSL, Winbox
+
+_PORT_CREDENTIAL_TYPES = (
+    ("ssh", _SSH_PORTS),
+    ("snmp", _SNMP_PORTS),
+    ("wmi", _WMI_PORTS),
+    ("mikrotik", _MIKROTIK_PORTS),
+)
+
+# Priorità auto-detect: wmi prima (più informativo), poi snmp, poi ssh
+_AUTO_DETECT_PRIORITY = ("wmi", "snmp", "ssh", "mikrotik")
+
+# Callback (tipo, id) chiamate dopo modifica o eliminazione di sonde ("agent") e
+# credenziali ("credential"): chi tiene copie in cache (es. segreti decifrati) le invalida
+_change_listeners: List[Callable[[str, str], None]] = []
+
+
+def on_entity_changed(callback: Callable[[str, str], None]) -> None:
+    """Registra una callback di invalidazione per modifiche a sonde e credenziali"""
+    _change_listeners.append(callback)
+
+
+def notify_entity_changed(kind: str, entity_id: str) -> None:
+    """Notifica la modifica di una sonda o credenziale ai listener registrati"""
+    for callback in _change_listeners:
+        try:
+            callback(kind, entity_id)
+        except Exception as e:
+            logger.error("Change listener failed for {} {}: {}", kind, entity_id, e)
+
+
+def credential_types_for_ports(open_ports: List[Dict[str, Any]]) -> set:
+    """Tipi di credenziale da provare in base alle porte aperte [{port, open, ...}]"""
+    ports = {p.get("port") for p in open_ports if p.get("open")}
+    return {
+        cred_type for cred_type, type_ports in _PORT_CREDENTIAL_TYPES
+        if not type_ports.isdisjoint(ports)
+    }
+
+
 class CustomerService:
     """Servizio per gestione multi-tenant"""
     
@@ -42,6 +87,19 @@ class CustomerService:
         """Ottiene sessione database"""
         return get_session(self._engine)
     
+    @contextmanager
+    def _session_scope(self):
+        """Sessione unica con commit finale, rollback su errore e chiusura"""
+        session = self._get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
     # ==========================================
     # CUSTOMERS
     # ==========================================
@@ -410,9 +468,34 @@ class CustomerService:
         finally:
             session.close()
     
-    def _decrypt_credential(self, cred: CredentialDB) -> Credential:
+    def get_credentials_bulk(self, credential_ids: List[str], include_secrets: bool = False) -> List[Any]:
+        """
+        Ottiene più credenziali con una sola query (WHERE id IN ...).
+        Mantiene l'ordine di credential_ids, ignorando gli ID non trovati.
+        """
+        if not credential_ids:
+            return []
+        
+        session = self._get_session()
+        try:
+            creds = session.query(CredentialDB).filter(
+                CredentialDB.id.in_(set(credential_ids))
+            ).all()
+            
+            if include_secrets:
+                encryption = get_encryption_service()
+                by_id = {c.id: self._decrypt_credential(c, encryption) for c in creds}
+            else:
+                by_id = {c.id: self._to_credential_safe(c) for c in creds}
+            
+            return [by_id[cid] for cid in dict.fromkeys(credential_ids) if cid in by_id]
+            
+        finally:
+            session.close()
+    
+    def _decrypt_credential(self, cred: CredentialDB, encryption=None) -> Credential:
         """Decripta una credenziale per uso interno"""
-        encryption = get_encryption_service()
+        encryption = encryption or get_encryption_service()
         return Credential(
             id=cred.id,
             customer_id=cred.customer_id,
@@ -617,25 +700,20 @@ class CustomerService:
         result = {}
         
         try:
-            # 1. Prima cerca credenziali linkate al cliente
-            links = session.query(CredentialLinkDB).filter(
-                CredentialLinkDB.customer_id == customer_id
-            ).order_by(
-                CredentialLinkDB.is_default.desc()  # Default prima
-            ).all()
+            # 1. Prima cerca credenziali linkate al cliente (una sola query con JOIN)
+            linked_query = session.query(CredentialDB).join(
+                CredentialLinkDB,
+                CredentialLinkDB.credential_id == CredentialDB.id
+            ).filter(
+                CredentialLinkDB.customer_id == customer_id,
+                CredentialDB.active == True
+            )
+            if credential_types:
+                linked_query = linked_query.filter(CredentialDB.credential_type.in_(credential_types))
             
-            for link in links:
-                cred = session.query(CredentialDB).filter(
-                    CredentialDB.id == link.credential_id,
-                    CredentialDB.active == True
-                ).first()
-                
-                if not cred:
-                    continue
-                    
-                if credential_types and cred.credential_type not in credential_types:
-                    continue
-                
+            for cred in linked_query.order_by(
+                CredentialLinkDB.is_default.desc()  # Default prima
+            ).all():
                 if cred.credential_type not in result:
                     result[cred.credential_type] = self._decrypt_credential(cred)
             
@@ -670,7 +748,8 @@ class CustomerService:
     def get_credentials_for_auto_detect(
         self,
         customer_id: str,
-        open_ports: List[Dict[str, Any]],
+        open_ports: Optional[List[Dict[str, Any]]] = None,
+        credential_types: Optional[set] = None,
     ) -> List[Credential]:
         """
         Ottiene le credenziali da provare in base alle porte aperte.
@@ -684,36 +763,14 @@ class CustomerService:
         Args:
             customer_id: ID del cliente
             open_ports: Lista porte aperte [{port, protocol, service, open}]
+            credential_types: Tipi già calcolati con credential_types_for_ports()
+                              (se presente, open_ports viene ignorato)
         
         Returns:
             Lista di Credential ordinate per priorità
         """
         # Determina quali tipi di credenziali servono
-        types_needed = set()
-        
-        # Mappa porte → tipo credenziale
-        port_type_map = {
-            22: "ssh",
-            23: "ssh",  # telnet, proviamo ssh
-            161: "snmp",
-            162: "snmp",
-            3389: "wmi",  # RDP = Windows
-            445: "wmi",   # SMB = Windows
-            139: "wmi",   # NetBIOS = Windows
-            389: "wmi",   # LDAP = Windows AD
-            135: "wmi",   # RPC = Windows
-            5985: "wmi",  # WinRM = Windows
-            5986: "wmi",  # WinRM SSL = Windows
-            8728: "mikrotik",
-            8729: "mikrotik",
-            8291: "mikrotik",  # Winbox
-        }
-        
-        for port_info in open_ports:
-            if port_info.get("open"):
-                port = port_info.get("port")
-                if port in port_type_map:
-                    types_needed.add(port_type_map[port])
+        types_needed = credential_types if credential_types is not None else credential_types_for_ports(open_ports or [])
         
         if not types_needed:
             logger.debug(f"No credential types detected from open ports")
@@ -727,17 +784,12 @@ class CustomerService:
             list(types_needed)
         )
         
-        # Ordina per priorità: wmi prima (più informativo), poi snmp, poi ssh
-        priority_order = ["wmi", "snmp", "ssh", "mikrotik"]
-        result = []
-        
-        for cred_type in priority_order:
-            if cred_type in creds_by_type:
-                result.append(creds_by_type[cred_type])
+        # Ordina per priorità
+        result = [creds_by_type[t] for t in _AUTO_DETECT_PRIORITY if t in creds_by_type]
         
-        # Aggiungi eventuali tipi non in priority_order
+        # Aggiungi eventuali tipi non in _AUTO_DETECT_PRIORITY
         for cred_type, cred in creds_by_type.items():
-            if cred not in result:
+            if cred_type not in _AUTO_DETECT_PRIORITY:
                 result.append(cred)
         
         logger.info(f"Found {len(result)} credentials for auto-detect: {[c.credential_type for c in result]}")
@@ -771,6 +823,7 @@ class CustomerService:
             
             session.commit()
             session.refresh(cred)
+            notify_entity_changed("credential", credential_id)
             
             logger.info(f"Updated credential: {cred.name}")
             return self._to_credential_safe(cred)
@@ -795,6 +848,7 @@ class CustomerService:
             
             session.delete(cred)
             session.commit()
+            notify_entity_changed("credential", credential_id)
             
             logger.info(f"Deleted credential: {cred.name}")
             return True
@@ -1014,38 +1068,68 @@ class CustomerService:
             if not agent:
                 return None
             
-            result = AgentAssignment.model_validate(agent)
+            return self._agent_to_schema(agent, include_password)
             
-            enc_service = get_encryption_service()
-            
-            # Decrypt password se richiesto
-            if include_password and agent.password:
-                try:
-                    result.password = enc_service.decrypt(agent.password)
-                except:
-                    result.password = agent.password  # Fallback a valore in chiaro
-            else:
-                result.password = None
-            
-            # Decrypt agent_token se presente
-            if include_password and agent.agent_token:
-                try:
-                    result.agent_token = enc_service.decrypt(agent.agent_token)
-                except:
-                    result.agent_token = agent.agent_token  # Fallback a valore in chiaro
+        finally:
+            session.close()
+    
+    def get_agents_bulk(self, agent_ids: List[str], include_password: bool = False) -> List[AgentAssignment]:
+        """
+        Ottiene più sonde con una sola query (WHERE id IN ...).
+        Mantiene l'ordine di agent_ids, ignorando gli ID non trovati.
+        """
+        if not agent_ids:
+            return []
+        
+        session = self._get_session()
+        try:
+            agents = session.query(AgentAssignmentDB).filter(
+                AgentAssignmentDB.id.in_(set(agent_ids))
+            ).all()
             
-            return result
+            by_id = {a.id: self._agent_to_schema(a, include_password) for a in agents}
+            return [by_id[aid] for aid in dict.fromkeys(agent_ids) if aid in by_id]
             
         finally:
             session.close()
     
+    def _agent_to_schema(self, agent: AgentAssignmentDB, include_password: bool) -> AgentAssignment:
+        """Converte una sonda DB in schema, decifrando password e token se richiesto"""
+        result = AgentAssignment.model_validate(agent)
+        
+        enc_service = get_encryption_service()
+        
+        # Decrypt password se richiesto
+        if include_password and agent.password:
+            try:
+                result.password = enc_service.decrypt(agent.password)
+            except:
+                result.password = agent.password  # Fallback a valore in chiaro
+        else:
+            result.password = None
+        
+        # Decrypt agent_token se presente
+        if include_password and agent.agent_token:
+            try:
+                result.agent_token = enc_service.decrypt(agent.agent_token)
+            except:
+                result.agent_token = agent.agent_token  # Fallback a valore in chiaro
+        
+        return result
+    
     def list_agents(
         self,
         customer_id: Optional[str] = None,
         active_only: bool = True,
         include_password: bool = False,
-    ) -> List[AgentAssignmentSafe]:
-        """Lista sonde"""
+        agent_type: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Union[AgentAssignmentSafe, AgentAssignment]]:
+        """
+        Lista sonde.
+        Con include_password ritorna AgentAssignment con i segreti decifrati,
+        letti nella stessa query (senza un get_agent per sonda).
+        """
         session = self._get_session()
         try:
             query = session.query(AgentAssignmentDB)
@@ -1054,8 +1138,16 @@ class CustomerService:
                 query = query.filter(AgentAssignmentDB.customer_id == customer_id)
             if active_only:
                 query = query.filter(AgentAssignmentDB.active == True)
+            if agent_type:
+                query = query.filter(AgentAssignmentDB.agent_type == agent_type)
             
-            agents = query.order_by(AgentAssignmentDB.name).all()
+            query = query.order_by(AgentAssignmentDB.name)
+            if limit:
+                query = query.limit(limit)
+            agents = query.all()
+            
+            if include_password:
+                return [self._agent_to_schema(agent, True) for agent in agents]
             
             results = []
             for agent in agents:
@@ -1094,6 +1186,7 @@ class CustomerService:
             
             session.commit()
             session.refresh(agent)
+            notify_entity_changed("agent", agent_id)
             
             logger.info(f"Updated agent: {agent.name}")
             return AgentAssignment.model_validate(agent)
@@ -1114,6 +1207,7 @@ class CustomerService:
             
             session.delete(agent)
             session.commit()
+            notify_entity_changed("agent", agent_id)
             
             logger.info(f"Deleted agent: {agent.name}")
             return True
@@ -1261,6 +1355,7 @@ class CustomerService:
             agent.updated_at = datetime.utcnow()
             
             session.commit()
+            notify_entity_changed("agent", agent_id)
             
             logger.info(f"Updated agent {agent.name} address: {old_address} -> {new_address}")
             return True
@@ -6,12 +6,32 @@ Supporta esecuzione tramite agente MikroTik remoto
 from typing import Optional, Dict, Any, List
 from loguru import logger
 import asyncio
+import random
 import socket
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from enum import Enum
 from .mac_lookup_service import get_mac_lookup_service
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _max_tcp_connects(default: int = 256) -> int:
+    """Limite di connect TCP contemporanee, proporzionale a ulimit -n"""
+    if resource is None:
+        return default
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ValueError, OSError):
+        return default
+    if soft == resource.RLIM_INFINITY:
+        return default
+    # Lascia descrittori liberi per DB, log e connessioni HTTP
+    return max(16, min(default, soft // 4))
+
 
 class ProbeProtocol(Enum):
     SSH = "ssh"
@@ -67,8 +87,15 @@ class MikroTikAgent:
 class DeviceProbeService:
     """Servizio per identificare dispositivi tramite probe attivi"""
     
+    # Probe di credenziali contemporanei sullo stesso host (auto_identify_device parallelo)
+    MAX_PARALLEL_CREDENTIALS = 4
+    
+    # Connect TCP contemporanee di scan_services, globali su tutti gli host
+    MAX_PARALLEL_TCP_CONNECTS = _max_tcp_connects()
+    
     def __init__(self):
         self._executor = ThreadPoolExecutor(max_workers=10)
+        self._tcp_connect_semaphore = asyncio.Semaphore(self.MAX_PARALLEL_TCP_CONNECTS)
     
     async def probe_device(
         self,
@@ -1585,11 +1612,16 @@ class DeviceProbeService:
         services = []
 
         # Scansione TCP (più veloce e affidabile)
-        tcp_tasks = []
-        for port, service_name in tcp_ports.items():
-            tcp_tasks.append(self._scan_tcp_port(address, port, service_name))
+        # Ordine di connect casuale per non sondare sempre le porte in sequenza;
+        # i risultati restano nell'ordine della tabella
+        scan_order = list(tcp_ports.items())
+        random.shuffle(scan_order)
+        tcp_tasks = {
+            port: asyncio.ensure_future(self._scan_tcp_port(address, port, service_name))
+            for port, service_name in scan_order
+        }
 
-        tcp_results = await asyncio.gather(*tcp_tasks, return_exceptions=True)
+        tcp_results = await asyncio.gather(*(tcp_tasks[port] for port in tcp_ports), return_exceptions=True)
         for result in tcp_results:
             if isinstance(result, dict) and result.get("open"):
                 services.append(result)
@@ -1613,36 +1645,30 @@ class DeviceProbeService:
         return services
 
     async def _scan_tcp_port(self, address: str, port: int, service_name: str) -> Dict[str, Any]:
-        """Scansiona una singola porta TCP"""
-        loop = asyncio.get_event_loop()
-
-        def check():
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1.0)  # Timeout breve per velocità
+        """
+        Scansiona una singola porta TCP.
+        Connect non bloccante sull'event loop: non occupa thread dell'executor
+        e il numero di socket aperti è limitato da _tcp_connect_semaphore.
+        """
+        is_open = False
+        async with self._tcp_connect_semaphore:
             try:
-                result = sock.connect_ex((address, port))
-                return result == 0
-            except:
-                return False
-            finally:
-                sock.close()
+                # Timeout breve per velocità
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout=1.0)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            except Exception as e:
+                logger.debug("Error scanning {}:{} - {}", address, port, e)
+            else:
+                is_open = True
+                writer.close()
 
-        try:
-            is_open = await loop.run_in_executor(self._executor, check)
-            return {
-                "port": port,
-                "protocol": "tcp",
-                "service": service_name,
-                "open": is_open
-            }
-        except Exception as e:
-            logger.debug(f"Error scanning {address}:{port} - {e}")
-            return {
-                "port": port,
-                "protocol": "tcp",
-                "service": service_name,
-                "open": False
-            }
+        return {
+            "port": port,
+            "protocol": "tcp",
+            "service": service_name,
+            "open": is_open
+        }
 
     async def _scan_udp_port(self, address: str, port: int, service_name: str) -> Dict[str, Any]:
         """Scansiona una singola porta UDP"""
@@ -1743,13 +1769,130 @@ class DeviceProbeService:
             # Fallback a scan diretto
             return await self.scan_services(address, agent=None, use_agent=False)
 
+    async def _probe_credential(
+        self,
+        address: str,
+        creds: Dict[str, Any],
+        cred_name: str,
+        available_protocols: List[str]
+    ) -> List[ProbeResult]:
+        """Esegue il probe di una credenziale sui protocolli del suo tipo"""
+        cred_type = creds.get("type", "")
+        
+        # Scegli protocolli in base al tipo credenziali
+        if cred_type == "mikrotik" or cred_type == "routeros":
+            protocols = ["mikrotik_api"]
+        elif cred_type == "ssh" or cred_type == "linux":
+            protocols = ["ssh"]
+        elif cred_type == "snmp":
+            protocols = ["snmp"]
+        elif cred_type == "wmi" or cred_type == "windows":
+            protocols = ["wmi"]
+        else:
+            # Prova tutti i protocolli disponibili
+            protocols = available_protocols
+        
+        logger.debug(f"Testing credential '{cred_name}' (type: {cred_type}) with protocols: {protocols}")
+        return await self.probe_device(address, creds, protocols)
+    
+    def _merge_probe_results(
+        self,
+        address: str,
+        result: Dict[str, Any],
+        probe_results: List[ProbeResult],
+        cred_name: str
+    ) -> bool:
+        """
+        Aggiunge i probe a result["probe_results"] e, se uno ha identificato
+        il dispositivo, ne copia i dati in result. Ritorna True se identificato.
+        """
+        # Arricchisci i risultati con i dati extra raccolti
+        for probe in probe_results:
+            result["probe_results"].append({
+                "protocol": probe.protocol,
+                "success": probe.success,
+                "device_type": probe.device_type,
+                "category": probe.category,
+                "os_family": probe.os_family,
+                "hostname": probe.hostname,
+                "error": probe.error,
+                "extra_info": probe.extra_info # Includi extra info
+            })
+        
+        # Se trovato un risultato positivo, aggiorna
+        for probe in probe_results:
+            if probe.success and probe.device_type:
+                result["device_type"] = probe.device_type
+                result["category"] = probe.category
+                result["os_family"] = probe.os_family
+                result["hostname"] = probe.hostname
+                result["model"] = probe.model
+                result["identified_by"] = f"probe_{probe.protocol}"
+                result["credential_used"] = cred_name
+                
+                # Merge extra info into main result
+                # Questo include: cpu_model, cpu_cores, memory_total_mb, 
+                # disk_total_gb, disk_free_gb, serial_number, manufacturer, domain, etc.
+                if probe.extra_info:
+                    logger.debug(f"Merging extra_info from {probe.protocol}: {list(probe.extra_info.keys())}")
+                    for key, value in probe.extra_info.items():
+                        if value is not None and value != "":
+                            result[key] = value
+
+                logger.success(f"Device {address} identified via {probe.protocol}: type={probe.device_type}, hostname={probe.hostname}, extra_keys={list(probe.extra_info.keys()) if probe.extra_info else []}")
+                return True
+        
+        return False
+    
+    async def _try_credentials_parallel(
+        self,
+        address: str,
+        credentials_list: List[Dict],
+        result: Dict[str, Any]
+    ):
+        """
+        Prova le credenziali in parallelo (al massimo MAX_PARALLEL_CREDENTIALS
+        alla volta) con lo stesso esito del ciclo sequenziale: i risultati
+        vengono valutati nell'ordine della lista (credenziale assegnata, poi
+        wmi > snmp > ssh), quindi vince la prima credenziale in ordine di
+        priorità che identifica il dispositivo, non la più veloce.
+        Trovata quella, i probe successivi ancora in coda vengono cancellati.
+        """
+        semaphore = asyncio.Semaphore(self.MAX_PARALLEL_CREDENTIALS)
+        
+        async def probe_one(creds: Dict[str, Any], cred_name: str) -> List[ProbeResult]:
+            async with semaphore:
+                return await self._probe_credential(address, creds, cred_name, result["available_protocols"])
+        
+        tasks = []
+        for idx, creds in enumerate(credentials_list, 1):
+            cred_name = creds.get("name", f"credential-{idx}")
+            tasks.append((asyncio.create_task(probe_one(creds, cred_name)), cred_name))
+        
+        try:
+            # Attende in ordine di priorità: una credenziale viene considerata
+            # solo dopo che tutte quelle prima di lei hanno terminato
+            for task, cred_name in tasks:
+                try:
+                    probe_results = await task
+                except Exception as e:
+                    logger.error(f"Credential probe '{cred_name}' failed for {address}: {e}")
+                    continue
+                if self._merge_probe_results(address, result, probe_results, cred_name):
+                    return
+        finally:
+            for task, _ in tasks:
+                if not task.done():
+                    task.cancel()
+    
     async def auto_identify_device(
         self,
         address: str,
         mac_address: str = None,
         credentials_list: List[Dict] = None,
         agent: Optional['MikroTikAgent'] = None,
-        use_agent: bool = True
+        use_agent: bool = True,
+        parallel_credentials: bool = False
     ) -> Dict[str, Any]:
         """
         Identificazione automatica del dispositivo.
@@ -1765,6 +1908,9 @@ class DeviceProbeService:
             credentials_list: Lista credenziali da provare
             agent: Agente MikroTik per operazioni remote (opzionale)
             use_agent: Se True e agent è specificato, usa l'agente per port scan e DNS
+            parallel_credentials: Se True prova le credenziali in parallelo
+                (max MAX_PARALLEL_CREDENTIALS); vince comunque la prima che identifica
+                nell'ordine della lista, come nel ciclo sequenziale
 
         Returns:
             Dict con device_type, category, os_family, hostname, etc
@@ -1810,67 +1956,15 @@ class DeviceProbeService:
         # 3. Prova credenziali se fornite
         if credentials_list:
             logger.info(f"Testing {len(credentials_list)} credential(s) for {address}")
-            for idx, creds in enumerate(credentials_list, 1):
-                cred_type = creds.get("type", "")
-                cred_name = creds.get("name", f"credential-{idx}")
-
-                # Scegli protocolli in base al tipo credenziali
-                protocols = []
-                if cred_type == "mikrotik" or cred_type == "routeros":
-                    protocols = ["mikrotik_api"]
-                elif cred_type == "ssh" or cred_type == "linux":
-                    protocols = ["ssh"]
-                elif cred_type == "snmp":
-                    protocols = ["snmp"]
-                elif cred_type == "wmi" or cred_type == "windows":
-                    protocols = ["wmi"]
-                else:
-                    # Prova tutti i protocolli disponibili
-                    protocols = result["available_protocols"]
-
-                logger.debug(f"Testing credential '{cred_name}' (type: {cred_type}) with protocols: {protocols}")
-                probe_results = await self.probe_device(address, creds, protocols)
-                
-                # Arricchisci i risultati con i dati extra raccolti
-                for probe in probe_results:
-                     probe_data = {
-                        "protocol": probe.protocol,
-                        "success": probe.success,
-                        "device_type": probe.device_type,
-                        "category": probe.category,
-                        "os_family": probe.os_family,
-                        "hostname": probe.hostname,
-                        "error": probe.error,
-                        "extra_info": probe.extra_info # Includi extra info
-                    }
-                     result["probe_results"].append(probe_data)
-
-                # Se trovato un risultato positivo, aggiorna
-                for probe in probe_results:
-                    if probe.success and probe.device_type:
-                        result["device_type"] = probe.device_type
-                        result["category"] = probe.category
-                        result["os_family"] = probe.os_family
-                        result["hostname"] = probe.hostname
-                        result["model"] = probe.model
-                        result["identified_by"] = f"probe_{probe.protocol}"
-                        result["credential_used"] = cred_name
-                        
-                        # Merge extra info into main result
-                        # Questo include: cpu_model, cpu_cores, memory_total_mb, 
-                        # disk_total_gb, disk_free_gb, serial_number, manufacturer, domain, etc.
-                        if probe.extra_info:
-                            logger.debug(f"Merging extra_info from {probe.protocol}: {list(probe.extra_info.keys())}")
-                            for key, value in probe.extra_info.items():
-                                if value is not None and value != "":
-                                    result[key] = value
-
-                        logger.success(f"Device {address} identified via {probe.protocol}: type={probe.device_type}, hostname={probe.hostname}, extra_keys={list(probe.extra_info.keys()) if probe.extra_info else []}")
+            if parallel_credentials and len(credentials_list) > 1:
+                await self._try_credentials_parallel(address, credentials_list, result)
+            else:
+                for idx, creds in enumerate(credentials_list, 1):
+                    cred_name = creds.get("name", f"credential-{idx}")
+                    probe_results = await self._probe_credential(address, creds, cred_name, result["available_protocols"])
+                    if self._merge_probe_results(address, result, probe_results, cred_name):
                         break
 
-                if result["identified_by"] and result["identified_by"].startswith("probe_"):
-                    break
-
         # 4. Scansiona servizi attivi
         try:
             scan_method = "via agent" if agent and use_agent else "direct"
@@ -1880,7 +1974,7 @@ class DeviceProbeService:
             
             # Usa le porte aperte per migliorare identificazione OS/ruolo se non già identificato
             if not result.get("identified_by") or result["identified_by"] == "mac_vendor":
-                os_hint = self._identify_os_from_ports(result["open_ports"])
+                os_hint = self.identify_os_from_ports(result["open_ports"])
                 if os_hint:
                     if not result.get("os_family"):
                         result["os_family"] = os_hint.get("os_family")
@@ -1901,7 +1995,7 @@ class DeviceProbeService:
 
         return result
 
-    def _identify_os_from_ports(self, open_ports: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def identify_os_from_ports(self, open_ports: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         """
         Identifica OS/ruolo sistema basandosi sulle porte aperte.
         
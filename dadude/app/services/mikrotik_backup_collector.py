@@ -9,12 +9,16 @@ import paramiko
 import time
 import logging
 import hashlib
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
 from datetime import datetime
 from pathlib import Path
 import re
 
 
+# Dimensione blocchi per download SFTP e scrittura su disco dei backup binari
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
 class MikroTikBackupCollector:
     """
     Collector per backup configurazioni RouterOS MikroTik
@@ -435,7 +439,7 @@ class MikroTikBackupCollector:
 
             # Download via SFTP
             if backup_path:
-                local_path = self._download_backup_sftp(
+                local_path, size, checksum = self._download_backup_sftp(
                     client=client,
                     remote_filename=f"{remote_filename}.backup",
                     device_info=device_info,
@@ -444,16 +448,8 @@ class MikroTikBackupCollector:
                 )
 
                 result["binary_file_path"] = local_path
-
-                # Calcola dimensione e checksum
-                local_file = Path(local_path)
-                if local_file.exists():
-                    result["binary_size_bytes"] = local_file.stat().st_size
-
-                    # Checksum SHA256
-                    with open(local_file, 'rb') as f:
-                        file_hash = hashlib.sha256(f.read()).hexdigest()
-                        result["binary_checksum"] = file_hash
+                result["binary_size_bytes"] = size
+                result["binary_checksum"] = checksum
 
                 # Cleanup file remoto
                 self.logger.info("Cleaning up remote backup file...")
@@ -469,8 +465,15 @@ class MikroTikBackupCollector:
 
     def _download_backup_sftp(self, client: paramiko.SSHClient, remote_filename: str,
                              device_info: Dict[str, Any], backup_path: str,
-                             host: str) -> str:
-        """Download file backup via SFTP"""
+                             host: str) -> tuple:
+        """
+        Download file backup via SFTP.
+        Scrive a blocchi calcolando lo SHA256 durante il trasferimento,
+        senza rileggere il file dal disco.
+
+        Returns:
+            (local_path, size_bytes, sha256)
+        """
         identity = device_info.get("identity", host.replace('.', '_'))
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
@@ -485,26 +488,109 @@ class MikroTikBackupCollector:
         sftp = client.open_sftp()
         self.logger.info(f"Downloading {remote_filename} to {local_path}...")
 
-        sftp.get(remote_filename, str(local_path))
-        sftp.close()
+        file_hash = hashlib.sha256()
+        size = 0
+        try:
+            with sftp.open(remote_filename, 'rb') as remote, open(local_path, 'wb') as f:
+                # Richieste di lettura in pipeline, come sftp.get()
+                remote.prefetch()
+                while True:
+                    chunk = remote.read(_DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    file_hash.update(chunk)
+                    size += len(chunk)
+        finally:
+            sftp.close()
 
         self.logger.info(f"Download completed: {local_path}")
-        return str(local_path)
+        return str(local_path), size, file_hash.hexdigest()
 
-    def _save_export(self, config: str, device_info: Dict[str, Any],
-                    backup_path: str, host: str) -> str:
-        """Salva export testuale su file"""
+    def stream_export(self, host: str, username: str, password: str,
+                      port: int = 22, backup_path: Optional[str] = None,
+                      chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Export testuale in streaming: blocchi di righe di /export verbose
+        man mano che arrivano dal router, senza tenere in memoria l'intera
+        configurazione. Con backup_path l'export viene anche salvato su file
+        (stesso formato di _save_export).
+
+        Generatore: connessione ed errori SSH avvengono al primo next().
+        """
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        out_file = None
+
+        try:
+            self.logger.info(f"Connecting to MikroTik {host}:{port} for streamed export...")
+            client.connect(
+                hostname=host,
+                port=port,
+                username=username,
+                password=password,
+                timeout=self.timeout,
+                allow_agent=False,
+                look_for_keys=False,
+                banner_timeout=30
+            )
+
+            if backup_path:
+                device_info = self._get_device_info(client)
+                device_info["backup_timestamp"] = datetime.now().isoformat()
+                out_file = open(self._export_file_path(device_info, backup_path, host), 'w', encoding='utf-8')
+                out_file.write(self._export_header(device_info, host))
+
+            stdin, stdout, stderr = client.exec_command('/export verbose')
+
+            pending = b""
+            while True:
+                data = stdout.read(chunk_size)
+                if data:
+                    pending += data
+                    raw_lines = pending.split(b"\n")
+                    pending = raw_lines.pop()
+                else:
+                    # Fine output: l'ultima riga non ha newline
+                    raw_lines, pending = [pending], b""
+
+                # Stessa pulizia di _export_config: niente righe vuote né prompt
+                lines = []
+                for raw in raw_lines:
+                    line = raw.decode('utf-8', errors='ignore').rstrip('\r')
+                    if line.strip() and not line.strip().startswith('['):
+                        lines.append(line + "\n")
+
+                if lines:
+                    chunk = "".join(lines)
+                    if out_file:
+                        out_file.write(chunk)
+                    yield chunk.encode('utf-8')
+
+                if not data:
+                    break
+
+        finally:
+            if out_file:
+                out_file.close()
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _export_file_path(self, device_info: Dict[str, Any], backup_path: str, host: str) -> Path:
+        """Percorso file .rsc dell'export (crea la directory del device)"""
         identity = device_info.get("identity", host.replace('.', '_'))
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
         backup_dir = Path(backup_path) / identity
         backup_dir.mkdir(parents=True, exist_ok=True)
 
-        file_name = f"{identity}_{timestamp}.rsc"
-        file_path = backup_dir / file_name
+        return backup_dir / f"{identity}_{timestamp}.rsc"
 
-        # Header informativo
-        header = f"""# MikroTik RouterOS Configuration Export
+    def _export_header(self, device_info: Dict[str, Any], host: str) -> str:
+        """Header informativo del file di export"""
+        return f"""# MikroTik RouterOS Configuration Export
 # Identity: {device_info.get('identity', 'unknown')}
 # Model: {device_info.get('model', 'unknown')}
 # Version: {device_info.get('version', 'unknown')}
@@ -515,8 +601,13 @@ class MikroTikBackupCollector:
 
 """
 
+    def _save_export(self, config: str, device_info: Dict[str, Any],
+                    backup_path: str, host: str) -> str:
+        """Salva export testuale su file"""
+        file_path = self._export_file_path(device_info, backup_path, host)
+
         with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(header)
+            f.write(self._export_header(device_info, host))
             f.write(config)
 
         return str(file_path)
@@ -4,28 +4,77 @@ Gestione funzionalità avanzate su router MikroTik remoti
 """
 from typing import Optional, List, Dict, Any
 from loguru import logger
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
 import routeros_api
+import select
+import threading
+import time
 from datetime import datetime
 
 
-class MikroTikRemoteService:
+@dataclass(frozen=True, slots=True)
+class MikroTikConnSpec:
+    """Parametri di connessione API RouterOS, come attesi dai metodi del servizio"""
+    address: str
+    port: int
+    username: str
+    password: str
+    use_ssl: bool = False
+    
+    @classmethod
+    def from_credential(cls, credential: Any, address: Optional[str] = None) -> "MikroTikConnSpec":
+        """
+        Parametri da una credenziale, con le regole di priorità:
+        - indirizzo: address dato (device_ip o device associato), poi address della credenziale
+        - porta: mikrotik_api_port, poi port generico, poi 8728
+        - SSL: mikrotik_api_ssl se impostato, altrimenti use_ssl generico
+        """
+        use_ssl = getattr(credential, 'mikrotik_api_ssl', None)
+        if use_ssl is None:
+            use_ssl = getattr(credential, 'use_ssl', False)
+        
+        return cls(
+            address=address or getattr(credential, 'address', None) or "",
+            port=getattr(credential, 'mikrotik_api_port', None) or getattr(credential, 'port', None) or 8728,
+            username=credential.username or "admin",
+            password=credential.password or "",
+            use_ssl=bool(use_ssl),
+        )
+    
+    def as_kwargs(self) -> Dict[str, Any]:
+        return {
+            "address": self.address,
+            "port": self.port,
+            "username": self.username,
+            "password": self.password,
+            "use_ssl": self.use_ssl,
+        }
+
+
+class MikroTikConnectionPool:
     """
-    Servizio per operazioni avanzate su router MikroTik remoti.
-    Supporta: ip-scan, netwatch, snmp, neighbor discovery
+    Connessioni API RouterOS riutilizzabili tra le chiamate, per
+    (address, port, username, password, use_ssl): evita connect + login
+    a ogni richiesta.
+    
+    Una connessione è usata da un solo thread alla volta: acquire() la
+    preleva dal pool e la restituisce a fine blocco, oppure la chiude se
+    il blocco solleva un'eccezione. Le connessioni inattive da più di
+    idle_ttl secondi vengono chiuse; oltre max_size si chiudono le più vecchie.
+    Prima di riusare una connessione libera si verifica che il router non
+    l'abbia chiusa nel frattempo.
     """
     
-    def __init__(self):
-        self._connections: Dict[str, Any] = {}
+    def __init__(self, max_size: int = 64, idle_ttl: float = 60.0):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        # Connessioni libere in ordine di rilascio: (key, RouterOsApiPool, api, last_used)
+        self._idle: deque = deque()
     
-    def _get_connection(
-        self,
-        address: str,
-        port: int,
-        username: str,
-        password: str,
-        use_ssl: bool = False,
-    ) -> Any:
-        """Ottiene connessione API al router"""
+    def _connect(self, address: str, port: int, username: str, password: str, use_ssl: bool):
         try:
             connection = routeros_api.RouterOsApiPool(
                 host=address,
@@ -36,11 +85,113 @@ class MikroTikRemoteService:
                 ssl_verify=False,
                 plaintext_login=True,
             )
-            return connection.get_api()
+            return connection, connection.get_api()
         except Exception as e:
             logger.error(f"Connection error to {address}: {e}")
             raise
     
+    @staticmethod
+    def _close(connection) -> None:
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        """
+        Connessione libera ancora utilizzabile. Da inattiva non deve avere nulla
+        da leggere: un socket leggibile ha ricevuto EOF, reset (anche dal
+        keepalive TCP) o un !fatal del router.
+        """
+        sock = getattr(connection.socket, "socket", None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+    
+    def _take_expired(self, now: float) -> list:
+        """Rimuove (sotto lock) le connessioni scadute o in eccesso e le ritorna"""
+        expired = []
+        while self._idle and (
+            len(self._idle) > self.max_size or now - self._idle[0][3] > self.idle_ttl
+        ):
+            expired.append(self._idle.popleft()[1])
+        return expired
+    
+    @contextmanager
+    def acquire(self, address: str, port: int, username: str, password: str, use_ssl: bool = False):
+        key = (address, port, username, password, bool(use_ssl))
+        while True:
+            entry = None
+            with self._lock:
+                expired = self._take_expired(time.monotonic())
+                # La più recente per questa chiave
+                for i in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[i][0] == key:
+                        entry = self._idle[i]
+                        del self._idle[i]
+                        break
+            for connection in expired:
+                self._close(connection)
+            if entry is None or self._is_alive(entry[1]):
+                break
+            # Chiusa lato router: scartala e prova la successiva (o una nuova)
+            self._close(entry[1])
+        
+        if entry:
+            _, connection, api, _ = entry
+        else:
+            connection, api = self._connect(address, port, username, password, use_ssl)
+        
+        try:
+            yield api
+        except BaseException:
+            # Stato del socket incerto: non riutilizzare
+            self._close(connection)
+            raise
+        
+        with self._lock:
+            self._idle.append((key, connection, api, time.monotonic()))
+            expired = self._take_expired(time.monotonic())
+        for connection in expired:
+            self._close(connection)
+    
+    def close_all(self) -> None:
+        """Chiude tutte le connessioni libere"""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for entry in idle:
+            self._close(entry[1])
+
+
+class MikroTikRemoteService:
+    """
+    Servizio per operazioni avanzate su router MikroTik remoti.
+    Supporta: ip-scan, netwatch, snmp, neighbor discovery
+    """
+    
+    def __init__(self):
+        self._pool = MikroTikConnectionPool()
+    
+    def _api(
+        self,
+        address: str,
+        port: int,
+        username: str,
+        password: str,
+        use_ssl: bool = False,
+    ):
+        """Connessione API al router dal pool (context manager)"""
+        return self._pool.acquire(address, port, username, password, use_ssl)
+    
+    def close_connections(self) -> None:
+        """Chiude le connessioni API in pool (shutdown)"""
+        self._pool.close_all()
+    
     # ==========================================
     # SYSTEM INFO
     # ==========================================
@@ -55,51 +206,50 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene informazioni complete del sistema RouterOS"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            # Identity
-            identity = api.get_resource('/system/identity').get()
-            
-            # Resource (CPU, RAM, etc)
-            resource = api.get_resource('/system/resource').get()
-            
-            # RouterBoard info
-            try:
-                routerboard = api.get_resource('/system/routerboard').get()
-            except:
-                routerboard = [{}]
-            
-            # License
-            try:
-                license_info = api.get_resource('/system/license').get()
-            except:
-                license_info = [{}]
-            
-            res = resource[0] if resource else {}
-            rb = routerboard[0] if routerboard else {}
-            lic = license_info[0] if license_info else {}
-            
-            return {
-                "success": True,
-                "identity": identity[0].get("name") if identity else "",
-                "version": res.get("version", ""),
-                "board_name": res.get("board-name", ""),
-                "platform": res.get("platform", ""),
-                "architecture": res.get("architecture-name", ""),
-                "cpu_model": res.get("cpu", ""),
-                "cpu_count": int(res.get("cpu-count", 1)),
-                "cpu_frequency": int(res.get("cpu-frequency", 0)),
-                "cpu_load": int(res.get("cpu-load", 0)),
-                "memory_total_mb": int(res.get("total-memory", 0)) // (1024*1024),
-                "memory_free_mb": int(res.get("free-memory", 0)) // (1024*1024),
-                "hdd_total_mb": int(res.get("total-hdd-space", 0)) // (1024*1024),
-                "hdd_free_mb": int(res.get("free-hdd-space", 0)) // (1024*1024),
-                "uptime": res.get("uptime", ""),
-                "routerboard": rb.get("model", ""),
-                "serial_number": rb.get("serial-number", ""),
-                "firmware": rb.get("current-firmware", ""),
-                "license_level": lic.get("level", ""),
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                # Identity
+                identity = api.get_resource('/system/identity').get()
+                
+                # Resource (CPU, RAM, etc)
+                resource = api.get_resource('/system/resource').get()
+                
+                # RouterBoard info
+                try:
+                    routerboard = api.get_resource('/system/routerboard').get()
+                except:
+                    routerboard = [{}]
+                
+                # License
+                try:
+                    license_info = api.get_resource('/system/license').get()
+                except:
+                    license_info = [{}]
+                
+                res = resource[0] if resource else {}
+                rb = routerboard[0] if routerboard else {}
+                lic = license_info[0] if license_info else {}
+                
+                return {
+                    "success": True,
+                    "identity": identity[0].get("name") if identity else "",
+                    "version": res.get("version", ""),
+                    "board_name": res.get("board-name", ""),
+                    "platform": res.get("platform", ""),
+                    "architecture": res.get("architecture-name", ""),
+                    "cpu_model": res.get("cpu", ""),
+                    "cpu_count": int(res.get("cpu-count", 1)),
+                    "cpu_frequency": int(res.get("cpu-frequency", 0)),
+                    "cpu_load": int(res.get("cpu-load", 0)),
+                    "memory_total_mb": int(res.get("total-memory", 0)) // (1024*1024),
+                    "memory_free_mb": int(res.get("free-memory", 0)) // (1024*1024),
+                    "hdd_total_mb": int(res.get("total-hdd-space", 0)) // (1024*1024),
+                    "hdd_free_mb": int(res.get("free-hdd-space", 0)) // (1024*1024),
+                    "uptime": res.get("uptime", ""),
+                    "routerboard": rb.get("model", ""),
+                    "serial_number": rb.get("serial-number", ""),
+                    "firmware": rb.get("current-firmware", ""),
+                    "license_level": lic.get("level", ""),
+                }
         except Exception as e:
             logger.error(f"Error getting system info: {e}")
             return {"success": False, "error": str(e)}
@@ -135,46 +285,45 @@ class MikroTikRemoteService:
         try:
             import ipaddress
             
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            # Leggi tabella ARP completa
-            arp_resource = api.get_resource('/ip/arp')
-            arps = arp_resource.get()
-            
-            # Filtra per network
-            try:
-                net = ipaddress.ip_network(network_cidr, strict=False)
-            except ValueError as e:
-                return {"success": False, "error": f"Invalid network: {e}"}
-            
-            results = []
-            for a in arps:
-                ip_str = a.get("address", "")
-                if not ip_str:
-                    continue
-                    
+            with self._api(address, port, username, password, use_ssl) as api:
+                # Leggi tabella ARP completa
+                arp_resource = api.get_resource('/ip/arp')
+                arps = arp_resource.get()
+                
+                # Filtra per network
                 try:
-                    ip = ipaddress.ip_address(ip_str)
-                    if ip in net:
-                        mac = a.get("mac-address", "")
-                        if mac and mac != "00:00:00:00:00:00":
-                            results.append({
-                                "ip": ip_str,
-                                "mac": mac.upper(),
-                                "interface": a.get("interface", ""),
-                                "complete": a.get("complete", "") == "true",
-                            })
-                except ValueError:
-                    continue
-            
-            logger.info(f"MikroTik ARP for {network_cidr}: found {len(results)} entries")
-            
-            return {
-                "success": True,
-                "network": network_cidr,
-                "entries": results,
-                "count": len(results),
-            }
+                    net = ipaddress.ip_network(network_cidr, strict=False)
+                except ValueError as e:
+                    return {"success": False, "error": f"Invalid network: {e}"}
+                
+                results = []
+                for a in arps:
+                    ip_str = a.get("address", "")
+                    if not ip_str:
+                        continue
+                        
+                    try:
+                        ip = ipaddress.ip_address(ip_str)
+                        if ip in net:
+                            mac = a.get("mac-address", "")
+                            if mac and mac != "00:00:00:00:00:00":
+                                results.append({
+                                    "ip": ip_str,
+                                    "mac": mac.upper(),
+                                    "interface": a.get("interface", ""),
+                                    "complete": a.get("complete", "") == "true",
+                                })
+                    except ValueError:
+                        continue
+                
+                logger.info(f"MikroTik ARP for {network_cidr}: found {len(results)} entries")
+                
+                return {
+                    "success": True,
+                    "network": network_cidr,
+                    "entries": results,
+                    "count": len(results),
+                }
             
         except Exception as e:
             logger.error(f"Error getting ARP for network {network_cidr}: {e}")
@@ -205,81 +354,80 @@ class MikroTikRemoteService:
             duration: Durata scansione in secondi
         """
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            # Prepara parametri
-            params = {
-                "address-range": network,
-                "duration": f"{duration}s",
-            }
-            
-            if interface:
-                params["interface"] = interface
-            
-            # Avvia ip-scan
-            # Nota: ip-scan è interattivo, dobbiamo usare un approccio diverso
-            # Usiamo il comando "run" per eseguire e raccogliere risultati
-            
-            scan_resource = api.get_resource('/tool')
-            
-            # RouterOS API non supporta direttamente ip-scan come resource
-            # Dobbiamo usare un workaround: leggere ARP + neighbor dopo un ping sweep
-            
-            # Alternativa: usa /ip arp + /ip neighbor che sono già popolati
-            logger.info(f"IP-scan not directly available via API, using ARP + Neighbor")
-            
-            results = []
-            
-            # ARP table
-            arp_resource = api.get_resource('/ip/arp')
-            arps = arp_resource.get()
-            
-            for a in arps:
-                ip = a.get("address", "")
-                # Filtra per rete se specificato
-                if network and "/" in network:
-                    import ipaddress
-                    try:
-                        net = ipaddress.ip_network(network, strict=False)
-                        if ipaddress.ip_address(ip) not in net:
-                            continue
-                    except:
-                        pass
+            with self._api(address, port, username, password, use_ssl) as api:
+                # Prepara parametri
+                params = {
+                    "address-range": network,
+                    "duration": f"{duration}s",
+                }
                 
-                results.append({
-                    "address": ip,
-                    "mac_address": a.get("mac-address", ""),
-                    "interface": a.get("interface", ""),
-                    "source": "arp",
-                    "complete": a.get("complete", "") == "true",
-                })
-            
-            # Neighbor discovery (MNDP/CDP/LLDP)
-            neighbor_resource = api.get_resource('/ip/neighbor')
-            neighbors = neighbor_resource.get()
-            
-            existing_ips = {r["address"] for r in results if r["address"]}
-            
-            for n in neighbors:
-                ip = n.get("address", "")
-                if ip and ip not in existing_ips:
+                if interface:
+                    params["interface"] = interface
+                
+                # Avvia ip-scan
+                # Nota: ip-scan è interattivo, dobbiamo usare un approccio diverso
+                # Usiamo il comando "run" per eseguire e raccogliere risultati
+                
+                scan_resource = api.get_resource('/tool')
+                
+                # RouterOS API non supporta direttamente ip-scan come resource
+                # Dobbiamo usare un workaround: leggere ARP + neighbor dopo un ping sweep
+                
+                # Alternativa: usa /ip arp + /ip neighbor che sono già popolati
+                logger.info(f"IP-scan not directly available via API, using ARP + Neighbor")
+                
+                results = []
+                
+                # ARP table
+                arp_resource = api.get_resource('/ip/arp')
+                arps = arp_resource.get()
+                
+                for a in arps:
+                    ip = a.get("address", "")
+                    # Filtra per rete se specificato
+                    if network and "/" in network:
+                        import ipaddress
+                        try:
+                            net = ipaddress.ip_network(network, strict=False)
+                            if ipaddress.ip_address(ip) not in net:
+                                continue
+                        except:
+                            pass
+                    
                     results.append({
                         "address": ip,
-                        "mac_address": n.get("mac-address", ""),
-                        "interface": n.get("interface", ""),
-                        "identity": n.get("identity", ""),
-                        "platform": n.get("platform", ""),
-                        "board": n.get("board", ""),
-                        "version": n.get("version", ""),
-                        "source": "neighbor",
+                        "mac_address": a.get("mac-address", ""),
+                        "interface": a.get("interface", ""),
+                        "source": "arp",
+                        "complete": a.get("complete", "") == "true",
                     })
-            
-            return {
-                "success": True,
-                "network": network,
-                "devices_found": len(results),
-                "results": results,
-            }
+                
+                # Neighbor discovery (MNDP/CDP/LLDP)
+                neighbor_resource = api.get_resource('/ip/neighbor')
+                neighbors = neighbor_resource.get()
+                
+                existing_ips = {r["address"] for r in results if r["address"]}
+                
+                for n in neighbors:
+                    ip = n.get("address", "")
+                    if ip and ip not in existing_ips:
+                        results.append({
+                            "address": ip,
+                            "mac_address": n.get("mac-address", ""),
+                            "interface": n.get("interface", ""),
+                            "identity": n.get("identity", ""),
+                            "platform": n.get("platform", ""),
+                            "board": n.get("board", ""),
+                            "version": n.get("version", ""),
+                            "source": "neighbor",
+                        })
+                
+                return {
+                    "success": True,
+                    "network": network,
+                    "devices_found": len(results),
+                    "results": results,
+                }
             
         except Exception as e:
             logger.error(f"Error running ip-scan: {e}")
@@ -299,31 +447,30 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene lista netwatch configurati sul router"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            netwatch_resource = api.get_resource('/tool/netwatch')
-            netwatches = netwatch_resource.get()
-            
-            results = []
-            for nw in netwatches:
-                results.append({
-                    "id": nw.get(".id", ""),
-                    "host": nw.get("host", ""),
-                    "port": nw.get("port", ""),
-                    "type": nw.get("type", "icmp"),
-                    "interval": nw.get("interval", ""),
-                    "timeout": nw.get("timeout", ""),
-                    "status": nw.get("status", "unknown"),
-                    "since": nw.get("since", ""),
-                    "disabled": nw.get("disabled", "false") == "true",
-                    "comment": nw.get("comment", ""),
-                })
-            
-            return {
-                "success": True,
-                "count": len(results),
-                "netwatches": results,
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                netwatch_resource = api.get_resource('/tool/netwatch')
+                netwatches = netwatch_resource.get()
+                
+                results = []
+                for nw in netwatches:
+                    results.append({
+                        "id": nw.get(".id", ""),
+                        "host": nw.get("host", ""),
+                        "port": nw.get("port", ""),
+                        "type": nw.get("type", "icmp"),
+                        "interval": nw.get("interval", ""),
+                        "timeout": nw.get("timeout", ""),
+                        "status": nw.get("status", "unknown"),
+                        "since": nw.get("since", ""),
+                        "disabled": nw.get("disabled", "false") == "true",
+                        "comment": nw.get("comment", ""),
+                    })
+                
+                return {
+                    "success": True,
+                    "count": len(results),
+                    "netwatches": results,
+                }
             
         except Exception as e:
             logger.error(f"Error getting netwatch list: {e}")
@@ -346,40 +493,85 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Aggiunge un netwatch sul router remoto"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            params = {
-                "host": host,
-                "interval": interval,
-                "timeout": timeout,
-            }
-            
-            if target_port:
-                params["port"] = str(target_port)
-                params["type"] = "tcp-conn"
-            else:
-                params["type"] = "icmp"
-            
-            if up_script:
-                params["up-script"] = up_script
-            if down_script:
-                params["down-script"] = down_script
-            if comment:
-                params["comment"] = comment
-            
-            netwatch_resource = api.get_resource('/tool/netwatch')
-            result = netwatch_resource.add(**params)
-            
-            return {
-                "success": True,
-                "message": f"Netwatch per {host} creato",
-                "netwatch_id": result if isinstance(result, str) else None,
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                params = {
+                    "host": host,
+                    "interval": interval,
+                    "timeout": timeout,
+                }
+                
+                if target_port:
+                    params["port"] = str(target_port)
+                    params["type"] = "tcp-conn"
+                else:
+                    params["type"] = "icmp"
+                
+                if up_script:
+                    params["up-script"] = up_script
+                if down_script:
+                    params["down-script"] = down_script
+                if comment:
+                    params["comment"] = comment
+                
+                netwatch_resource = api.get_resource('/tool/netwatch')
+                result = netwatch_resource.add(**params)
+                
+                return {
+                    "success": True,
+                    "message": f"Netwatch per {host} creato",
+                    "netwatch_id": result if isinstance(result, str) else None,
+                }
             
         except Exception as e:
             logger.error(f"Error adding netwatch: {e}")
             return {"success": False, "error": str(e)}
     
+    def add_netwatch_batch(
+        self,
+        address: str,
+        port: int,
+        username: str,
+        password: str,
+        hosts: List[Dict[str, Any]],
+        interval: str = "30s",
+        timeout: str = "3s",
+        use_ssl: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggiunge più netwatch ICMP sullo stesso router con una sola connessione API.
+        hosts: dict con "host" e "comment" opzionale.
+        Ritorna un risultato per host, nello stesso ordine.
+        """
+        results = []
+        try:
+            with self._api(address, port, username, password, use_ssl) as api:
+                netwatch_resource = api.get_resource('/tool/netwatch')
+                
+                for entry in hosts:
+                    params = {
+                        "host": entry["host"],
+                        "interval": interval,
+                        "timeout": timeout,
+                        "type": "icmp",
+                    }
+                    if entry.get("comment"):
+                        params["comment"] = entry["comment"]
+                    
+                    try:
+                        result = netwatch_resource.add(**params)
+                        results.append({
+                            "success": True,
+                            "netwatch_id": result if isinstance(result, str) else None,
+                        })
+                    except Exception as e:
+                        logger.error(f"Error adding netwatch for {entry['host']}: {e}")
+                        results.append({"success": False, "error": str(e)})
+        except Exception as e:
+            # Connessione fallita: errore per gli host non ancora processati
+            results.extend({"success": False, "error": str(e)} for _ in hosts[len(results):])
+        
+        return results
+    
     def remove_netwatch(
         self,
         address: str,
@@ -391,15 +583,14 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Rimuove un netwatch dal router"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            netwatch_resource = api.get_resource('/tool/netwatch')
-            netwatch_resource.remove(id=netwatch_id)
-            
-            return {
-                "success": True,
-                "message": f"Netwatch {netwatch_id} rimosso",
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                netwatch_resource = api.get_resource('/tool/netwatch')
+                netwatch_resource.remove(id=netwatch_id)
+                
+                return {
+                    "success": True,
+                    "message": f"Netwatch {netwatch_id} rimosso",
+                }
             
         except Exception as e:
             logger.error(f"Error removing netwatch: {e}")
@@ -417,15 +608,14 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Aggiorna un netwatch esistente"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            netwatch_resource = api.get_resource('/tool/netwatch')
-            netwatch_resource.set(id=netwatch_id, **kwargs)
-            
-            return {
-                "success": True,
-                "message": f"Netwatch {netwatch_id} aggiornato",
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                netwatch_resource = api.get_resource('/tool/netwatch')
+                netwatch_resource.set(id=netwatch_id, **kwargs)
+                
+                return {
+                    "success": True,
+                    "message": f"Netwatch {netwatch_id} aggiornato",
+                }
             
         except Exception as e:
             logger.error(f"Error updating netwatch: {e}")
@@ -445,31 +635,30 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene lista interfacce del router"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            interface_resource = api.get_resource('/interface')
-            interfaces = interface_resource.get()
-            
-            results = []
-            for iface in interfaces:
-                results.append({
-                    "id": iface.get(".id", ""),
-                    "name": iface.get("name", ""),
-                    "type": iface.get("type", ""),
-                    "mac_address": iface.get("mac-address", ""),
-                    "mtu": iface.get("mtu", ""),
-                    "running": iface.get("running", "false") == "true",
-                    "disabled": iface.get("disabled", "false") == "true",
-                    "rx_bytes": int(iface.get("rx-byte", 0)),
-                    "tx_bytes": int(iface.get("tx-byte", 0)),
-                    "comment": iface.get("comment", ""),
-                })
-            
-            return {
-                "success": True,
-                "count": len(results),
-                "interfaces": results,
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                interface_resource = api.get_resource('/interface')
+                interfaces = interface_resource.get()
+                
+                results = []
+                for iface in interfaces:
+                    results.append({
+                        "id": iface.get(".id", ""),
+                        "name": iface.get("name", ""),
+                        "type": iface.get("type", ""),
+                        "mac_address": iface.get("mac-address", ""),
+                        "mtu": iface.get("mtu", ""),
+                        "running": iface.get("running", "false") == "true",
+                        "disabled": iface.get("disabled", "false") == "true",
+                        "rx_bytes": int(iface.get("rx-byte", 0)),
+                        "tx_bytes": int(iface.get("tx-byte", 0)),
+                        "comment": iface.get("comment", ""),
+                    })
+                
+                return {
+                    "success": True,
+                    "count": len(results),
+                    "interfaces": results,
+                }
             
         except Exception as e:
             logger.error(f"Error getting interfaces: {e}")
@@ -485,28 +674,27 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene indirizzi IP configurati"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            ip_resource = api.get_resource('/ip/address')
-            addresses = ip_resource.get()
-            
-            results = []
-            for addr in addresses:
-                results.append({
-                    "id": addr.get(".id", ""),
-                    "address": addr.get("address", ""),
-                    "network": addr.get("network", ""),
-                    "interface": addr.get("interface", ""),
-                    "disabled": addr.get("disabled", "false") == "true",
-                    "dynamic": addr.get("dynamic", "false") == "true",
-                    "comment": addr.get("comment", ""),
-                })
-            
-            return {
-                "success": True,
-                "count": len(results),
-                "addresses": results,
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                ip_resource = api.get_resource('/ip/address')
+                addresses = ip_resource.get()
+                
+                results = []
+                for addr in addresses:
+                    results.append({
+                        "id": addr.get(".id", ""),
+                        "address": addr.get("address", ""),
+                        "network": addr.get("network", ""),
+                        "interface": addr.get("interface", ""),
+                        "disabled": addr.get("disabled", "false") == "true",
+                        "dynamic": addr.get("dynamic", "false") == "true",
+                        "comment": addr.get("comment", ""),
+                    })
+                
+                return {
+                    "success": True,
+                    "count": len(results),
+                    "addresses": results,
+                }
             
         except Exception as e:
             logger.error(f"Error getting IP addresses: {e}")
@@ -526,32 +714,31 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene tabella routing"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            route_resource = api.get_resource('/ip/route')
-            routes = route_resource.get()
-            
-            results = []
-            for r in routes:
-                results.append({
-                    "id": r.get(".id", ""),
-                    "dst_address": r.get("dst-address", ""),
-                    "gateway": r.get("gateway", ""),
-                    "distance": r.get("distance", ""),
-                    "scope": r.get("scope", ""),
-                    "routing_table": r.get("routing-table", "main"),
-                    "active": r.get("active", "false") == "true",
-                    "dynamic": r.get("dynamic", "false") == "true",
-                    "static": r.get("static", "false") == "true",
-                    "disabled": r.get("disabled", "false") == "true",
-                    "comment": r.get("comment", ""),
-                })
-            
-            return {
-                "success": True,
-                "count": len(results),
-                "routes": results,
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                route_resource = api.get_resource('/ip/route')
+                routes = route_resource.get()
+                
+                results = []
+                for r in routes:
+                    results.append({
+                        "id": r.get(".id", ""),
+                        "dst_address": r.get("dst-address", ""),
+                        "gateway": r.get("gateway", ""),
+                        "distance": r.get("distance", ""),
+                        "scope": r.get("scope", ""),
+                        "routing_table": r.get("routing-table", "main"),
+                        "active": r.get("active", "false") == "true",
+                        "dynamic": r.get("dynamic", "false") == "true",
+                        "static": r.get("static", "false") == "true",
+                        "disabled": r.get("disabled", "false") == "true",
+                        "comment": r.get("comment", ""),
+                    })
+                
+                return {
+                    "success": True,
+                    "count": len(results),
+                    "routes": results,
+                }
             
         except Exception as e:
             logger.error(f"Error getting routes: {e}")
@@ -571,31 +758,30 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Ottiene statistiche firewall"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            # Filter rules count
-            filter_resource = api.get_resource('/ip/firewall/filter')
-            filter_rules = filter_resource.get()
-            
-            # NAT rules count
-            nat_resource = api.get_resource('/ip/firewall/nat')
-            nat_rules = nat_resource.get()
-            
-            # Mangle rules count
-            mangle_resource = api.get_resource('/ip/firewall/mangle')
-            mangle_rules = mangle_resource.get()
-            
-            # Connections count
-            conn_resource = api.get_resource('/ip/firewall/connection')
-            connections = conn_resource.get()
-            
-            return {
-                "success": True,
-                "filter_rules": len(filter_rules),
-                "nat_rules": len(nat_rules),
-                "mangle_rules": len(mangle_rules),
-                "active_connections": len(connections),
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                # Filter rules count
+                filter_resource = api.get_resource('/ip/firewall/filter')
+                filter_rules = filter_resource.get()
+                
+                # NAT rules count
+                nat_resource = api.get_resource('/ip/firewall/nat')
+                nat_rules = nat_resource.get()
+                
+                # Mangle rules count
+                mangle_resource = api.get_resource('/ip/firewall/mangle')
+                mangle_rules = mangle_resource.get()
+                
+                # Connections count
+                conn_resource = api.get_resource('/ip/firewall/connection')
+                connections = conn_resource.get()
+                
+                return {
+                    "success": True,
+                    "filter_rules": len(filter_rules),
+                    "nat_rules": len(nat_rules),
+                    "mangle_rules": len(mangle_rules),
+                    "active_connections": len(connections),
+                }
             
         except Exception as e:
             logger.error(f"Error getting firewall stats: {e}")
@@ -615,51 +801,50 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Verifica stato Dude Agent sul router"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            # Verifica se il pacchetto dude è installato
-            packages = api.get_resource('/system/package')
-            pkg_list = packages.get()
-            
-            dude_installed = False
-            dude_version = None
-            
-            for pkg in pkg_list:
-                if pkg.get("name") == "dude":
-                    dude_installed = True
-                    dude_version = pkg.get("version", "")
-                    break
-            
-            if not dude_installed:
-                return {
-                    "success": True,
-                    "dude_installed": False,
-                    "message": "Dude agent package non installato",
-                }
-            
-            # Ottieni configurazione dude agent
-            try:
-                dude_resource = api.get_resource('/dude')
-                dude_config = dude_resource.get()
+            with self._api(address, port, username, password, use_ssl) as api:
+                # Verifica se il pacchetto dude è installato
+                packages = api.get_resource('/system/package')
+                pkg_list = packages.get()
                 
-                config = dude_config[0] if dude_config else {}
+                dude_installed = False
+                dude_version = None
                 
-                return {
-                    "success": True,
-                    "dude_installed": True,
-                    "dude_version": dude_version,
-                    "enabled": config.get("enabled", "false") == "true",
-                    "server": config.get("server", ""),
-                    "status": config.get("status", "unknown"),
-                }
-            except:
-                return {
-                    "success": True,
-                    "dude_installed": True,
-                    "dude_version": dude_version,
-                    "enabled": None,
-                    "message": "Impossibile leggere configurazione dude",
-                }
+                for pkg in pkg_list:
+                    if pkg.get("name") == "dude":
+                        dude_installed = True
+                        dude_version = pkg.get("version", "")
+                        break
+                
+                if not dude_installed:
+                    return {
+                        "success": True,
+                        "dude_installed": False,
+                        "message": "Dude agent package non installato",
+                    }
+                
+                # Ottieni configurazione dude agent
+                try:
+                    dude_resource = api.get_resource('/dude')
+                    dude_config = dude_resource.get()
+                    
+                    config = dude_config[0] if dude_config else {}
+                    
+                    return {
+                        "success": True,
+                        "dude_installed": True,
+                        "dude_version": dude_version,
+                        "enabled": config.get("enabled", "false") == "true",
+                        "server": config.get("server", ""),
+                        "status": config.get("status", "unknown"),
+                    }
+                except:
+                    return {
+                        "success": True,
+                        "dude_installed": True,
+                        "dude_version": dude_version,
+                        "enabled": None,
+                        "message": "Impossibile leggere configurazione dude",
+                    }
             
         except Exception as e:
             logger.error(f"Error getting dude agent status: {e}")
@@ -677,19 +862,18 @@ class MikroTikRemoteService:
     ) -> Dict[str, Any]:
         """Configura Dude Agent sul router remoto"""
         try:
-            api = self._get_connection(address, port, username, password, use_ssl)
-            
-            dude_resource = api.get_resource('/dude')
-            
-            dude_resource.set(
-                server=dude_server,
-                enabled="yes" if enabled else "no",
-            )
-            
-            return {
-                "success": True,
-                "message": f"Dude agent configurato per connettersi a {dude_server}",
-            }
+            with self._api(address, port, username, password, use_ssl) as api:
+                dude_resource = api.get_resource('/dude')
+                
+                dude_resource.set(
+                    server=dude_server,
+                    enabled="yes" if enabled else "no",
+                )
+                
+                return {
+                    "success": True,
+                    "message": f"Dude agent configurato per connettersi a {dude_server}",
+                }
             
         except Exception as e:
             logger.error(f"Error configuring dude agent: {e}")
@@ -7,6 +7,8 @@ from typing import Optional, Dict, Any
 from pathlib import Path
 from loguru import logger
 
+from ..auth import invalidate_env_cache
+
 
 class SettingsService:
     """Servizio per gestione configurazione .env"""
@@ -109,6 +111,7 @@ class SettingsService:
             # Scrivi file
             with open(self.env_file, 'w') as f:
                 f.writelines(new_lines)
+            invalidate_env_cache()
             
             # Aggiorna anche environment corrente
             for key, value in updates.items():
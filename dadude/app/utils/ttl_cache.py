@@ -0,0 +1,101 @@
+"""
+TTL Cache Utility
+
+Cache in memoria con scadenza per chiave e dimensione massima, per
+risultati costosi (scansioni di rete, lookup DNS) richiesti spesso
+per gli stessi parametri.
+"""
+
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Cache LRU con time-to-live.
+
+    Le voci scadono dopo `ttl` secondi; oltre `maxsize` voci viene
+    rimossa la meno recente. get_or_set() serializza i miss concorrenti
+    sulla stessa chiave, così una sola coroutine calcola il valore.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Ritorna il valore se presente e non scaduto, altrimenti default"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            return default
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            # Rimossa nel frattempo da pop()/clear() chiamati da un altro thread
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Memorizza un valore con scadenza ttl"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Invalida una chiave (utilizzabile anche da thread diversi dal loop)"""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Svuota la cache"""
+        self._data.clear()
+
+    def get_for_sources(self, key: Hashable, sources: tuple, factory: Callable[[], Any]) -> Any:
+        """
+        Ritorna il valore per key se calcolato sugli stessi oggetti sources
+        (confronto per identità), altrimenti lo ricalcola con factory().
+        Per viste derivate da dati che vengono sostituiti, non modificati:
+        un nuovo oggetto sorgente invalida la voce senza doverla rimuovere.
+        """
+        entry = self.get(key)
+        if entry is not None and len(entry[0]) == len(sources) and all(
+            a is b for a, b in zip(entry[0], sources)
+        ):
+            return entry[1]
+        value = factory()
+        self.set(key, (sources, value))
+        return value
+
+    async def get_or_set(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ritorna il valore in cache o lo calcola con factory().
+        Le eccezioni di factory non vengono memorizzate.
+        """
+        value = self.get(key, self._MISSING)
+        if value is not self._MISSING:
+            return value
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+
+        async with lock:
+            # Un'altra coroutine potrebbe averlo calcolato nel frattempo
+            value = self.get(key, self._MISSING)
+            if value is not self._MISSING:
+                return value
+            value = await factory()
+            self.set(key, value)
+            return value
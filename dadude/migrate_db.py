@@ -305,6 +305,14 @@ def migrate_database(db_path: str = "./data/dadude.db"):
             print("Aggiungo colonna last_check a inventory_devices...")
             cursor.execute("ALTER TABLE inventory_devices ADD COLUMN last_check DATETIME")
         
+        # Indice per la lista inventario (filtro cliente + ordinamento per nome)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_list ON inventory_devices(customer_id, name, id)")
+        # Indici per cliente: duplicati/scansioni per IP e statistiche per tipo e stato
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_customer_ip ON inventory_devices(customer_id, primary_ip)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_customer_type_status ON inventory_devices(customer_id, device_type, status)")
+        # Indice per il device associato a una credenziale
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_credential ON inventory_devices(credential_id, primary_ip)")
+        
         # Crea tabella customer_credential_links se non esiste
         cursor.execute("""
             SELECT name FROM sqlite_master 
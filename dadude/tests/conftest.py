@@ -0,0 +1,31 @@
+"""
+Configurazione comune dei test: database SQLite temporaneo e chiave di
+cifratura impostati prima di importare l'applicazione.
+Esegui con: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="dadude-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TMP_DIR, 'dadude.db')}"
+os.environ.setdefault("ENCRYPTION_KEY", "dadude-test-encryption-key-0123456789")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def customer_service():
+    from app.services.customer_service import get_customer_service
+    return get_customer_service()
+
+
+@pytest.fixture
+def customer(customer_service):
+    from app.models.customer_schemas import CustomerCreate
+    code = f"T{uuid.uuid4().hex[:8].upper()}"
+    return customer_service.create_customer(CustomerCreate(code=code, name=f"Cliente {code}"))
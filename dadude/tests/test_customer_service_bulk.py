@@ -0,0 +1,56 @@
+"""Test dei getter bulk di CustomerService (una query per più ID)"""
+from app.models.customer_schemas import AgentAssignmentCreate, CredentialCreate, CredentialType
+
+
+def _create_credential(customer_service, customer, name):
+    return customer_service.create_credential(CredentialCreate(
+        customer_id=customer.id,
+        name=name,
+        credential_type=CredentialType.SSH,
+        username="admin",
+        password=f"pw-{name}",
+    ))
+
+
+def _create_agent(customer_service, customer, name):
+    return customer_service.create_agent(AgentAssignmentCreate(
+        customer_id=customer.id,
+        name=name,
+        address="192.0.2.1",
+        agent_type="mikrotik",
+        username="admin",
+        password=f"pw-{name}",
+    ))
+
+
+def test_get_credentials_bulk_keeps_order_and_skips_missing(customer_service, customer):
+    a = _create_credential(customer_service, customer, "cred-a")
+    b = _create_credential(customer_service, customer, "cred-b")
+
+    creds = customer_service.get_credentials_bulk([b.id, "missing", a.id, b.id])
+
+    assert [c.id for c in creds] == [b.id, a.id]
+    assert customer_service.get_credentials_bulk([]) == []
+
+
+def test_get_credentials_bulk_secrets(customer_service, customer):
+    a = _create_credential(customer_service, customer, "cred-secret")
+
+    (safe,) = customer_service.get_credentials_bulk([a.id])
+    (full,) = customer_service.get_credentials_bulk([a.id], include_secrets=True)
+
+    assert getattr(safe, "password", None) is None
+    assert full.password == "pw-cred-secret"
+
+
+def test_get_agents_bulk_keeps_order_and_password(customer_service, customer):
+    a = _create_agent(customer_service, customer, "agent-a")
+    b = _create_agent(customer_service, customer, "agent-b")
+
+    agents = customer_service.get_agents_bulk([b.id, a.id, "missing"])
+    assert [agent.id for agent in agents] == [b.id, a.id]
+    assert all(agent.password is None for agent in agents)
+
+    (with_password,) = customer_service.get_agents_bulk([a.id], include_password=True)
+    assert with_password.password == "pw-agent-a"
+    assert customer_service.get_agents_bulk([]) == []
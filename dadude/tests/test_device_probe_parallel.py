@@ -0,0 +1,93 @@
+"""Test di DeviceProbeService._try_credentials_parallel: priorità delle credenziali"""
+import asyncio
+
+import pytest
+
+from app.services.device_probe_service import DeviceProbeService, ProbeResult
+
+
+def _success(name):
+    return [ProbeResult(success=True, protocol="ssh", device_type="linux", hostname=f"host-{name}")]
+
+
+def _failure():
+    return [ProbeResult(success=False, protocol="ssh", error="auth failed")]
+
+
+@pytest.fixture
+def probe_service(monkeypatch):
+    """Servizio con _probe_credential simulato: (ritardo, esito) per nome credenziale"""
+    service = DeviceProbeService()
+    service.outcomes = {}
+    service.started = []
+
+    async def fake_probe_credential(address, creds, cred_name, available_protocols):
+        service.started.append(cred_name)
+        delay, outcome = service.outcomes[cred_name]
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(service, "_probe_credential", fake_probe_credential)
+    return service
+
+
+def _run(service, names):
+    result = {"available_protocols": ["ssh"], "probe_results": []}
+    credentials = [{"name": name} for name in names]
+    asyncio.run(service._try_credentials_parallel("10.0.0.1", credentials, result))
+    return result
+
+
+def test_first_credential_in_order_wins_over_faster_one(probe_service):
+    probe_service.outcomes = {
+        "assigned": (0.05, _success("assigned")),
+        "fallback": (0.0, _success("fallback")),
+    }
+
+    result = _run(probe_service, ["assigned", "fallback"])
+
+    assert result["credential_used"] == "assigned"
+    assert result["hostname"] == "host-assigned"
+
+
+def test_failed_and_raising_credentials_fall_through(probe_service):
+    probe_service.outcomes = {
+        "wrong": (0.0, _failure()),
+        "broken": (0.0, RuntimeError("timeout")),
+        "right": (0.01, _success("right")),
+    }
+
+    result = _run(probe_service, ["wrong", "broken", "right"])
+
+    assert result["credential_used"] == "right"
+    assert [p["success"] for p in result["probe_results"]] == [False, True]
+
+
+def test_queued_probes_cancelled_after_success(probe_service, monkeypatch):
+    monkeypatch.setattr(probe_service, "MAX_PARALLEL_CREDENTIALS", 1)
+    probe_service.outcomes = {
+        "first": (0.0, _success("first")),
+        "second": (0.0, _success("second")),
+        "third": (0.0, _success("third")),
+    }
+
+    result = _run(probe_service, ["first", "second", "third"])
+
+    assert result["credential_used"] == "first"
+    # "second" può partire al rilascio del semaphore, ma viene annullato e non conta
+    assert "third" not in probe_service.started
+    assert [p["hostname"] for p in result["probe_results"]] == ["host-first"]
+
+
+def test_no_credential_identifies(probe_service):
+    probe_service.outcomes = {
+        "a": (0.0, _failure()),
+        "b": (0.0, _failure()),
+    }
+
+    result = _run(probe_service, ["a", "b"])
+
+    assert "credential_used" not in result
+    assert len(result["probe_results"]) == 2
@@ -0,0 +1,104 @@
+"""Test di TTLCache: scadenza, LRU e get_or_set single-flight"""
+import asyncio
+
+import pytest
+
+from app.utils import ttl_cache
+from app.utils.ttl_cache import TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_get_set_and_expiry(clock):
+    cache = TTLCache(maxsize=10, ttl=30)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    clock.now += 29
+    assert cache.get("a") == 1
+
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+
+
+def test_maxsize_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_pop_and_clear(clock):
+    cache = TTLCache(maxsize=10, ttl=30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_get_or_set_single_flight():
+    cache = TTLCache(maxsize=10, ttl=30)
+    calls = 0
+
+    async def factory():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_set("key", factory) for _ in range(10)))
+
+    assert asyncio.run(run()) == ["value"] * 10
+    assert calls == 1
+
+
+def test_get_or_set_recomputes_after_expiry(clock):
+    cache = TTLCache(maxsize=10, ttl=30)
+    values = iter([1, 2])
+
+    async def factory():
+        return next(values)
+
+    assert asyncio.run(cache.get_or_set("key", factory)) == 1
+    assert asyncio.run(cache.get_or_set("key", factory)) == 1
+    clock.now += 31
+    assert asyncio.run(cache.get_or_set("key", factory)) == 2
+
+
+def test_get_or_set_does_not_cache_exceptions():
+    cache = TTLCache(maxsize=10, ttl=30)
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def working():
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_or_set("key", failing))
+    assert asyncio.run(cache.get_or_set("key", working)) == "ok"